@@ -1,5 +1,5 @@
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtCore import Qt, QThread, QSize, QTimer, QPointF, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap, QIcon, QPainter, QColor
 
 # ---- PyQt6 enum 快捷別名 ----
 Align = Qt.AlignmentFlag
@@ -10,13 +10,1111 @@ Fmt = QImage.Format
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton,
     QVBoxLayout, QHBoxLayout, QGroupBox, QFileDialog, QSlider,
-    QComboBox, QFormLayout, QMessageBox
+    QComboBox, QFormLayout, QMessageBox, QInputDialog,
+    QListWidget, QListWidgetItem, QListView, QCheckBox,
+    QDialog, QDialogButtonBox, QSpinBox, QLineEdit, QProgressBar, QTabBar,
+    QGridLayout, QToolButton
 )
 
 import sys
+import os
+import math
+import socket
+import time
+import queue
+import itertools
+import threading
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait as wait_connections
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from PIL import Image
-import io
+
+from svd_engine import (
+    BLOCK_SIZES, BlockSVD, EXPORT_FORMATS, FactorCache, GEOMETRIC_TRANSFORMS,
+    HEATMAP_MAX_ERROR, HEATMAP_TAIL, IMAGE_EXTENSIONS, JOINT_MODE, JPEG_SUBSAMPLING,
+    JointColorSVD, ProgressiveStreamDecoder, SIZE_TOLERANCE, STREAM_READ_SIZE, SizeModel,
+    TEMPLATES, build_parser, calculate_psnr, channel_energies, decode_image,
+    decode_preview, decompose_image, estimate_state_nbytes, export_rank, factors_max_rank,
+    heatmap_overlay, image_state_nbytes, nearest_indices, preview_needs_full_decode,
+    rank_for_ratio, rank_for_size, reconstruct_channel, reconstruct_from_factors,
+    reconstruct_region, render_rank_series, residual_energy_map, shrink_array, timed_svd,
+    transform_image
+)
+
+
+class SizeModelThread(QThread):
+    """在背景建立或補齊 SizeModel 的探測點，並完整編碼 rank k 校正（k = 0 時只探測）"""
+
+    ready = pyqtSignal(object, int, int)   # model, k, 實測位元組
+
+    def __init__(self, model, factors, k, frame=None, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.factors = factors
+        self.k = k
+        self.frame = frame
+
+    def run(self):
+        if not self.model.measured:
+            # 滿 rank 就是原圖，先編碼一次當作另一端的校正點
+            self.model.measure(self.factors, self.model.full_rank, self.model.original)
+        self.model.probe(self.factors)
+        size = self.model.measure(self.factors, self.k, self.frame) if self.k else 0
+        self.ready.emit(self.model, self.k, size)
+
+
+class ExportThread(QThread):
+    """在背景重建並編碼一或多個 rank；多個 rank 以執行緒平行處理
+
+    numpy 的矩陣乘法與 Pillow 的 zlib / libjpeg / libwebp 編碼都會
+    釋放 GIL，所以執行緒就能用上多核心。
+    """
+
+    progress = pyqtSignal(int, int)   # 已完成, 總數
+    exported = pyqtSignal(object)     # [(k, 路徑, 位元組, 編碼毫秒), ...]
+    failed = pyqtSignal(str)
+
+    def __init__(self, factors, jobs, fmt, options, frames=None, original=None, parent=None,
+                 render=None):
+        super().__init__(parent)
+        self.factors = factors
+        self.original = original
+        self.jobs = jobs          # [(k, 路徑), ...]
+        self.fmt = fmt
+        self.options = options
+        self.frames = frames or {}  # 已經重建好的 k → 影像
+        self.render = render        # k → 影像，取代以因子重建（分塊模式）
+
+    def frame(self, k):
+        if k in self.frames:
+            return self.frames[k]
+        return self.render(k) if self.render is not None else None
+
+    def run(self):
+        results = []
+        try:
+            workers = min(len(self.jobs), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(lambda k, path: export_rank(
+                        self.factors, k, self.fmt, self.options, path, self.frame(k),
+                        self.original), k, path)
+                    for k, path in self.jobs
+                ]
+                for done, future in enumerate(as_completed(futures), 1):
+                    results.append(future.result())
+                    self.progress.emit(done, len(self.jobs))
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.exported.emit(sorted(results))
+
+
+def parse_ranks(text):
+    """解析以逗號分隔的 k 列表（全形逗號亦可），無效時回傳空列表"""
+    try:
+        ranks = [int(part) for part in text.replace("，", ",").split(",") if part.strip()]
+    except ValueError:
+        return []
+    return [k for k in ranks if k > 0]
+
+
+class ExportDialog(QDialog):
+    """選擇輸出格式、編碼參數與要匯出的 rank"""
+
+    def __init__(self, k, fmt="png", parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("匯出壓縮圖片")
+        layout = QFormLayout(self)
+
+        self.format_combo = QComboBox()
+        for code, (name, _, _) in EXPORT_FORMATS.items():
+            self.format_combo.addItem(name, code)
+        self.format_combo.setCurrentIndex(list(EXPORT_FORMATS).index(fmt))
+        self.format_combo.currentIndexChanged.connect(self.update_enabled)
+        layout.addRow("格式：", self.format_combo)
+
+        self.level_spin = QSpinBox()
+        self.level_spin.setRange(0, 9)
+        self.level_spin.setValue(6)
+        layout.addRow("PNG 壓縮等級：", self.level_spin)
+
+        self.quality_spin = QSpinBox()
+        self.quality_spin.setRange(1, 100)
+        self.quality_spin.setValue(90)
+        layout.addRow("JPEG / WebP 品質：", self.quality_spin)
+
+        self.subsampling_combo = QComboBox()
+        self.subsampling_combo.addItems(list(JPEG_SUBSAMPLING))
+        self.subsampling_combo.setCurrentText("4:2:0")
+        layout.addRow("JPEG 色度抽樣：", self.subsampling_combo)
+
+        self.optimize_check = QCheckBox("最佳化（較慢、較小）")
+        self.progressive_check = QCheckBox("JPEG 漸進式")
+        self.lossless_check = QCheckBox("WebP 無損")
+        layout.addRow(self.optimize_check)
+        layout.addRow(self.progressive_check)
+        layout.addRow(self.lossless_check)
+
+        self.max_error_spin = QSpinBox()
+        self.max_error_spin.setRange(0, 127)
+        self.max_error_spin.setValue(2)
+        self.max_error_spin.setToolTip("0 為無失真；基底 rank 由編碼器自動選擇")
+        layout.addRow("SVDR 每像素最大誤差：", self.max_error_spin)
+
+        self.ranks_edit = QLineEdit(str(k))
+        self.ranks_edit.setPlaceholderText("例如：50, 100, 200")
+        layout.addRow("匯出的 k（可多個）：", self.ranks_edit)
+
+        buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.update_enabled()
+
+    def update_enabled(self):
+        fmt = self.format()
+        self.level_spin.setEnabled(fmt == "png")
+        self.quality_spin.setEnabled(fmt in ("jpeg", "webp"))
+        self.subsampling_combo.setEnabled(fmt == "jpeg")
+        self.optimize_check.setEnabled(fmt in ("png", "jpeg"))
+        self.progressive_check.setEnabled(fmt == "jpeg")
+        self.lossless_check.setEnabled(fmt == "webp")
+        self.max_error_spin.setEnabled(fmt == "svdr")
+        self.ranks_edit.setEnabled(fmt != "svdr")
+
+    def format(self):
+        return self.format_combo.currentData()
+
+    def options(self):
+        return {
+            "level": self.level_spin.value(),
+            "quality": self.quality_spin.value(),
+            "subsampling": self.subsampling_combo.currentText(),
+            "optimize": self.optimize_check.isChecked(),
+            "progressive": self.progressive_check.isChecked(),
+            "lossless": self.lossless_check.isChecked(),
+            "max_error": self.max_error_spin.value(),
+        }
+
+    def ranks(self):
+        return parse_ranks(self.ranks_edit.text())
+
+
+# 比較格的縮圖邊長上限與預設格數
+COMPARE_THUMBNAIL = 240
+COMPARE_COUNT = 8
+
+
+class RankComparisonDialog(QDialog):
+    """小倍數比較：同一張圖片在多個 rank 的縮圖排成一格，點選即套用該 rank
+
+    render(ranks) 回傳 [(k, 縮圖, 說明文字), ...]；改了 k 列表按「更新」重畫。
+    """
+
+    rank_chosen = pyqtSignal(int)
+
+    def __init__(self, ranks, render, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("比較不同 rank")
+        self.render = render
+        layout = QVBoxLayout(self)
+
+        controls = QHBoxLayout()
+        self.ranks_edit = QLineEdit(", ".join(map(str, ranks)))
+        self.ranks_edit.setPlaceholderText("例如：5, 20, 50, 100")
+        refresh_btn = QPushButton("更新")
+        refresh_btn.clicked.connect(self.refresh)
+        self.ranks_edit.returnPressed.connect(self.refresh)
+        controls.addWidget(QLabel("k："))
+        controls.addWidget(self.ranks_edit)
+        controls.addWidget(refresh_btn)
+        layout.addLayout(controls)
+
+        self.grid = QGridLayout()
+        layout.addLayout(self.grid)
+        self.timing_label = QLabel()
+        self.timing_label.setStyleSheet("font-size: 12px; color: #7f8c8d;")
+        layout.addWidget(self.timing_label)
+        self.refresh()
+
+    def ranks(self):
+        return parse_ranks(self.ranks_edit.text())
+
+    def refresh(self):
+        while self.grid.count():
+            self.grid.takeAt(0).widget().deleteLater()
+        ranks = self.ranks()
+        if not ranks:
+            self.timing_label.setText("請輸入要比較的 k")
+            return
+        start = time.perf_counter()
+        tiles = self.render(ranks)
+        elapsed = (time.perf_counter() - start) * 1000
+        columns = math.ceil(math.sqrt(len(tiles)))
+        for i, (k, thumbnail, caption) in enumerate(tiles):
+            button = QToolButton()
+            pixmap = QPixmap.fromImage(array_to_qimage(thumbnail))
+            button.setIcon(QIcon(pixmap))
+            button.setIconSize(pixmap.size())
+            button.setText(caption)
+            button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextUnderIcon)
+            button.clicked.connect(lambda _, k=k: self.choose(k))
+            self.grid.addWidget(button, i // columns, i % columns)
+        self.timing_label.setText(f"{len(tiles)} 個 rank 一次畫完：{elapsed:.0f} ms")
+
+    def choose(self, k):
+        self.rank_chosen.emit(k)
+        self.accept()
+
+
+class StreamReaderThread(QThread):
+    """在背景讀取漸進式串流（本機檔案或 socket）並逐段解碼"""
+
+    # 影像、已收位元組、總位元組、目前 rank
+    frame_ready = pyqtSignal(object, int, int, int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        # source 為檔案路徑，或 (host, port)
+        self.source = source
+
+    def run(self):
+        decoder = ProgressiveStreamDecoder()
+        try:
+            if isinstance(self.source, tuple):
+                stream = socket.create_connection(self.source, timeout=10)
+                read = stream.recv
+            else:
+                stream = open(self.source, "rb")
+                read = stream.read
+
+            with stream:
+                while not self.isInterruptionRequested() and not decoder.finished:
+                    data = read(STREAM_READ_SIZE)
+                    if not data:
+                        break
+                    if decoder.feed(data):
+                        self.frame_ready.emit(
+                            decoder.image(), decoder.bytes_received,
+                            decoder.total_bytes, decoder.rank
+                        )
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+
+
+# ==================== 多行程運算後端 ====================
+#
+# 選用。因子與原圖複製到 multiprocessing.shared_memory，各計算行程
+# 直接映射同一份資料，負責部分通道的重建並把結果寫進共用的 uint8
+# 畫面緩衝區（兩個輪流使用），GUI 只需映射該緩衝區並繪圖。
+
+COMPUTE_WORKERS = 3
+
+
+class SharedArrays:
+    """一組放在共享記憶體裡的 numpy 陣列"""
+
+    def __init__(self, arrays):
+        # arrays：名稱 → ndarray（複製進去）或 (shape, dtype)（只配置）
+        self.segments = {}
+        self.arrays = {}
+        for name, spec in arrays.items():
+            shape, dtype = (spec.shape, spec.dtype) if isinstance(spec, np.ndarray) else spec
+            dtype = np.dtype(dtype)
+            size = max(1, int(np.prod(shape)) * dtype.itemsize)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            view = np.ndarray(shape, dtype, buffer=shm.buf)
+            if isinstance(spec, np.ndarray):
+                view[...] = spec
+            self.segments[name] = shm
+            self.arrays[name] = view
+
+    def layout(self):
+        """給其他行程 attach 用的描述：名稱 → (區段名稱, shape, dtype)"""
+        return {
+            name: (self.segments[name].name, arr.shape, arr.dtype.str)
+            for name, arr in self.arrays.items()
+        }
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in self.segments.values())
+
+    def close(self):
+        """釋放並刪除所有區段（呼叫前須先放掉外部的 view）"""
+        self.arrays.clear()
+        for shm in self.segments.values():
+            shm.close()
+            shm.unlink()
+        self.segments.clear()
+
+
+def attach_shared_arrays(layout):
+    """在計算行程中映射 SharedArrays.layout() 描述的陣列"""
+    segments, arrays = [], {}
+    for name, (segment, shape, dtype) in layout.items():
+        try:
+            shm = shared_memory.SharedMemory(name=segment, track=False)
+        except TypeError:
+            # Python 3.13 以前沒有 track 參數；spawn 出來的行程與主行程共用
+            # resource_tracker，重複登記不影響，區段仍由主行程 unlink
+            shm = shared_memory.SharedMemory(name=segment)
+        segments.append(shm)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+    return segments, arrays
+
+
+def compute_worker_main(commands, results):
+    """計算行程：依指令重建指定通道到共用畫面緩衝區，回傳平方誤差和"""
+    segments, arrays = [], {}
+
+    def detach():
+        arrays.clear()
+        for shm in segments:
+            shm.close()
+        segments.clear()
+
+    try:
+        while True:
+            message = commands.recv()
+            if message[0] == "stop":
+                break
+            if message[0] == "attach":
+                detach()
+                new_segments, new_arrays = attach_shared_arrays(message[1])
+                segments.extend(new_segments)
+                arrays.update(new_arrays)
+            elif message[0] == "render":
+                _, request_id, k, buffer, channel_ids = message
+                start = time.perf_counter()
+                frame = arrays[f"frame{buffer}"]
+                original = arrays["original"]
+                sse = 0
+                for c in channel_ids:
+                    U, S, Vt = arrays[f"U{c}"], arrays[f"S{c}"], arrays[f"Vt{c}"]
+                    np.clip(reconstruct_channel(U, S, Vt, min(k, len(S))), 0, 255,
+                            out=frame[:, :, c], casting="unsafe")
+                    diff = original[:, :, c].astype(np.int16) - frame[:, :, c]
+                    sse += int(np.sum(np.square(diff, dtype=np.int32), dtype=np.int64))
+                results.send(("done", request_id, sse, time.perf_counter() - start))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        detach()
+
+
+class ComputeBackend(QThread):
+    """多行程運算後端：管理計算行程、共享記憶體區段與結果收集
+
+    run() 在背景等候各行程的結果，湊齊一張畫面後送出 frame_ready；
+    行程意外結束時自動重啟、重新 attach，並補送進行中的工作。
+    拖動滑桿時若前一張還沒算完，只保留最新的 k。
+    """
+
+    frame_ready = pyqtSignal(int, int, float)  # 緩衝區編號, k, PSNR
+    worker_restarted = pyqtSignal(int)
+
+    def __init__(self, workers=COMPUTE_WORKERS, parent=None):
+        super().__init__(parent)
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.workers = [None] * workers  # (行程, 指令端, 結果端)
+        self.store = None
+        self.layout = None
+        self.published = []
+        self.n_channels = 0
+        self.request_id = 0
+        self.in_flight = None
+        self.queued_k = None
+        for i in range(workers):
+            self.spawn(i)
+
+    def spawn(self, i):
+        command_recv, command_send = self.context.Pipe(duplex=False)
+        result_recv, result_send = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=compute_worker_main, args=(command_recv, result_send), daemon=True
+        )
+        process.start()
+        command_recv.close()
+        result_send.close()
+        self.workers[i] = (process, command_send, result_recv)
+        if self.layout is not None:
+            command_send.send(("attach", self.layout))
+
+    @property
+    def frames(self):
+        return [self.store.arrays["frame0"], self.store.arrays["frame1"]]
+
+    def is_published(self, factors):
+        """目前共享記憶體中的是否就是這組因子"""
+        return len(factors) == len(self.published) and all(
+            ref() is U for ref, (U, _, _) in zip(self.published, factors)
+        )
+
+    def publish(self, factors, original):
+        """把新的因子與原圖放進共享記憶體，並釋放舊的區段"""
+        arrays = {"original": original}
+        for c, (U, S, Vt) in enumerate(factors):
+            arrays[f"U{c}"], arrays[f"S{c}"], arrays[f"Vt{c}"] = U, S, Vt
+        arrays["frame0"] = arrays["frame1"] = (original.shape, np.uint8)
+        store = SharedArrays(arrays)
+
+        with self.lock:
+            old, self.store = self.store, store
+            self.layout = store.layout()
+            self.published = [weakref.ref(U) for U, _, _ in factors]
+            self.n_channels = len(factors)
+            self.in_flight = None
+            self.queued_k = None
+            for _, commands, _ in self.workers:
+                commands.send(("attach", self.layout))
+        if old is not None:
+            old.close()
+
+    def render(self, k):
+        """要求重建 rank k；前一張還在算時只記下最新的 k"""
+        with self.lock:
+            if self.in_flight is not None:
+                self.queued_k = k
+            else:
+                self.send_render(k)
+
+    def send_render(self, k):
+        self.request_id += 1
+        job = {"id": self.request_id, "k": k, "buffer": self.request_id % 2,
+               "waiting": set(), "sse": 0}
+        for i in range(len(self.workers)):
+            if self.send_job(i, job):
+                job["waiting"].add(i)
+        self.in_flight = job
+
+    def send_job(self, i, job):
+        """把 job 中屬於第 i 個行程的通道送出，沒有分到通道則回傳 False"""
+        channel_ids = list(range(i, self.n_channels, len(self.workers)))
+        if channel_ids:
+            self.workers[i][1].send(("render", job["id"], job["k"], job["buffer"], channel_ids))
+        return bool(channel_ids)
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            with self.lock:
+                watched = {}
+                for i, (process, _, results) in enumerate(self.workers):
+                    watched[results] = i
+                    watched[process.sentinel] = i
+            for ready in wait_connections(list(watched), timeout=0.1):
+                i = watched[ready]
+                if isinstance(ready, int):
+                    self.restart(i)
+                    continue
+                try:
+                    message = ready.recv()
+                except (EOFError, OSError):
+                    self.restart(i)
+                    continue
+                self.collect(i, message)
+
+    def collect(self, i, message):
+        _, request_id, sse, _ = message
+        with self.lock:
+            job = self.in_flight
+            if job is None or job["id"] != request_id:
+                return
+            job["waiting"].discard(i)
+            job["sse"] += sse
+            if job["waiting"]:
+                return
+            self.in_flight = None
+            if self.queued_k is not None:
+                k, self.queued_k = self.queued_k, None
+                self.send_render(k)
+            height, width = self.store.arrays["original"].shape[:2]
+
+        mse = job["sse"] / (height * width * self.n_channels)
+        psnr = float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+        self.frame_ready.emit(job["buffer"], job["k"], psnr)
+
+    def restart(self, i):
+        """重啟意外結束的行程，並補送它負責的進行中工作"""
+        with self.lock:
+            process, commands, results = self.workers[i]
+            if process.is_alive() and not results.closed:
+                return
+            process.join(timeout=1)
+            commands.close()
+            results.close()
+            self.spawn(i)
+            if self.in_flight is not None and i in self.in_flight["waiting"]:
+                self.send_job(i, self.in_flight)
+        self.worker_restarted.emit(i)
+
+    def shutdown(self):
+        """停止所有行程並刪除共享記憶體區段"""
+        self.requestInterruption()
+        self.wait()
+        with self.lock:
+            for process, commands, results in self.workers:
+                try:
+                    commands.send(("stop",))
+                except OSError:
+                    pass
+            for process, commands, results in self.workers:
+                process.join(timeout=2)
+                if process.is_alive():
+                    process.terminate()
+                commands.close()
+                results.close()
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+
+
+class RankExtensionThread(QThread):
+    """在背景把各通道的三元組延伸到目標 rank"""
+
+    extended = pyqtSignal(int)
+
+    def __init__(self, channels, target, parent=None):
+        super().__init__(parent)
+        self.channels = channels
+        self.target = target
+
+    def run(self):
+        for channel in self.channels:
+            channel.extend(self.target)
+        self.extended.emit(self.target)
+
+
+class BlockSVDThread(QThread):
+    """在背景做分塊 SVD"""
+
+    decomposed = pyqtSignal(object, object)  # 原圖, BlockSVD
+
+    def __init__(self, img_array, size, parent=None):
+        super().__init__(parent)
+        self.img_array = img_array
+        self.size = size
+
+    def run(self):
+        self.decomposed.emit(self.img_array, BlockSVD(self.img_array, self.size))
+
+
+class JointColorThread(QThread):
+    """在背景做聯合色彩分解，並計時逐通道 SVD 當比較基準"""
+
+    decomposed = pyqtSignal(object, object, object)  # 原圖, JointColorSVD, (各通道奇異值, 秒)
+
+    def __init__(self, img_array, parent=None):
+        super().__init__(parent)
+        self.img_array = img_array
+
+    def run(self):
+        joint = JointColorSVD(self.img_array)
+        values, seconds = [], 0.0
+        for c in range(self.img_array.shape[2]):
+            (_, S, _), elapsed = timed_svd(self.img_array[:, :, c].astype(float))
+            values.append(S)
+            seconds += elapsed
+        self.decomposed.emit(self.img_array, joint, (values, seconds))
+
+
+# 預先分解目前圖片之後的幾張
+PREFETCH_COUNT = 3
+# 已分解圖片快取的記憶體上限
+CACHE_MEMORY_MB = 1024
+THUMBNAIL_SIZE = (96, 72)
+# 先以約略標籤大小的縮小版分解，完整解析度之後在背景補上
+PREVIEW_SIZE = (600, 500)
+
+
+class PrefetchThread(QThread):
+    """背景工作：產生縮圖，並預先解碼、分解佇列中接下來的圖片"""
+
+    thumbnail_ready = pyqtSignal(str, object)          # 路徑, QImage
+    previewed = pyqtSignal(str, object, object)        # 路徑, 縮小版, 原始 (寬, 高)
+    decomposed = pyqtSignal(str, object, object)       # 路徑, 原圖, 各通道 ChannelSVD
+    failed = pyqtSignal(str, str)
+
+    # 數字越小越先處理；OPEN 是還沒有預覽的目前圖片，解碼後先送出縮小版
+    OPEN, CURRENT, DECOMPOSE, THUMBNAIL = 0, 1, 2, 3
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tasks = queue.PriorityQueue()
+        self.order = itertools.count()
+
+    def submit(self, kind, path):
+        self.tasks.put((kind, next(self.order), path))
+
+    def stop(self):
+        self.tasks.put((-1, -1, None))
+        self.wait()
+
+    def run(self):
+        while True:
+            kind, _, path = self.tasks.get()
+            if path is None:
+                return
+            try:
+                if kind == self.THUMBNAIL:
+                    self.thumbnail_ready.emit(path, self.make_thumbnail(path))
+                else:
+                    img_array = decode_image(path)
+                    height, width = img_array.shape[:2]
+                    if kind == self.OPEN and (width > PREVIEW_SIZE[0] or height > PREVIEW_SIZE[1]):
+                        self.previewed.emit(path, shrink_array(img_array, PREVIEW_SIZE),
+                                            (width, height))
+                    self.decomposed.emit(path, img_array, decompose_image(img_array))
+            except Exception as e:
+                self.failed.emit(path, str(e))
+
+    @staticmethod
+    def make_thumbnail(path):
+        img = Image.open(path)
+        img.draft("RGB", (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        img = img.convert("RGB")
+        img.thumbnail(THUMBNAIL_SIZE)
+        data = img.tobytes()
+        return QImage(data, img.width, img.height, 3 * img.width, Fmt.Format_RGB888).copy()
+
+
+def array_to_qimage(img_array):
+    """(高, 寬[, 通道]) uint8 陣列 → QImage，單通道用 Format_Grayscale8
+
+    QImage 直接引用陣列的記憶體，需要保留時呼叫端要 copy()。
+    """
+    height, width = img_array.shape[:2]
+    if img_array.ndim == 2 or img_array.shape[2] == 1:
+        return QImage(img_array.data, width, height, width, Fmt.Format_Grayscale8)
+    return QImage(img_array.data, width, height, 3 * width, Fmt.Format_RGB888)
+
+
+# 縮放檢視：圖塊邊長（螢幕像素）、快取圖塊數、最大倍率
+VIEWPORT_TILE = 256
+VIEWPORT_TILE_CACHE = 64
+MAX_ZOOM = 8.0
+
+
+class ZoomableLabel(QLabel):
+    """可縮放、平移的壓縮預覽
+
+    全圖時和一般 QLabel 一樣顯示縮好的 pixmap；放大後只重建畫面上
+    看得到的列與欄（以圖塊為單位，最近鄰取樣到螢幕大小），
+    成本和原圖解析度無關。周圍一圈圖塊會在閒置時先算好放進快取。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.factors = None
+        self.k = 0
+        self.zoom = None          # None 表示全圖
+        self.center = (0.0, 0.0)  # 畫面中心對應的原圖座標 (x, y)
+        self.drag_origin = None
+        self.tiles = OrderedDict()
+        self.ring = []
+        self.ring_timer = QTimer(self)
+        self.ring_timer.setInterval(0)
+        self.ring_timer.timeout.connect(self.prefetch_ring_tile)
+
+    def set_source(self, factors, k):
+        """設定要重建的因子與 rank；factors 為 None 時停用縮放"""
+        same = (
+            factors is not None and self.factors is not None
+            and k == self.k
+            and all(a[0] is b[0] and a[2] is b[2] for a, b in zip(factors, self.factors))
+        )
+        if same:
+            return
+        if factors is None or self.factors is None or \
+                factors[0][0].shape[0] != self.factors[0][0].shape[0] or \
+                factors[0][2].shape[1] != self.factors[0][2].shape[1]:
+            self.zoom = None
+        self.factors = factors
+        self.k = k
+        self.tiles.clear()
+        if self.zoom is not None:
+            self.update()
+
+    def image_size(self):
+        return self.factors[0][2].shape[1], self.factors[0][0].shape[0]
+
+    def fit_zoom(self):
+        width, height = self.image_size()
+        return min(self.width() / width, self.height() / height)
+
+    def reset_view(self):
+        """回到全圖"""
+        self.zoom = None
+        self.ring_timer.stop()
+        self.update()
+
+    def clamp_center(self):
+        """讓畫面不要移出圖片範圍"""
+        width, height = self.image_size()
+        half_w = self.width() / 2 / self.zoom
+        half_h = self.height() / 2 / self.zoom
+        x, y = self.center
+        x = width / 2 if half_w * 2 >= width else min(max(x, half_w), width - half_w)
+        y = height / 2 if half_h * 2 >= height else min(max(y, half_h), height - half_h)
+        self.center = (x, y)
+
+    def wheelEvent(self, event):
+        if self.factors is None:
+            return super().wheelEvent(event)
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            return
+        fit = self.fit_zoom()
+        zoom = self.zoom or fit
+        new_zoom = min(MAX_ZOOM, zoom * 1.25 ** steps)
+        if new_zoom <= fit:
+            self.reset_view()
+            return
+
+        # 讓游標下的點保持不動
+        if self.zoom is None:
+            width, height = self.image_size()
+            self.center = (width / 2, height / 2)
+        pos = event.position()
+        dx, dy = pos.x() - self.width() / 2, pos.y() - self.height() / 2
+        x = self.center[0] + dx / zoom
+        y = self.center[1] + dy / zoom
+        self.zoom = new_zoom
+        self.center = (x - dx / new_zoom, y - dy / new_zoom)
+        self.clamp_center()
+        self.update()
+
+    def mousePressEvent(self, event):
+        if self.zoom is not None:
+            self.drag_origin = (event.position(), self.center)
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_origin is not None:
+            start, (x, y) = self.drag_origin
+            delta = event.position() - start
+            self.center = (x - delta.x() / self.zoom, y - delta.y() / self.zoom)
+            self.clamp_center()
+            self.update()
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        self.drag_origin = None
+        super().mouseReleaseEvent(event)
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset_view()
+
+    def visible_tiles(self, margin=0):
+        """畫面（外加 margin 圈）涵蓋的圖塊 (tx, ty) 與畫面左上角的畫布座標"""
+        width, height = self.image_size()
+        left = self.center[0] * self.zoom - self.width() / 2
+        top = self.center[1] * self.zoom - self.height() / 2
+        n_x = math.ceil(width * self.zoom / VIEWPORT_TILE)
+        n_y = math.ceil(height * self.zoom / VIEWPORT_TILE)
+        tx0 = max(0, math.floor(left / VIEWPORT_TILE) - margin)
+        ty0 = max(0, math.floor(top / VIEWPORT_TILE) - margin)
+        tx1 = min(n_x - 1, math.floor((left + self.width()) / VIEWPORT_TILE) + margin)
+        ty1 = min(n_y - 1, math.floor((top + self.height()) / VIEWPORT_TILE) + margin)
+        tiles = [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+        return tiles, left, top
+
+    def tile(self, tx, ty):
+        """取得（或重建）一個圖塊"""
+        key = (self.zoom, tx, ty)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        width, height = self.image_size()
+        x0, y0 = tx * VIEWPORT_TILE, ty * VIEWPORT_TILE
+        x1 = min(x0 + VIEWPORT_TILE, math.ceil(width * self.zoom))
+        y1 = min(y0 + VIEWPORT_TILE, math.ceil(height * self.zoom))
+        cols = np.minimum(((np.arange(x0, x1) + 0.5) / self.zoom).astype(int), width - 1)
+        rows = np.minimum(((np.arange(y0, y1) + 0.5) / self.zoom).astype(int), height - 1)
+
+        region = reconstruct_region(self.factors, self.k, rows, cols)
+        image = array_to_qimage(region).copy()
+        self.tiles[key] = image
+        if len(self.tiles) > VIEWPORT_TILE_CACHE:
+            self.tiles.popitem(last=False)
+        return image
+
+    def prefetch_ring_tile(self):
+        """閒置時每次補算一個周圍的圖塊"""
+        while self.ring:
+            tx, ty = self.ring.pop()
+            if (self.zoom, tx, ty) not in self.tiles:
+                self.tile(tx, ty)
+                return
+        self.ring_timer.stop()
+
+    def paintEvent(self, event):
+        if self.zoom is None or self.factors is None:
+            return super().paintEvent(event)
+
+        super().paintEvent(event)
+        painter = QPainter(self)
+        area = self.contentsRect()
+        painter.setClipRect(area)
+        painter.fillRect(area, QColor("#e8f4f8"))
+
+        tiles, left, top = self.visible_tiles()
+        for tx, ty in tiles:
+            painter.drawImage(
+                QPointF(tx * VIEWPORT_TILE - left, ty * VIEWPORT_TILE - top),
+                self.tile(tx, ty)
+            )
+        painter.drawText(area.adjusted(8, 4, -8, -4),
+                         Align.AlignRight | Align.AlignTop,
+                         f"{self.zoom * 100:.0f}%")
+        painter.end()
+
+        # 周圍一圈先算好，平移時不必等
+        visible = set(tiles)
+        self.ring = [t for t in self.visible_tiles(margin=1)[0] if t not in visible]
+        self.ring_timer.start()
+
+
+# 拖動預取：往前預先重建的 k 數、保留的畫面數、停止拖動多久後補算完整解析度
+SCRUB_AHEAD = 4
+SCRUB_CACHE = 16
+SCRUB_IDLE_MS = 150
+
+
+class ScrubPrefetcher(QThread):
+    """拖動比例滑桿時，依方向與速度在背景先重建接下來幾個 k
+
+    只重建顯示解析度（最近鄰取樣到 label 大小），命中時直接換 pixmap；
+    PSNR 用 Eckart-Young 由原圖能量與前 k 個奇異值估計，不必重建完整解析度。
+    方向改變或有實際工作時，清掉尚未開始的預測。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cond = threading.Condition()
+        self.jobs = deque()
+        self.frames = OrderedDict()   # k → (顯示解析度畫面, 估計 PSNR)
+        self.source = None            # (因子, 列索引, 欄索引, 原圖)
+        self.key = None
+        self.energy = None            # 各通道原圖的平方和
+        self.sampled = None           # (因子, 取樣後的 float32 因子)
+        self.events = deque(maxlen=5) # 最近的滑桿值
+        self.direction = 0
+        self.hits = 0
+        self.misses = 0
+        self.stopped = False
+
+    def set_source(self, key, factors, rows, cols, original):
+        """換圖片或 label 大小（key 不同）時清空；否則只更新因子（延伸後的）"""
+        with self.cond:
+            if key != self.key:
+                self.key = key
+                self.jobs.clear()
+                self.frames.clear()
+                self.events.clear()
+                self.energy = None
+                self.sampled = None
+            self.source = (factors, rows, cols, original)
+
+    def take(self, k):
+        """取出預先算好的畫面，沒有則回傳 None；計入命中率"""
+        with self.cond:
+            frame = self.frames.get(k)
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.frames.move_to_end(k)
+            return frame
+
+    def cancel(self):
+        """有實際工作要做：清掉尚未開始的預測"""
+        with self.cond:
+            self.jobs.clear()
+
+    def observe(self, value, rank_of, max_rank):
+        """記下一次滑桿值，依方向與每次的步幅預測接下來的 k"""
+        with self.cond:
+            if self.source is None:
+                return
+            self.events.append(value)
+            if len(self.events) < 2:
+                return
+            steps = np.diff(self.events)
+            direction = int(np.sign(steps[-1]))
+            if direction != self.direction:
+                self.jobs.clear()
+                self.direction = direction
+            if direction == 0:
+                return
+            step = max(1, int(np.median(np.abs(steps[steps * direction > 0]))))
+            self.jobs.clear()
+            for i in range(1, SCRUB_AHEAD + 1):
+                k = rank_of(value + direction * step * i)
+                if 1 <= k <= max_rank and k not in self.frames and k not in self.jobs:
+                    self.jobs.append(k)
+            self.cond.notify()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def nbytes(self):
+        with self.cond:
+            return sum(frame.nbytes for frame, _ in self.frames.values())
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.wait()
+
+    def render(self, k):
+        """重建 rank k 的顯示解析度畫面並估計 PSNR；因子不足時回傳 None"""
+        with self.cond:
+            if self.source is None:
+                return None
+            key, (factors, rows, cols, original) = self.key, self.source
+            energy, sampled = self.energy, self.sampled
+        if k > factors_max_rank(factors):
+            return None
+        if energy is None:
+            energy = [float(np.sum(np.square(original[:, :, c], dtype=np.float64)))
+                      for c in range(original.shape[2])]
+        if sampled is None or sampled[0] is not factors:
+            # 只取顯示用的列與欄並轉成 float32，每張畫面的乘法量與圖片解析度無關
+            sampled = (factors, [
+                (U[rows].astype(np.float32), S.astype(np.float32),
+                 Vt[:, cols].astype(np.float32))
+                for U, S, Vt in factors
+            ])
+        frame = np.empty((len(rows), len(cols), len(factors)), dtype=np.uint8)
+        for c, (U, S, Vt) in enumerate(sampled[1]):
+            np.clip((U[:, :k] * S[:k]) @ Vt[:k], 0, 255, out=frame[:, :, c], casting="unsafe")
+        tail = sum(e - np.sum(S[:k] ** 2) for e, (_, S, _) in zip(energy, factors))
+        mse = max(tail, 0.0) / (original.shape[0] * original.shape[1] * len(factors)) + 1 / 12
+        result = (frame, 10 * np.log10(255.0 ** 2 / mse))
+        with self.cond:
+            if key == self.key:
+                self.energy, self.sampled = energy, sampled
+                self.frames[k] = result
+                if len(self.frames) > SCRUB_CACHE:
+                    self.frames.popitem(last=False)
+        return result
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.jobs and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                k = self.jobs.popleft()
+            self.render(k)
+
+
+# 建議的最低 PSNR
+PSNR_THRESHOLD = 40.0
+
+
+class QualityNotifier:
+    """非強制回應的品質提示
+
+    只在 PSNR 跨越門檻或放開滑桿時提示（橫幅 + 狀態列），
+    同樣的訊息在 min_interval 秒內不重複；拖動滑桿期間只更新
+    橫幅上的數字與 PSNR 標籤顏色，不會阻塞事件迴圈。
+    """
+
+    def __init__(self, banner, psnr_label, status_bar,
+                 threshold=PSNR_THRESHOLD, min_interval=2.0):
+        self.banner = banner
+        self.psnr_label = psnr_label
+        self.status_bar = status_bar
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.below = None
+        self.last_message = None
+        self.last_time = 0.0
+        self.hide_timer = QTimer()
+        self.hide_timer.setSingleShot(True)
+        self.hide_timer.timeout.connect(self.banner.hide)
+
+    def reset(self):
+        """換圖片時重新開始判斷"""
+        self.below = None
+        self.last_message = None
+        self.hide_timer.stop()
+        self.banner.hide()
+
+    def update(self, psnr, released=False):
+        below = psnr < self.threshold
+        crossed = below != self.below
+        self.below = below
+
+        if crossed:
+            color = "red" if below else "green"
+            self.psnr_label.setStyleSheet(f"color: {color}; font-weight: bold;")
+        if below and self.banner.isVisible():
+            self.banner.setText(self.warning_text(psnr))
+        if not (crossed or released):
+            return
+
+        if below:
+            message = self.warning_text(psnr)
+            self.hide_timer.stop()
+            self.banner.setStyleSheet(
+                "background-color: #fdecea; color: #c0392b; padding: 6px; border-radius: 5px;"
+            )
+        elif crossed and self.last_message is not None:
+            message = f"✓ PSNR 已回到 {self.threshold:.0f} dB 以上"
+            self.banner.setStyleSheet(
+                "background-color: #e9f7ef; color: #1e8449; padding: 6px; border-radius: 5px;"
+            )
+            self.hide_timer.start(3000)
+        else:
+            return
+
+        # 去除重複：同一狀態在短時間內只提示一次
+        now = time.monotonic()
+        if below == self.last_message and now - self.last_time < self.min_interval:
+            return
+        self.last_message = below
+        self.last_time = now
+        self.banner.setText(message)
+        self.banner.show()
+        self.status_bar.showMessage(message, 5000)
+
+    def warning_text(self, psnr):
+        return (f"⚠ 品質警告：目前 PSNR 為 {psnr:.2f} dB，低於建議值 {self.threshold:.0f} dB，"
+                f"建議提高壓縮比例以保持品質。")
+
+
+class Document:
+    """一張開啟中的圖片（一個分頁）與它的檢視狀態
+
+    分解結果不放在這裡，而是交給 FactorCache 保管：閒置時可能被壓成
+    float16、寫到磁碟或丟棄，切回這個分頁時由 load_image 取回或重算。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ratio = 50         # 壓縮比例滑桿
+        self.size_rank = None   # 依目標大小選出的 k
+        self.template = None    # 預設模板（TEMPLATES 的鍵，自訂為 None）
+        self.transforms = []    # 已套用的幾何變換 [(op, scale), ...]
+
 
 class SVDCompressionApp(QMainWindow):
 
@@ -29,16 +1127,58 @@ class SVDCompressionApp(QMainWindow):
         self.original_image = None
         self.compressed_image = None
         self.original_size_mb = 0
-        self.U_R = None
-        self.S_R = None
-        self.Vt_R = None
-        self.U_G = None
-        self.S_G = None
-        self.Vt_G = None
-        self.U_B = None
-        self.S_B = None
-        self.Vt_B = None
+        self.channels = None  # 各通道的 ChannelSVD
         self.max_rank = 0
+        self.stream_thread = None
+        self.rank_thread = None
+        self.pending_rank = 0
+        self.displayed_rank = 0
+        self.last_psnr = float('inf')
+        self.waiting_for_rank = False
+        self.compute_backend = None
+        self.export_thread = None
+        self.pending_export = None  # 等待延伸完成的匯出：(通道, 工作, 格式, 選項)
+        self.size_model = None    # 目前圖片在估計格式下的 SizeModel
+        self.size_thread = None
+        self.size_rank = None     # 依目標大小選出的 k（比例滑桿只有 1% 的刻度）
+        self.size_target = None   # 等待完整編碼確認的目標位元組
+        
+        # 多檔佇列：每張都是一份開啟中的文件（分頁）
+        self.queue_paths = []
+        self.documents = {}  # 路徑 → Document
+        self.current_path = None
+        self.preview_mode = False  # 目前顯示的是縮小版預覽
+        self.opening = None        # 背景解碼中、還沒有畫面的圖片：(路徑, notify)
+        self.factor_cache = FactorCache(
+            CACHE_MEMORY_MB * 1024 * 1024, trim=self.trim_cached_factors,
+            external=self.view_nbytes
+        )
+        self.prefetching = set()
+        self.prefetch_skipped = set()
+        self.prefetch_thread = PrefetchThread(self)
+        self.prefetch_thread.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self.prefetch_thread.previewed.connect(self.on_previewed)
+        self.prefetch_thread.decomposed.connect(self.on_prefetched)
+        self.prefetch_thread.failed.connect(self.on_prefetch_failed)
+        self.prefetch_thread.start()
+        
+        # 拖動比例滑桿時的預測預取
+        self.scrub = ScrubPrefetcher(self)
+        self.scrub.start()
+        self.scrub_timer = QTimer(self)
+        self.scrub_timer.setSingleShot(True)
+        self.scrub_timer.setInterval(SCRUB_IDLE_MS)
+        self.scrub_timer.timeout.connect(self.update_compression)
+        
+        # rank 比較格與誤差熱度圖：(原圖, 各通道平方和)
+        self.original_energy = (None, None)
+        
+        # 分塊模式：每個區塊各自的 rank（None 為整張分解）
+        self.block_svd = None
+        self.block_threads = []
+        # 聯合色彩模式：[R | G | B] 的分解與逐通道的比較基準
+        self.joint_svd = None
+        self.joint_baseline = None
         
         self.init_ui()
         
@@ -50,7 +1190,7 @@ class SVDCompressionApp(QMainWindow):
         
         # 標題
         title_label = QLabel("SVD 智慧影像壓縮工具")
-        title_label.setAlignment(Qt.AlignCenter)
+        title_label.setAlignment(Align.AlignCenter)
         title_label.setStyleSheet("""
             font-size: 24px;
             font-weight: bold;
@@ -59,6 +1199,14 @@ class SVDCompressionApp(QMainWindow):
         """)
         main_layout.addWidget(title_label)
         
+        # 開啟中的圖片分頁
+        self.tab_bar = QTabBar()
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.tabCloseRequested.connect(self.close_document)
+        main_layout.addWidget(self.tab_bar)
+        
         # 上半部：圖片顯示區
         image_layout = QHBoxLayout()
         
@@ -72,6 +1220,18 @@ class SVDCompressionApp(QMainWindow):
         
         main_layout.addLayout(image_layout)
         
+        # 多檔佇列的縮圖列
+        self.filmstrip = QListWidget()
+        self.filmstrip.setViewMode(QListView.ViewMode.IconMode)
+        self.filmstrip.setFlow(QListView.Flow.LeftToRight)
+        self.filmstrip.setWrapping(False)
+        self.filmstrip.setIconSize(QSize(*THUMBNAIL_SIZE))
+        self.filmstrip.setFixedHeight(THUMBNAIL_SIZE[1] + 50)
+        self.filmstrip.currentRowChanged.connect(self.show_queue_item)
+        self.filmstrip.setVisible(False)
+        main_layout.addWidget(self.filmstrip)
+        self.tab_bar.currentChanged.connect(self.filmstrip.setCurrentRow)
+        
         # 中間：控制區
         control_group = self.create_control_panel()
         main_layout.addWidget(control_group)
@@ -80,6 +1240,20 @@ class SVDCompressionApp(QMainWindow):
         suggestion_group = self.create_suggestion_panel()
         main_layout.addWidget(suggestion_group)
         
+        # 狀態列：記憶體用量
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        
+        # 狀態列：匯出進度
+        self.export_progress = QProgressBar()
+        self.export_progress.setMaximumWidth(160)
+        self.export_progress.hide()
+        self.statusBar().addPermanentWidget(self.export_progress)
+        
+        self.quality_notifier = QualityNotifier(
+            self.quality_banner, self.compressed_psnr_label, self.statusBar()
+        )
+        
     def create_image_group(self, title, is_original):
         """建立圖片顯示區塊"""
         group_box = QGroupBox(title)
@@ -106,7 +1280,7 @@ class SVDCompressionApp(QMainWindow):
             image_label = QLabel()
             image_label.setMinimumSize(500, 400)
             image_label.setMaximumSize(600, 500)
-            image_label.setAlignment(Qt.AlignCenter)
+            image_label.setAlignment(Align.AlignCenter)
             image_label.setStyleSheet("""
                 QLabel {
                     border: 2px dashed #95a5a6;
@@ -124,10 +1298,11 @@ class SVDCompressionApp(QMainWindow):
             
             self.original_image_label = image_label
         else:
-            image_label = QLabel()
+            image_label = ZoomableLabel()
+            image_label.setToolTip("滾輪縮放、拖曳平移、雙擊回到全圖")
             image_label.setMinimumSize(500, 400)
             image_label.setMaximumSize(600, 500)
-            image_label.setAlignment(Qt.AlignCenter)
+            image_label.setAlignment(Align.AlignCenter)
             image_label.setStyleSheet("""
                 QLabel {
                     border: 2px solid #3498db;
@@ -138,6 +1313,12 @@ class SVDCompressionApp(QMainWindow):
             image_label.setText("壓縮預覽\n\n上傳圖片後\n調整滑桿查看效果")
             image_label.setScaledContents(False)
             self.compressed_image_label = image_label
+            
+            # 品質提示橫幅（非強制回應）
+            self.quality_banner = QLabel()
+            self.quality_banner.setWordWrap(True)
+            self.quality_banner.hide()
+            layout.addWidget(self.quality_banner)
         
         layout.addWidget(image_label)
         
@@ -167,6 +1348,27 @@ class SVDCompressionApp(QMainWindow):
             """)
             upload_btn.clicked.connect(self.upload_image)
             layout.addWidget(upload_btn)
+            
+            # 幾何變換：直接作用在已分解的因子上
+            transform_layout = QHBoxLayout()
+            for text, tip, op, scale in (("⟲", "逆時針旋轉 90°", "rot90", 1.0),
+                                         ("⟳", "順時針旋轉 90°", "rot270", 1.0),
+                                         ("⇆", "左右翻轉", "flip_h", 1.0),
+                                         ("⇅", "上下翻轉", "flip_v", 1.0),
+                                         ("⤡", "轉置", "transpose", 1.0),
+                                         ("½", "縮小為 50%", "resize", 0.5)):
+                button = QToolButton()
+                button.setText(text)
+                button.setToolTip(tip)
+                button.clicked.connect(lambda _, op=op, scale=scale: self.apply_transform(op, scale))
+                transform_layout.addWidget(button)
+            reset_btn = QToolButton()
+            reset_btn.setText("↺ 還原")
+            reset_btn.setToolTip("取消所有幾何變換，重新載入原圖")
+            reset_btn.clicked.connect(self.reset_transforms)
+            transform_layout.addWidget(reset_btn)
+            transform_layout.addStretch()
+            layout.addLayout(transform_layout)
         else:
             self.compressed_ratio_label = QLabel("？？%")
             self.compressed_size_label = QLabel("？？ MB")
@@ -192,6 +1394,39 @@ class SVDCompressionApp(QMainWindow):
             """)
             save_btn.clicked.connect(self.save_compressed_image)
             layout.addWidget(save_btn)
+            
+            # 漸進式串流：匯出 / 檢視
+            stream_layout = QHBoxLayout()
+            export_stream_btn = QPushButton("📤 匯出漸進串流")
+            export_stream_btn.clicked.connect(self.export_progressive_stream)
+            view_stream_btn = QPushButton("📡 串流檢視")
+            view_stream_btn.clicked.connect(self.open_stream_viewer)
+            compare_btn = QPushButton("🔍 比較 rank")
+            compare_btn.clicked.connect(self.show_rank_comparison)
+            for btn in (export_stream_btn, view_stream_btn, compare_btn):
+                btn.setStyleSheet("""
+                    QPushButton {
+                        background-color: #16a085;
+                        color: white;
+                        padding: 8px;
+                        border-radius: 5px;
+                        font-size: 13px;
+                    }
+                    QPushButton:hover {
+                        background-color: #138d75;
+                    }
+                """)
+                stream_layout.addWidget(btn)
+            layout.addLayout(stream_layout)
+            
+            # 誤差熱度圖：由捨去的三元組在顯示解析度上計算
+            self.heatmap_checkbox = QCheckBox("🔥 誤差熱度圖")
+            self.heatmap_checkbox.setToolTip(
+                f"全圖檢視時疊上每像素的誤差：黃 → 紅代表 RMS 誤差 0 → {HEATMAP_MAX_ERROR:.0f} 灰階\n"
+                f"（由緊接在 k 之後的 {HEATMAP_TAIL} 個捨去三元組估計）"
+            )
+            self.heatmap_checkbox.toggled.connect(lambda _: self.update_compression())
+            layout.addWidget(self.heatmap_checkbox)
         
         layout.addLayout(info_layout)
         group_box.setLayout(layout)
@@ -219,13 +1454,12 @@ class SVDCompressionApp(QMainWindow):
         template_label = QLabel("選擇預設模板：")
         template_label.setStyleSheet("font-size: 14px;")
         
+        # 項目資料是 TEMPLATES 的鍵（自訂為 None），不依賴排列順序
         self.template_combo = QComboBox()
-        self.template_combo.addItems([
-            "自訂",
-            "社群媒體 (2 MB, 快速上傳)",
-            "郵件附件 (5 MB, 平衡)",
-            "高品質存檔 (保持 PSNR > 40 dB)"
-        ])
+        self.template_combo.addItem("自訂", None)
+        self.template_combo.addItem("社群媒體 (2 MB, 快速上傳)", "social")
+        self.template_combo.addItem("郵件附件 (5 MB, 平衡)", "email")
+        self.template_combo.addItem("高品質存檔 (保持 PSNR > 40 dB)", "archive")
         self.template_combo.currentIndexChanged.connect(self.apply_template)
         
         template_layout.addWidget(template_label)
@@ -240,13 +1474,14 @@ class SVDCompressionApp(QMainWindow):
         ratio_layout.addWidget(ratio_label)
         
         ratio_slider_layout = QHBoxLayout()
-        self.ratio_slider = QSlider(Qt.Horizontal)
+        self.ratio_slider = QSlider(Ori.Horizontal)
         self.ratio_slider.setMinimum(1)
         self.ratio_slider.setMaximum(100)
         self.ratio_slider.setValue(50)
-        self.ratio_slider.setTickPosition(QSlider.TicksBelow)
+        self.ratio_slider.setTickPosition(QSlider.TickPosition.TicksBelow)
         self.ratio_slider.setTickInterval(10)
         self.ratio_slider.valueChanged.connect(self.ratio_slider_changed)
+        self.ratio_slider.sliderReleased.connect(self.slider_released)
         
         self.ratio_value_label = QLabel("50%")
         self.ratio_value_label.setStyleSheet("font-size: 14px; font-weight: bold; color: #e74c3c;")
@@ -265,13 +1500,14 @@ class SVDCompressionApp(QMainWindow):
         size_layout.addWidget(size_label)
         
         size_slider_layout = QHBoxLayout()
-        self.size_slider = QSlider(Qt.Horizontal)
+        self.size_slider = QSlider(Ori.Horizontal)
         self.size_slider.setMinimum(1)
         self.size_slider.setMaximum(100)  # 會根據原始圖片大小動態調整
         self.size_slider.setValue(50)
-        self.size_slider.setTickPosition(QSlider.TicksBelow)
+        self.size_slider.setTickPosition(QSlider.TickPosition.TicksBelow)
         self.size_slider.setTickInterval(10)
         self.size_slider.valueChanged.connect(self.size_slider_changed)
+        self.size_slider.sliderReleased.connect(self.measure_size)
         
         self.size_value_label = QLabel("？？ MB")
         self.size_value_label.setStyleSheet("font-size: 14px; font-weight: bold; color: #e74c3c;")
@@ -281,13 +1517,51 @@ class SVDCompressionApp(QMainWindow):
         size_slider_layout.addWidget(self.size_value_label)
         size_layout.addLayout(size_slider_layout)
         
+        # 大小依這個格式的實際編碼估計
+        size_format_layout = QHBoxLayout()
+        size_format_label = QLabel("估計格式：")
+        size_format_label.setStyleSheet("font-size: 13px; color: #34495e;")
+        self.size_format_combo = QComboBox()
+        for code in ("jpeg", "png", "webp"):
+            self.size_format_combo.addItem(EXPORT_FORMATS[code][0], code)
+        self.size_format_combo.currentIndexChanged.connect(lambda _: self.start_size_model())
+        size_format_layout.addWidget(size_format_label)
+        size_format_layout.addWidget(self.size_format_combo)
+        size_format_layout.addStretch()
+        size_layout.addLayout(size_format_layout)
+        
         layout.addLayout(size_layout)
         
+        # 分解方式：整張、分塊或聯合色彩（後兩者的比例滑桿代表相同的儲存量）
+        block_layout = QHBoxLayout()
+        block_label = QLabel("分解方式：")
+        block_label.setStyleSheet("font-size: 13px; color: #34495e;")
+        self.block_combo = QComboBox()
+        self.block_combo.addItem("整張分解", None)
+        for size in BLOCK_SIZES:
+            self.block_combo.addItem(f"{size}×{size} 分塊（各區塊自適應 rank）", size)
+        self.block_combo.addItem("聯合色彩 [R|G|B]（共用 U）", JOINT_MODE)
+        self.block_combo.setToolTip(
+            "分塊時以相同的儲存量，把 rank 分配給細節多的區塊；\n"
+            "聯合色彩只分解一次、三個通道共用 U，並與逐通道 SVD 比較"
+        )
+        self.block_combo.currentIndexChanged.connect(self.set_block_mode)
+        block_layout.addWidget(block_label)
+        block_layout.addWidget(self.block_combo)
+        block_layout.addStretch()
+        layout.addLayout(block_layout)
+        
         # 說明文字
         note_label = QLabel("💡 註：兩條滑桿會互相連動，拖動任一滑桿都會自動調整另一個")
         note_label.setStyleSheet("font-size: 12px; color: #7f8c8d; font-style: italic;")
         layout.addWidget(note_label)
         
+        # 選用：重建與 PSNR 交給其他行程，GUI 執行緒只負責繪圖
+        self.backend_checkbox = QCheckBox("⚙ 多行程運算（共享記憶體）")
+        self.backend_checkbox.setStyleSheet("font-size: 13px;")
+        self.backend_checkbox.toggled.connect(self.set_compute_backend)
+        layout.addWidget(self.backend_checkbox)
+        
         group_box.setLayout(layout)
         return group_box
     
@@ -364,30 +1638,80 @@ class SVDCompressionApp(QMainWindow):
         """放下檔案事件"""
         files = [u.toLocalFile() for u in event.mimeData().urls()]
         if files:
-            self.load_image(files[0])
+            self.add_to_queue(files)
     
     # ==================== 圖片處理功能 ====================
     
     def upload_image(self):
         """上傳圖片按鈕"""
-        file_name, _ = QFileDialog.getOpenFileName(
-            self, "選擇圖片", "", "圖片檔案 (*.png *.jpg *.jpeg *.bmp)"
+        file_names, _ = QFileDialog.getOpenFileNames(
+            self, "選擇圖片", "", "圖片檔案 (*.png *.jpg *.jpeg *.bmp *.svdr)"
         )
-        if file_name:
-            self.load_image(file_name)
+        if file_names:
+            self.add_to_queue(file_names)
     
-    def load_image(self, file_path):
-        """載入圖片並進行 SVD"""
+    def load_image(self, file_path, notify=True):
+        """載入圖片並進行 SVD（已預取的直接使用）"""
+        self.opening = None
         try:
-            # 讀取圖片
-            img = Image.open(file_path)
-            img_array = np.array(img)
+            # 讀取圖片（已在快取中就不必重新分解）
+            entry = self.factor_cache.get(file_path)
+            if entry is not None:
+                img_array, channels = entry
+                self.show_loaded_image(file_path, img_array, channels, notify)
+            elif file_path in self.documents and preview_needs_full_decode(file_path, PREVIEW_SIZE):
+                # PNG、BMP 等無法在解碼時縮小：整張解碼交給背景，縮小版好了再顯示
+                self.clear_view()
+                self.current_path = file_path
+                self.opening = (file_path, notify)
+                self.original_image_label.setText("解碼中…")
+                if file_path not in self.prefetching:
+                    self.prefetching.add(file_path)
+                    self.prefetch_thread.submit(PrefetchThread.OPEN, file_path)
+                self.statusBar().showMessage(f"{os.path.basename(file_path)} 解碼中…")
+            else:
+                # 大圖先分解縮小版，完整解析度交給背景；小圖解碼出來的就是完整解析度
+                img_array, full_size = decode_preview(file_path, PREVIEW_SIZE)
+                self.show_decoded_image(file_path, img_array, full_size, notify)
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"載入圖片失敗：{str(e)}")
+    
+    def show_decoded_image(self, file_path, img_array, full_size, notify):
+        """分解剛解碼的圖片（或縮小版）並顯示"""
+        preview = img_array.shape[:2] != full_size[::-1]
+        channels = decompose_image(img_array)
+        img_array, channels = self.apply_document_transforms(file_path, img_array, channels)
+        self.show_loaded_image(file_path, img_array, channels, notify,
+                               full_size if preview else None)
+    
+    def show_loaded_image(self, file_path, img_array, channels, notify, full_size=None):
+        """顯示已分解的圖片；full_size 為原始 (寬, 高) 時表示目前只是預覽"""
+        try:
+            preview = full_size is not None
+            width, height = full_size if preview else (img_array.shape[1], img_array.shape[0])
+            
+            self.current_path = file_path
+            self.preview_mode = preview
+            if preview:
+                if file_path not in self.prefetching:
+                    self.prefetching.add(file_path)
+                    self.prefetch_thread.submit(PrefetchThread.CURRENT, file_path)
+                self.statusBar().showMessage(
+                    f"預覽 {img_array.shape[1]}×{img_array.shape[0]}，"
+                    f"完整解析度 {width}×{height} 分解中…"
+                )
+            else:
+                self.factor_cache.put(
+                    file_path, (img_array, channels), pinned=self.prefetch_window()
+                )
             
             # 儲存原始圖片
             self.original_image = img_array
             
-            # 計算檔案大小
-            self.original_size_mb = len(img_array.tobytes()) / (1024 * 1024)
+            # 計算檔案大小（預覽時仍以完整解析度計算，並計入縮放）
+            self.original_size_mb = width * height * img_array.shape[2] / (1024 * 1024)
+            if preview:
+                self.original_size_mb *= self.transform_area_scale(file_path)
             
             # 顯示原始圖片
             self.display_image(self.original_image_label, img_array)
@@ -397,76 +1721,151 @@ class SVDCompressionApp(QMainWindow):
             self.original_size_label.setText(f"{self.original_size_mb:.2f} MB")
             
             # 進行 SVD 分解
-            self.perform_svd(img_array)
+            self.set_channels(channels)
+            self.quality_notifier.reset()
             
-            # 更新滑桿最大值
+            # 更新滑桿最大值（比例已由文件狀態還原，大小滑桿跟著換算）
+            self.size_slider.blockSignals(True)
             self.size_slider.setMaximum(int(self.original_size_mb * 100))
-            self.size_slider.setValue(int(self.original_size_mb * 50))
+            self.size_slider.setValue(int(self.predicted_size_mb(self.current_rank()) * 100))
+            self.size_value_label.setText(f"{self.size_slider.value() / 100:.2f} MB")
+            self.size_slider.blockSignals(False)
             
             # 初始壓縮
             self.update_compression()
             
-            QMessageBox.information(self, "成功", "圖片載入成功！")
+            if notify:
+                QMessageBox.information(self, "成功", "圖片載入成功！")
             
         except Exception as e:
             QMessageBox.critical(self, "錯誤", f"載入圖片失敗：{str(e)}")
     
     def perform_svd(self, img_array):
-        """對 RGB 三個通道進行 SVD"""
-        if len(img_array.shape) == 2:
-            # 灰階圖片
-            img_array = np.stack([img_array] * 3, axis=2)
-        
-        R = img_array[:, :, 0].astype(float)
-        G = img_array[:, :, 1].astype(float)
-        B = img_array[:, :, 2].astype(float)
-        
-        # SVD 分解
-        self.U_R, self.S_R, self.Vt_R = np.linalg.svd(R, full_matrices=False)
-        self.U_G, self.S_G, self.Vt_G = np.linalg.svd(G, full_matrices=False)
-        self.U_B, self.S_B, self.Vt_B = np.linalg.svd(B, full_matrices=False)
+        """對 RGB 三個通道進行 SVD（大圖先截斷，之後依滑桿延伸）"""
+        self.set_channels(decompose_image(img_array))
+    
+    def set_channels(self, channels):
+        """改用另一組已分解的通道"""
+        self.channels = channels
+        self.max_rank = min(channels[0].channel.shape)
+        self.pending_rank = 0
+        self.start_size_model()
+        self.start_block_svd()
+    
+    def set_block_mode(self, index):
+        """切換分解方式"""
+        self.start_block_svd()
+        if self.block_combo.itemData(index) is None and self.channels is not None:
+            self.update_compression()
+    
+    def start_block_svd(self):
+        """分塊或聯合模式時在背景分解，完成前先顯示整張分解的結果"""
+        self.block_svd = None
+        self.joint_svd = None
+        size = self.block_combo.currentData()
+        if size is None or self.original_image is None:
+            return
+        if size == JOINT_MODE:
+            self.start_joint_svd()
+            return
+        thread = BlockSVDThread(self.original_image, size, self)
+        thread.decomposed.connect(self.on_block_decomposed)
+        thread.finished.connect(lambda: self.block_threads.remove(thread))
+        self.block_threads.append(thread)
+        self.statusBar().showMessage(f"{size}×{size} 分塊分解中…")
+        thread.start()
+    
+    def start_joint_svd(self):
+        thread = JointColorThread(self.original_image, self)
+        thread.decomposed.connect(self.on_joint_decomposed)
+        thread.finished.connect(lambda: self.block_threads.remove(thread))
+        self.block_threads.append(thread)
+        self.statusBar().showMessage("聯合色彩分解中（並計時逐通道 SVD）…")
+        thread.start()
+    
+    def on_joint_decomposed(self, img_array, joint, baseline):
+        """聯合分解完成；期間換了圖片或分解方式就丟掉"""
+        if img_array is not self.original_image or self.block_combo.currentData() != JOINT_MODE:
+            return
+        self.joint_svd = joint
+        self.joint_baseline = baseline
+        self.statusBar().clearMessage()
+        self.update_compression()
+    
+    def on_block_decomposed(self, img_array, block_svd):
+        """分塊分解完成；期間換了圖片或區塊大小就丟掉"""
+        if img_array is not self.original_image or block_svd.size != self.block_combo.currentData():
+            return
+        self.block_svd = block_svd
+        self.statusBar().clearMessage()
+        self.update_compression()
+    
+    def channel_factors(self):
+        """目前的 [(U, S, Vt), ...]，依 R、G、B 順序"""
+        return [channel.factors for channel in self.channels]
+    
+    def available_rank(self):
+        """三個通道都已算出的三元組數"""
+        return min(channel.rank for channel in self.channels)
+    
+    def request_rank(self, k):
+        """確保至少有 k 個三元組；不足時在背景延伸"""
+        k = min(k, self.max_rank)
+        if k <= self.available_rank():
+            return
+        self.pending_rank = max(self.pending_rank, k)
+        if self.rank_thread is not None and self.rank_thread.isRunning():
+            return
         
-        self.max_rank = min(len(self.S_R), len(self.S_G), len(self.S_B))
+        self.rank_thread = RankExtensionThread(self.channels, self.pending_rank, self)
+        self.rank_thread.extended.connect(self.on_rank_extended)
+        self.rank_thread.start()
+    
+    def on_rank_extended(self, target):
+        """背景延伸完成：繼續排隊中的目標與等待中的匯出，並補上不足的預覽"""
+        self.request_rank(self.pending_rank)
+        if self.pending_export is not None:
+            channels, jobs, fmt, options = self.pending_export
+            if channels is not self.channels:
+                self.pending_export = None  # 已換圖片
+            elif self.available_rank() >= max(k for k, _ in jobs):
+                self.pending_export = None
+                self.start_export(jobs, fmt, options)
+        self.factor_cache.evict(pinned=self.prefetch_window())
+        if self.size_target is not None:
+            self.measure_size()
+        else:
+            self.refresh_size_probes()
+        # 若期間換了圖片，舊圖片的結果就不必顯示
+        if self.sender().channels is self.channels and self.displayed_rank < self.current_rank():
+            self.update_compression()
+    
+    def current_rank(self):
+        """依壓縮比例滑桿（或目標大小選出的 k）計算目前的 k"""
+        if self.size_rank is not None:
+            return min(self.size_rank, self.max_rank)
+        k = int(self.max_rank * self.ratio_slider.value() / 100)
+        return max(1, min(k, self.max_rank))
     
     def reconstruct_channel(self, U, S, Vt, k):
         """重建單一通道"""
-        U_k = U[:, :k]
-        S_k = S[:k]
-        Vt_k = Vt[:k, :]
-        return np.dot(U_k, np.dot(np.diag(S_k), Vt_k))
+        return reconstruct_channel(U, S, Vt, k)
     
     def reconstruct_image(self, k):
         """重建 RGB 圖片"""
-        k = min(k, self.max_rank)
-        k = max(1, k)
-        
-        R_approx = self.reconstruct_channel(self.U_R, self.S_R, self.Vt_R, k)
-        G_approx = self.reconstruct_channel(self.U_G, self.S_G, self.Vt_G, k)
-        B_approx = self.reconstruct_channel(self.U_B, self.S_B, self.Vt_B, k)
-        
-        img_approx = np.stack([R_approx, G_approx, B_approx], axis=2)
-        return np.clip(img_approx, 0, 255).astype(np.uint8)
+        return reconstruct_from_factors(self.channel_factors(), k)
     
     def calculate_psnr(self, original, compressed):
         """計算 PSNR"""
-        mse = np.mean((original.astype(float) - compressed.astype(float)) ** 2)
-        if mse == 0:
-            return float('inf')
-        max_val = 255.0
-        psnr = 10 * np.log10((max_val ** 2) / mse)
-        return psnr
+        return calculate_psnr(original, compressed)
     
     def display_image(self, label, img_array):
         """在 QLabel 上顯示圖片"""
-        height, width = img_array.shape[:2]
-        bytes_per_line = 3 * width
-        
-        q_image = QImage(img_array.data, width, height, bytes_per_line, QImage.Format_RGB888)
-        pixmap = QPixmap.fromImage(q_image)
+        pixmap = QPixmap.fromImage(array_to_qimage(img_array))
         
         # 縮放以適應 label
         scaled_pixmap = pixmap.scaled(
-            label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
+            label.size(), AR.KeepAspectRatio, Trans.SmoothTransformation
         )
         label.setPixmap(scaled_pixmap)
     
@@ -475,24 +1874,80 @@ class SVDCompressionApp(QMainWindow):
     def ratio_slider_changed(self, value):
         """壓縮比例滑桿改變"""
         self.ratio_value_label.setText(f"{value}%")
+        self.size_rank = None
+        self.size_target = None
         
         # 更新目標大小滑桿
-        target_size = self.original_size_mb * (value / 100)
+        target_size = self.predicted_size_mb(self.current_rank())
         self.size_slider.blockSignals(True)
         self.size_slider.setValue(int(target_size * 100))
         self.size_value_label.setText(f"{target_size:.2f} MB")
         self.size_slider.blockSignals(False)
         
-        # 更新壓縮
-        self.update_compression()
+        # 拖動中先用預先算好的畫面，完整解析度等停下來再補
+        dragging = self.ratio_slider.isSliderDown()
+        if dragging and self.show_scrub_frame():
+            self.scrub_timer.start()
+        else:
+            self.scrub.cancel()
+            self.update_compression()
+        if dragging:
+            self.scrub.observe(
+                value, lambda v: rank_for_ratio(self.max_rank, v), self.available_rank()
+            )
+    
+    def show_scrub_frame(self):
+        """拖動中只換顯示解析度的 pixmap 與指標（未命中預取就當場重建），回傳是否處理"""
+        if (self.original_image is None or self.compute_backend is not None
+                or self.block_svd is not None or self.joint_svd is not None
+                or self.compressed_image_label.zoom is not None):
+            return False
+        k = self.current_rank()
+        result = self.scrub.take(k)
+        if result is None:
+            self.scrub.cancel()
+            result = self.scrub.render(k)
+            if result is None:
+                return False  # 還沒延伸到這個 k
+        frame, psnr = result
+        _, rows, cols, _ = self.scrub.source
+        self.show_frame(frame, k, rows, cols)
+        self.compressed_ratio_label.setText(f"{self.ratio_slider.value()}%")
+        self.compressed_size_label.setText(self.size_text(k))
+        self.compressed_psnr_label.setText(f"≈ {psnr:.2f} dB")
+        return True
+    
+    def display_grid(self):
+        """壓縮預覽 label 上每個像素對應的原圖列與欄（最近鄰）"""
+        height, width = self.original_image.shape[:2]
+        size = self.compressed_image_label.size()
+        scale = min(size.width() / width, size.height() / height)
+        return nearest_indices(height, scale), nearest_indices(width, scale)
+    
+    def update_scrub_source(self):
+        """讓拖動預取以目前的因子與 label 大小重建"""
+        rows, cols = self.display_grid()
+        size = self.compressed_image_label.size()
+        key = (self.current_path, id(self.channels), size.width(), size.height())
+        self.scrub.set_source(key, self.channel_factors(), rows, cols, self.original_image)
     
     def size_slider_changed(self, value):
         """目標大小滑桿改變"""
         target_size = value / 100
         self.size_value_label.setText(f"{target_size:.2f} MB")
+        self.size_target = None
         
         # 更新壓縮比例滑桿
-        if self.original_size_mb > 0:
+        if self.size_model is not None and self.size_model.ready:
+            self.size_rank = rank_for_size(
+                self.max_rank, self.original_size_mb, target_size, self.size_model
+            )
+            ratio = min(100, max(1, self.size_rank * 100 / self.max_rank))
+            self.ratio_slider.blockSignals(True)
+            self.ratio_slider.setValue(int(ratio))
+            self.ratio_value_label.setText(f"{int(ratio)}%")
+            self.ratio_slider.blockSignals(False)
+        elif self.original_size_mb > 0:
             ratio = (target_size / self.original_size_mb) * 100
             ratio = min(100, max(1, ratio))
             self.ratio_slider.blockSignals(True)
@@ -509,34 +1964,233 @@ class SVDCompressionApp(QMainWindow):
             return
         
         # 根據比例計算 k
-        ratio = self.ratio_slider.value() / 100
-        k = int(self.max_rank * ratio)
-        k = max(1, min(k, self.max_rank))
+        k = self.current_rank()
+        if self.block_svd is not None:
+            self.show_block_compression(k)
+            return
+        if self.joint_svd is not None:
+            self.show_joint_compression(k)
+            return
+        
+        # 先往前多要一些 rank，滑桿再往右時就不必等
+        self.request_rank(k + max(16, self.max_rank // 20))
+        self.displayed_rank = min(k, self.available_rank())
+        if self.displayed_rank < k:
+            self.statusBar().showMessage(
+                f"k = {k} 計算中，暫以 k = {self.displayed_rank} 顯示…"
+            )
+            self.waiting_for_rank = True
+        elif self.waiting_for_rank:
+            self.statusBar().clearMessage()
+            self.waiting_for_rank = False
+        
+        # 交給多行程後端時，結果由 on_backend_frame 顯示
+        if self.compute_backend is not None:
+            factors = self.channel_factors()
+            if not self.compute_backend.is_published(factors):
+                self.release_backend_frame()
+                self.compute_backend.publish(factors, self.original_image)
+            self.compute_backend.render(self.displayed_rank)
+            return
         
         # 重建圖片
-        self.compressed_image = self.reconstruct_image(k)
+        self.compressed_image = self.reconstruct_image(self.displayed_rank)
         
         # 計算 PSNR
         psnr = self.calculate_psnr(self.original_image, self.compressed_image)
+        self.show_compression(self.displayed_rank, psnr)
+    
+    def show_block_compression(self, k):
+        """分塊模式：以與全域 rank k 相同的儲存量分配各區塊的 rank"""
+        blocks = self.block_svd
+        ranks = blocks.allocate(triplets=blocks.triplets_for_rank(k))
+        self.displayed_rank = k
+        self.compressed_image = blocks.reconstruct(ranks)
+        psnr = self.calculate_psnr(self.original_image, self.compressed_image)
+        self.show_compression(k, psnr)
+        kept = np.concatenate(ranks)
+        self.statusBar().showMessage(
+            f"{blocks.size}×{blocks.size} 分塊：{blocks.n_blocks} 塊，"
+            f"rank 平均 {kept.mean():.1f}、最多 {kept.max()}"
+        )
+    
+    def show_joint_compression(self, k):
+        """聯合色彩模式：以與逐通道 rank k 相同的儲存量重建，並回報相同 PSNR 下的差異"""
+        joint = self.joint_svd
+        joint_k = joint.rank_for_storage(k)
+        self.displayed_rank = k
+        self.compressed_image = joint.reconstruct(joint_k)
+        psnr = self.calculate_psnr(self.original_image, self.compressed_image)
+        self.show_compression(k, psnr)
+        result = joint.compare(joint_k, *self.joint_baseline)
+        saved = 1 - result["joint_floats"] / max(result["separate_floats"], 1)
+        self.statusBar().showMessage(
+            f"聯合色彩 rank {joint_k}：分解 {result['joint_seconds'] * 1000:.0f} ms"
+            f"（逐通道 {result['separate_seconds'] * 1000:.0f} ms）；"
+            f"同為 ≈ {result['psnr']:.2f} dB 時存 {result['joint_floats']:,} 個浮點數，"
+            f"逐通道需 rank {result['separate_rank']}、{result['separate_floats']:,} 個"
+            f"（省 {saved:.0%}）"
+        )
+    
+    def show_compression(self, k, psnr):
+        """顯示 self.compressed_image 與其指標"""
+        ratio = self.ratio_slider.value() / 100
         
-        # 更新顯示
-        self.display_image(self.compressed_image_label, self.compressed_image)
+        # 更新顯示（分塊與聯合模式不支援以因子重建的縮放）
+        if self.heatmap_checkbox.isChecked():
+            rows, cols = self.display_grid()
+            self.show_frame(self.compressed_image[rows][:, cols], k, rows, cols)
+        else:
+            self.display_image(self.compressed_image_label, self.compressed_image)
+        whole = self.block_svd is None and self.joint_svd is None
+        self.compressed_image_label.set_source(self.channel_factors() if whole else None, k)
+        self.update_scrub_source()
         
-        # 更新資訊
-        compressed_size = len(self.compressed_image.tobytes()) / (1024 * 1024)
+        # 更新資訊（預覽時依完整解析度換算，PSNR 為估計值）
         self.compressed_ratio_label.setText(f"{int(ratio * 100)}%")
-        self.compressed_size_label.setText(f"{compressed_size:.2f} MB")
-        self.compressed_psnr_label.setText(f"{psnr:.2f} dB")
+        self.compressed_size_label.setText(self.size_text(k))
+        estimate = "≈ " if self.preview_mode else ""
+        self.compressed_psnr_label.setText(f"{estimate}{psnr:.2f} dB")
+        self.update_memory_usage()
         
         # PSNR 警告
-        if psnr < 40:
-            self.compressed_psnr_label.setStyleSheet("color: red; font-weight: bold;")
-            QMessageBox.warning(
-                self, "品質警告", 
-                f"目前 PSNR 為 {psnr:.2f} dB，低於建議值 40 dB！\n建議提高壓縮比例以保持品質。"
+        self.last_psnr = psnr
+        self.quality_notifier.update(psnr)
+    
+    # ==================== 幾何變換 ====================
+    
+    def apply_transform(self, op, scale=1.0):
+        """在已分解的因子上旋轉、翻轉、轉置或縮放，不重新分解"""
+        if self.original_image is None:
+            return
+        # 縮放時只處理目前需要的三元組，其餘交給背景延伸
+        k = math.ceil(self.current_rank() * scale)
+        rank = k + max(16, int(self.max_rank * scale) // 20)
+        start = time.perf_counter()
+        img_array, channels = transform_image(self.original_image, self.channels, op, scale, rank)
+        elapsed = time.perf_counter() - start
+        
+        doc = self.documents.get(self.current_path)
+        if doc is not None:
+            doc.transforms.append((op, scale))
+        if not self.preview_mode:
+            self.factor_cache.put(
+                self.current_path, (img_array, channels), pinned=self.prefetch_window()
             )
+        old_height, old_width = self.original_image.shape[:2]
+        self.original_size_mb *= img_array.shape[0] * img_array.shape[1] / (old_height * old_width)
+        
+        self.original_image = img_array
+        self.display_image(self.original_image_label, img_array)
+        self.original_size_label.setText(f"{self.original_size_mb:.2f} MB")
+        self.set_channels(channels)
+        self.size_slider.blockSignals(True)
+        self.size_slider.setMaximum(int(self.original_size_mb * 100))
+        self.size_slider.setValue(int(self.predicted_size_mb(self.current_rank()) * 100))
+        self.size_value_label.setText(f"{self.size_slider.value() / 100:.2f} MB")
+        self.size_slider.blockSignals(False)
+        self.update_compression()
+        self.statusBar().showMessage(
+            f"{GEOMETRIC_TRANSFORMS[op]}：{elapsed * 1000:.1f} ms"
+            f"（{img_array.shape[1]}×{img_array.shape[0]}，未重新分解）", 5000
+        )
+    
+    def apply_document_transforms(self, path, img_array, channels):
+        """重新分解（或完整解析度取代預覽）後，補上文件已套用的幾何變換"""
+        doc = self.documents.get(path)
+        for op, scale in (doc.transforms if doc is not None else ()):
+            img_array, channels = transform_image(img_array, channels, op, scale)
+        return img_array, channels
+    
+    def transform_area_scale(self, path):
+        """文件的幾何變換讓像素數變成原來的幾倍"""
+        doc = self.documents.get(path)
+        area = 1.0
+        for op, scale in (doc.transforms if doc is not None else ()):
+            if op == "resize":
+                area *= scale * scale
+        return area
+    
+    def reset_transforms(self):
+        """取消所有幾何變換，從檔案重新載入"""
+        doc = self.documents.get(self.current_path)
+        if doc is None or not doc.transforms:
+            return
+        doc.transforms = []
+        self.factor_cache.discard(self.current_path)
+        self.load_image(self.current_path, notify=False)
+    
+    # ==================== 誤差熱度圖 ====================
+    
+    def channel_energies(self):
+        """原圖各通道的平方和，每張圖片只算一次"""
+        if self.original_energy[0] is not self.original_image:
+            self.original_energy = (self.original_image, channel_energies(self.original_image))
+        return self.original_energy[1]
+    
+    def error_energy(self, k, rows, cols):
+        """顯示格點上的誤差能量（k 為比例滑桿的 rank）
+
+        分塊模式沒有全域的捨去三元組，直接以取樣後的原圖與重建相減。
+        """
+        if self.block_svd is not None:
+            diff = self.original_image[rows][:, cols].astype(float) - \
+                self.compressed_image[rows][:, cols]
+            return np.square(diff).sum(axis=2)
+        if self.joint_svd is not None:
+            factors, k = self.joint_svd.channel_factors(), self.joint_svd.rank_for_storage(k)
         else:
-            self.compressed_psnr_label.setStyleSheet("color: green; font-weight: bold;")
+            factors = self.channel_factors()
+        return residual_energy_map(factors, k, rows, cols, HEATMAP_TAIL, self.channel_energies())
+    
+    def show_frame(self, frame, k, rows, cols):
+        """顯示 rows × cols 的畫面；開啟熱度圖時疊上誤差"""
+        if self.heatmap_checkbox.isChecked():
+            frame = heatmap_overlay(frame, self.error_energy(k, rows, cols))
+        self.compressed_image_label.setPixmap(QPixmap.fromImage(array_to_qimage(frame)))
+    
+    # ==================== 多行程運算 ====================
+    
+    def set_compute_backend(self, enabled):
+        """開關多行程運算後端"""
+        if enabled and self.compute_backend is None:
+            self.compute_backend = ComputeBackend(COMPUTE_WORKERS, self)
+            self.compute_backend.frame_ready.connect(self.on_backend_frame)
+            self.compute_backend.worker_restarted.connect(
+                lambda i: self.statusBar().showMessage(f"計算行程 {i} 已重新啟動", 3000)
+            )
+            self.compute_backend.start()
+        elif not enabled and self.compute_backend is not None:
+            self.release_backend_frame()
+            self.compute_backend.shutdown()
+            self.compute_backend = None
+        self.update_compression()
+    
+    def release_backend_frame(self):
+        """舊的共享區段要釋放前，先把畫面複製出來"""
+        if self.compressed_image is not None and self.compressed_image.base is not None:
+            self.compressed_image = self.compressed_image.copy()
+    
+    def on_backend_frame(self, buffer, k, psnr):
+        """後端算好一張畫面：直接映射共用緩衝區顯示"""
+        if self.compute_backend is None or self.compute_backend.store is None:
+            return
+        self.compressed_image = self.compute_backend.frames[buffer]
+        self.show_compression(k, psnr)
+    
+    def slider_released(self):
+        """放開滑桿時補算完整解析度，再提示一次目前的品質"""
+        self.scrub.cancel()
+        if self.scrub_timer.isActive():
+            self.scrub_timer.stop()
+            self.update_compression()
+        if self.scrub.hits + self.scrub.misses:
+            self.statusBar().showMessage(
+                f"拖動預取命中率 {self.scrub.hit_rate * 100:.0f}%"
+                f"（{self.scrub.hits}/{self.scrub.hits + self.scrub.misses}）", 3000
+            )
+        if self.original_image is not None:
+            self.quality_notifier.update(self.last_psnr, released=True)
     
     # ==================== 預設模板 ====================
     
@@ -545,16 +2199,14 @@ class SVDCompressionApp(QMainWindow):
         if self.original_image is None:
             return
         
-        if index == 1:  # 社群媒體
-            target_size = min(2, self.original_size_mb)
-            ratio = (target_size / self.original_size_mb) * 100
-            self.ratio_slider.setValue(int(ratio))
-        elif index == 2:  # 郵件附件
-            target_size = min(5, self.original_size_mb)
-            ratio = (target_size / self.original_size_mb) * 100
-            self.ratio_slider.setValue(int(ratio))
-        elif index == 3:  # 高品質
-            self.ratio_slider.setValue(80)
+        key = self.template_combo.itemData(index)
+        if key is None:  # 自訂
+            return
+        target = TEMPLATES[key]
+        if "size_mb" in target:
+            self.apply_size_target(target["size_mb"])
+        else:
+            self.ratio_slider.setValue(target["ratio"])
     
     def apply_suggestion(self, suggestion_num):
         """套用建議"""
@@ -564,9 +2216,7 @@ class SVDCompressionApp(QMainWindow):
         
         if suggestion_num == 1:
             # 社群媒體優化
-            target_size = min(2, self.original_size_mb)
-            ratio = (target_size / self.original_size_mb) * 100
-            self.ratio_slider.setValue(int(ratio))
+            self.apply_size_target(TEMPLATES["social"]["size_mb"])
         elif suggestion_num == 2:
             # 平衡模式
             self.ratio_slider.setValue(50)
@@ -574,6 +2224,157 @@ class SVDCompressionApp(QMainWindow):
             # 高品質
             self.ratio_slider.setValue(80)
     
+    # ==================== 編碼大小估計 ====================
+    
+    def start_size_model(self):
+        """為目前圖片與估計格式建立新的 SizeModel（預覽時等完整解析度）"""
+        self.size_model = None
+        if self.channels is None or self.preview_mode:
+            return
+        self.size_model = SizeModel(self.original_image, self.size_format_combo.currentData())
+        self.measure_size()
+    
+    def measure_size(self):
+        """在背景完整編碼目前的 k，校正大小模型（第一次會先抽樣建模）"""
+        if self.size_model is None:
+            return
+        if self.size_thread is not None and self.size_thread.isRunning():
+            return  # 完成時會再檢查一次
+        k = self.current_rank()
+        if k > self.available_rank():
+            if self.size_target is not None:
+                return  # 等延伸完成，on_rank_extended 會再呼叫
+            k = self.available_rank()
+        if k in self.size_model.measured:
+            if self.size_model.probed_rank < self.available_rank():
+                self.refresh_size_probes()
+            elif self.size_target is not None:
+                self.on_size_measured(self.size_model, k, self.size_model.measured[k])
+            return
+        frame = None
+        if (self.displayed_rank == k and self.compute_backend is None
+                and self.compressed_image is not None):
+            frame = self.compressed_image.copy()
+        self.start_size_thread(k, frame)
+    
+    def refresh_size_probes(self):
+        """截斷分解延伸後，在背景補上新 rank 的探測點"""
+        if self.size_model is None or self.size_model.probed_rank >= self.available_rank():
+            return
+        if self.size_thread is None or not self.size_thread.isRunning():
+            self.start_size_thread(0)
+    
+    def start_size_thread(self, k, frame=None):
+        self.size_thread = SizeModelThread(self.size_model, self.channel_factors(), k, frame, self)
+        self.size_thread.ready.connect(self.on_size_measured)
+        self.size_thread.start()
+    
+    def on_size_measured(self, model, k, size):
+        """探測或實測完成：更新顯示；有等待中的目標大小時視需要重新選 k"""
+        self.size_thread.wait()  # 訊號在 run() 結束前送出
+        if model is not self.size_model:
+            self.measure_size()  # 期間換了圖片或格式，替新的模型補上
+            return
+        
+        if k and self.size_target is not None:
+            target = self.size_target
+            if size > target or size < target * (1 - SIZE_TOLERANCE):
+                retry = model.rank_for_size(target, self.max_rank)
+                if retry != k and retry not in model.measured:
+                    self.set_size_rank(retry)
+                    self.measure_size()
+                    return
+                if size > target:
+                    # 曲線不再給出新的 k：退回實測不超過目標的最大 k
+                    fits = [r for r, b in model.measured.items() if b <= target]
+                    if fits:
+                        self.set_size_rank(max(fits))
+            self.size_target = None
+        
+        self.size_slider.blockSignals(True)
+        self.size_slider.setValue(int(self.predicted_size_mb(self.current_rank()) * 100))
+        self.size_value_label.setText(f"{self.size_slider.value() / 100:.2f} MB")
+        self.size_slider.blockSignals(False)
+        if self.compressed_image is not None:
+            self.compressed_size_label.setText(self.size_text(self.displayed_rank))
+        if self.size_target is not None:
+            self.measure_size()
+        else:
+            self.refresh_size_probes()
+    
+    def predicted_size_mb(self, k):
+        """rank k 的預測編碼大小；模型未就緒前以未壓縮大小線性換算"""
+        if self.size_model is not None and self.size_model.ready:
+            return float(self.size_model.predict(k)) / (1024 * 1024)
+        return self.original_size_mb * k / max(1, self.max_rank)
+    
+    def size_text(self, k):
+        if self.size_model is None or not self.size_model.ready:
+            return f"{self.original_size_mb * k / max(1, self.max_rank):.2f} MB"
+        name = EXPORT_FORMATS[self.size_model.fmt][0]
+        if k in self.size_model.measured:
+            return f"{self.size_model.measured[k] / (1024 * 1024):.2f} MB（{name} 實測）"
+        return f"≈ {self.predicted_size_mb(k):.2f} MB（{name}）"
+    
+    def set_size_rank(self, k):
+        """改用依目標大小選出的 k，並同步比例滑桿"""
+        self.size_rank = k
+        ratio = min(100, max(1, k * 100 / self.max_rank))
+        self.ratio_slider.blockSignals(True)
+        self.ratio_slider.setValue(int(ratio))
+        self.ratio_value_label.setText(f"{int(ratio)}%")
+        self.ratio_slider.blockSignals(False)
+        self.update_compression()
+    
+    def set_rank(self, k):
+        """改用指定的 k：比例滑桿設到至少保留 k 個三元組的刻度，取消大小目標"""
+        value = min(100, max(1, math.ceil(k * 100 / self.max_rank)))
+        if value == self.ratio_slider.value():
+            self.ratio_slider_changed(value)
+        else:
+            self.ratio_slider.setValue(value)
+    
+    def apply_size_target(self, size_mb):
+        """把大小滑桿設到目標，完整編碼確認後必要時再微調 k"""
+        size_mb = min(size_mb, self.original_size_mb)
+        self.size_slider.setValue(int(size_mb * 100))
+        if self.size_model is not None and self.size_model.ready:
+            self.size_target = size_mb * 1024 * 1024
+            self.measure_size()
+    
+    # ==================== rank 比較 ====================
+    
+    def show_rank_comparison(self):
+        """以一次累加畫出多個 rank 的縮圖，點選的 rank 直接套用"""
+        if self.original_image is None:
+            QMessageBox.warning(self, "提醒", "請先上傳圖片！")
+            return
+        available = self.available_rank()
+        ranks = {int(k) for k in np.geomspace(1, available, COMPARE_COUNT)}
+        ranks.add(min(self.current_rank(), available))
+        dialog = RankComparisonDialog(sorted(ranks), self.render_rank_tiles, self)
+        dialog.rank_chosen.connect(self.set_rank)
+        dialog.exec()
+    
+    def render_rank_tiles(self, ranks):
+        """比較格的縮圖與說明（PSNR、預估大小）"""
+        height, width = self.original_image.shape[:2]
+        scale = min(1.0, COMPARE_THUMBNAIL / max(height, width))
+        rows, cols = nearest_indices(height, scale), nearest_indices(width, scale)
+        available = self.available_rank()
+        if max(ranks) > available:
+            self.request_rank(max(ranks))
+            self.statusBar().showMessage(
+                f"目前已分解到 k = {available}，較大的 k 以 {available} 顯示；"
+                f"背景延伸完成後再按「更新」", 5000
+            )
+        series = render_rank_series(
+            self.channel_factors(), ranks, rows, cols, float(self.channel_energies().sum())
+        )
+        estimate = "≈ " if self.preview_mode else ""
+        return [(k, frame, f"k = {k}\n{estimate}{psnr:.2f} dB\n{self.size_text(k)}")
+                for k, frame, psnr in series]
+    
     # ==================== 儲存功能 ====================
     
     def save_compressed_image(self):
@@ -581,24 +2382,530 @@ class SVDCompressionApp(QMainWindow):
         if self.compressed_image is None:
             QMessageBox.warning(self, "提醒", "尚未進行壓縮！")
             return
+        if self.preview_mode:
+            QMessageBox.information(self, "提醒", "完整解析度仍在分解中，請稍候再儲存。")
+            return
+        
+        dialog = ExportDialog(self.displayed_rank, self.size_format_combo.currentData(), self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        # svdr 的基底 rank 由編碼器決定，只輸出一個檔案
+        ranks = [self.displayed_rank] if dialog.format() == "svdr" else dialog.ranks()
+        if not ranks:
+            QMessageBox.warning(self, "提醒", "請輸入要匯出的 k！")
+            return
+        
+        fmt = dialog.format()
+        name, ext, _ = EXPORT_FORMATS[fmt]
+        if fmt == "svdp" and self.block_svd is not None:
+            QMessageBox.warning(self, "提醒", "分塊模式沒有整張的因子，無法匯出漸進串流。")
+            return
+        # 尚未分解到的 k 由 start_export 先延伸再匯出
+        ranks = sorted({min(k, self.max_rank) for k in ranks})
+        if len(ranks) == 1:
+            file_name, _ = QFileDialog.getSaveFileName(
+                self, "儲存壓縮圖片", "", f"{name} 檔案 (*{ext})"
+            )
+            if not file_name:
+                return
+            jobs = [(ranks[0], file_name)]
+        else:
+            directory = QFileDialog.getExistingDirectory(self, "選擇匯出資料夾")
+            if not directory:
+                return
+            stem = os.path.splitext(os.path.basename(self.current_path or "compressed"))[0]
+            jobs = [(k, os.path.join(directory, f"{stem}_k{k}{ext}")) for k in ranks]
+        
+        self.start_export(jobs, fmt, dialog.options())
+    
+    def start_export(self, jobs, fmt, options):
+        """在背景編碼並寫檔，狀態列顯示進度"""
+        if self.export_thread is not None and self.export_thread.isRunning():
+            QMessageBox.information(self, "提醒", "已有匯出正在進行中。")
+            return
+        
+        # 分塊、聯合模式的 k 代表相同的儲存量，所有 rank 都以該模式重建
+        factors, render, frames = self.channel_factors(), None, {}
+        if self.block_svd is not None and fmt != "svdr":
+            blocks = self.block_svd
+            render = lambda k: blocks.reconstruct(blocks.allocate(triplets=blocks.triplets_for_rank(k)))
+        elif self.joint_svd is not None and fmt != "svdr":
+            joint = self.joint_svd
+            factors = joint.channel_factors()
+            jobs = [(joint.rank_for_storage(k), path) for k, path in jobs]
+        else:
+            needed = max(k for k, _ in jobs)
+            if fmt != "svdr" and needed > self.available_rank():
+                self.pending_export = (self.channels, jobs, fmt, options)
+                self.request_rank(needed)
+                self.statusBar().showMessage(f"匯出前先延伸到 k = {needed}…")
+                return
+            # 畫面上的就是這個 k 的重建（多行程後端時不一定），不必再算一次
+            if self.compressed_image is not None and self.compute_backend is None:
+                frames[self.displayed_rank] = self.compressed_image.copy()
+        self.export_thread = ExportThread(
+            factors, jobs, fmt, options, frames, self.original_image, self, render
+        )
+        self.export_thread.progress.connect(self.on_export_progress)
+        self.export_thread.exported.connect(self.on_exported)
+        self.export_thread.failed.connect(self.on_export_failed)
+        self.export_progress.setRange(0, len(jobs))
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.export_thread.start()
+    
+    def on_export_progress(self, done, total):
+        self.export_progress.setValue(done)
+        self.statusBar().showMessage(f"匯出中… {done}/{total}")
+    
+    def on_exported(self, results):
+        """匯出完成：回報每個檔案的大小與編碼時間"""
+        self.export_progress.hide()
+        self.statusBar().showMessage("匯出完成", 3000)
+        lines = [
+            f"k = {k}：{os.path.basename(path)}  {size / (1024 * 1024):.2f} MB，"
+            f"編碼 {encode_ms:.0f} ms"
+            for k, path, size, encode_ms in results
+        ]
+        QMessageBox.information(self, "成功", "圖片已儲存！\n\n" + "\n".join(lines))
+    
+    def on_export_failed(self, message):
+        self.export_progress.hide()
+        QMessageBox.critical(self, "錯誤", f"儲存失敗：{message}")
+    
+    # ==================== 多檔佇列 ====================
+    
+    def add_to_queue(self, paths):
+        """把圖片加入佇列，並顯示第一張新加入的圖片"""
+        new_paths = [
+            p for p in paths
+            if p.lower().endswith(IMAGE_EXTENSIONS) and p not in self.queue_paths
+        ]
+        if not new_paths:
+            if paths and paths[0] in self.queue_paths:
+                self.filmstrip.setCurrentRow(self.queue_paths.index(paths[0]))
+            return
+        
+        first_row = len(self.queue_paths)
+        self.tab_bar.blockSignals(True)
+        for path in new_paths:
+            self.queue_paths.append(path)
+            self.documents[path] = Document(path)
+            self.factor_cache.retained.add(path)
+            item = QListWidgetItem(os.path.basename(path))
+            item.setToolTip(path)
+            self.filmstrip.addItem(item)
+            self.tab_bar.setTabToolTip(self.tab_bar.addTab(os.path.basename(path)), path)
+            self.prefetch_thread.submit(PrefetchThread.THUMBNAIL, path)
+        self.tab_bar.blockSignals(False)
+        
+        self.filmstrip.setVisible(len(self.queue_paths) > 1)
+        self.filmstrip.setCurrentRow(first_row)
+    
+    def show_queue_item(self, row):
+        """切換到佇列中的第 row 張（分頁），還原它的檢視狀態"""
+        if not 0 <= row < len(self.queue_paths):
+            return
+        path = self.queue_paths[row]
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.setCurrentIndex(row)
+        self.tab_bar.blockSignals(False)
+        
+        self.save_document_state()
+        self.restore_document_controls(self.documents[path])
+        self.load_image(path, notify=len(self.queue_paths) == 1)
+        self.schedule_prefetch()
+    
+    def save_document_state(self):
+        """把目前的控制項狀態記回目前的文件"""
+        doc = self.documents.get(self.current_path)
+        if doc is not None:
+            doc.ratio = self.ratio_slider.value()
+            doc.size_rank = self.size_rank
+            doc.template = self.template_combo.currentData()
+    
+    def restore_document_controls(self, doc):
+        """依文件狀態設定控制項（不觸發重建，由 load_image 統一更新）"""
+        for widget in (self.ratio_slider, self.template_combo):
+            widget.blockSignals(True)
+        self.ratio_slider.setValue(doc.ratio)
+        self.ratio_value_label.setText(f"{doc.ratio}%")
+        self.template_combo.setCurrentIndex(max(0, self.template_combo.findData(doc.template)))
+        for widget in (self.ratio_slider, self.template_combo):
+            widget.blockSignals(False)
+        self.size_rank = doc.size_rank
+        self.size_target = None
+    
+    def close_document(self, row):
+        """關閉分頁：從佇列與快取移除；關的是目前的分頁時切到相鄰的分頁"""
+        path = self.queue_paths.pop(row)
+        del self.documents[path]
+        self.factor_cache.retained.discard(path)
+        self.factor_cache.discard(path)
+        self.prefetch_skipped.discard(path)
+        for widget in (self.filmstrip, self.tab_bar):
+            widget.blockSignals(True)
+        self.filmstrip.takeItem(row)
+        self.tab_bar.removeTab(row)
+        for widget in (self.filmstrip, self.tab_bar):
+            widget.blockSignals(False)
+        self.filmstrip.setVisible(len(self.queue_paths) > 1)
+        
+        if path != self.current_path:
+            self.update_memory_usage()
+            return
+        self.current_path = None
+        if self.queue_paths:
+            row = min(row, len(self.queue_paths) - 1)
+            self.filmstrip.blockSignals(True)
+            self.filmstrip.setCurrentRow(row)
+            self.filmstrip.blockSignals(False)
+            self.show_queue_item(row)
+        else:
+            self.clear_view()
+    
+    def clear_view(self):
+        """最後一個分頁關閉後，回到尚未載入圖片的畫面"""
+        self.original_image = None
+        self.compressed_image = None
+        self.channels = None
+        self.block_svd = None
+        self.joint_svd = None
+        self.max_rank = 0
+        self.size_model = None
+        self.size_rank = None
+        self.preview_mode = False
+        self.original_image_label.clear()
+        self.original_image_label.setText("📁\n\n將圖片拖移到這邊\n或點擊下方按鈕上傳")
+        self.compressed_image_label.set_source(None, 0)
+        self.compressed_image_label.clear()
+        self.compressed_image_label.setText("壓縮預覽\n\n上傳圖片後\n調整滑桿查看效果")
+        for label, text in ((self.original_ratio_label, "？？%"),
+                            (self.original_size_label, "？？ MB"),
+                            (self.compressed_ratio_label, "？？%"),
+                            (self.compressed_size_label, "？？ MB"),
+                            (self.compressed_psnr_label, "？？ dB")):
+            label.setText(text)
+        self.quality_notifier.reset()
+        self.update_memory_usage()
+    
+    def schedule_prefetch(self):
+        """在記憶體上限內預先分解目前圖片之後的 PREFETCH_COUNT 張
+
+        一次只預取一張，放進快取後再排下一張，
+        這樣每次都能以實際用量判斷下一張放不放得下。
+        """
+        self.update_memory_usage()
+        if self.prefetching or self.current_path not in self.queue_paths:
+            return
+        
+        # 目前圖片與接下來幾張不丟，其餘的可以依 LRU 讓出空間
+        keep = self.prefetch_window()
+        held = sum(
+            image_state_nbytes(*entry)
+            for path, entry in self.factor_cache.entries.items() if path in keep
+        )
+        row = self.queue_paths.index(self.current_path)
+        for path in self.queue_paths[row + 1:row + 1 + PREFETCH_COUNT]:
+            if path in self.factor_cache or path in self.prefetch_skipped:
+                continue
+            try:
+                estimate = estimate_state_nbytes(path)
+            except OSError:
+                self.prefetch_skipped.add(path)
+                continue
+            if held + estimate > self.factor_cache.max_bytes:
+                return
+            self.prefetching.add(path)
+            self.prefetch_thread.submit(PrefetchThread.DECOMPOSE, path)
+            return
+    
+    def on_previewed(self, path, img_array, full_size):
+        """背景解碼出縮小版：先以它顯示，完整解析度分解完成後再換上"""
+        if self.opening is None or self.opening[0] != path:
+            return  # 已切換到別張
+        notify = self.opening[1]
+        self.opening = None
+        try:
+            self.show_decoded_image(path, img_array, full_size, notify)
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"載入圖片失敗：{str(e)}")
+    
+    def on_prefetched(self, path, img_array, channels):
+        """背景分解完成，放進快取"""
+        self.prefetching.discard(path)
+        if path not in self.documents:
+            return  # 分頁已關閉
+        img_array, channels = self.apply_document_transforms(path, img_array, channels)
+        if self.opening is not None and self.opening[0] == path:
+            # 小到不需要預覽的圖片：背景已解碼並分解完成，直接顯示
+            notify = self.opening[1]
+            self.opening = None
+            self.show_loaded_image(path, img_array, channels, notify)
+            self.schedule_prefetch()
+            return
+        if path == self.current_path and self.preview_mode:
+            self.factor_cache.put(
+                path, (img_array, channels), pinned=self.prefetch_window()
+            )
+            self.swap_in_full_resolution(img_array, channels)
+            self.schedule_prefetch()
+            return
+        if path in self.factor_cache:
+            return  # 使用者已先切換過去並同步載入
+        evicted = self.factor_cache.put(
+            path, (img_array, channels), pinned=self.prefetch_window()
+        )
+        if path in evicted:
+            # 單張就超過上限，之後不再預取
+            self.prefetch_skipped.add(path)
+        self.schedule_prefetch()
+    
+    def swap_in_full_resolution(self, img_array, channels):
+        """以完整解析度的分解取代預覽，保留滑桿位置"""
+        self.preview_mode = False
+        self.original_image = img_array
+        self.set_channels(channels)
+        self.display_image(self.original_image_label, img_array)
+        self.update_compression()
+        self.statusBar().showMessage("已切換為完整解析度", 3000)
+    
+    def prefetch_window(self):
+        """目前圖片與接下來 PREFETCH_COUNT 張的路徑"""
+        if self.current_path not in self.queue_paths:
+            return {self.current_path}
+        row = self.queue_paths.index(self.current_path)
+        return set(self.queue_paths[row:row + 1 + PREFETCH_COUNT])
+    
+    def on_prefetch_failed(self, path, message):
+        self.prefetching.discard(path)
+        self.prefetch_skipped.add(path)
+        if self.opening is not None and self.opening[0] == path:
+            self.opening = None
+            self.original_image_label.setText("📁\n\n將圖片拖移到這邊\n或點擊下方按鈕上傳")
+            QMessageBox.critical(self, "錯誤", f"載入圖片失敗：{message}")
+            return
+        self.statusBar().showMessage(f"無法讀取 {os.path.basename(path)}：{message}")
+    
+    def on_thumbnail_ready(self, path, thumbnail):
+        if path in self.queue_paths:
+            item = self.filmstrip.item(self.queue_paths.index(path))
+            item.setIcon(QIcon(QPixmap.fromImage(thumbnail)))
+    
+    # ==================== 記憶體保留策略 ====================
+    
+    def retention_rank(self, full_rank, size_mb, doc=None):
+        """文件的目標（比例 + 預取餘裕、依大小選出的 k、模板）最多用到的 k
+
+        doc 為 None 或目前的文件時依控制項，其餘依文件記下的狀態。
+        """
+        if doc is None or doc.path == self.current_path:
+            ratio, size_rank = self.ratio_slider.value(), self.size_rank
+            template = self.template_combo.currentData()
+        else:
+            ratio, size_rank, template = doc.ratio, doc.size_rank, doc.template
+        needed = rank_for_ratio(full_rank, ratio) + max(16, full_rank // 20)
+        if size_rank is not None:
+            needed = max(needed, size_rank)
+        
+        if template is not None:
+            target = TEMPLATES[template]
+            if "ratio" in target:
+                needed = max(needed, rank_for_ratio(full_rank, target["ratio"]))
+            else:
+                needed = max(needed, rank_for_size(full_rank, size_mb, target["size_mb"]))
+        return min(needed, full_rank)
+    
+    def trim_cached_factors(self, path, entry):
+        """把一張圖片的因子修剪到目前目標用得到的 rank"""
+        img_array, channels = entry
+        keep = self.retention_rank(
+            min(img_array.shape[:2]), img_array.nbytes / (1024 * 1024),
+            self.documents.get(path)
+        )
+        for channel in channels:
+            channel.truncate(keep)
+    
+    def memory_report(self):
+        """目前持有的每個陣列：[(名稱, 形狀, 位元組), ...]"""
+        arrays = []
+        if self.original_image is not None:
+            arrays.append(("原始圖片", self.original_image.shape, self.original_image.nbytes))
+        if self.compressed_image is not None:
+            arrays.append(("壓縮預覽", self.compressed_image.shape, self.compressed_image.nbytes))
+        if self.channels is not None:
+            for name, channel in zip("RGB" if len(self.channels) == 3 else "L", self.channels):
+                for part, arr in zip(("U", "S", "Vt"), channel.factors):
+                    arrays.append((f"{part}_{name}", arr.shape, arr.nbytes))
+                if channel.warm_start is not None:
+                    arrays.append((f"起始子空間_{name}", channel.warm_start.shape,
+                                   channel.warm_start.nbytes))
+        if self.block_svd is not None:
+            blocks = self.block_svd
+            arrays.append((f"{blocks.size}×{blocks.size} 分塊因子",
+                           (len(blocks.factors), blocks.n_blocks), blocks.nbytes()))
+        if self.joint_svd is not None:
+            arrays.append(("聯合色彩因子", (self.joint_svd.max_rank,), self.joint_svd.nbytes()))
+        if self.compute_backend is not None and self.compute_backend.store is not None:
+            arrays.append(("共享記憶體區段", (len(self.compute_backend.store.segments),),
+                           self.compute_backend.store.nbytes))
+        pixmaps = self.pixmap_nbytes()
+        if pixmaps:
+            arrays.append(("畫面 pixmap 與縮放圖塊", (), pixmaps))
+        for path, entry in self.factor_cache.entries.items():
+            if path != self.current_path:
+                state = self.factor_cache.state(path)
+                arrays.append((f"快取（{state}）：{os.path.basename(path)}", entry[0].shape,
+                               image_state_nbytes(*entry)))
+        return arrays
+    
+    def pixmap_nbytes(self):
+        """兩個 label 上的 pixmap 與縮放圖塊佔用的位元組"""
+        total = 0
+        for label in (self.original_image_label, self.compressed_image_label):
+            pixmap = label.pixmap()
+            if pixmap is not None and not pixmap.isNull():
+                total += pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        total += sum(tile.sizeInBytes() for tile in self.compressed_image_label.tiles.values())
+        return total
+    
+    def view_nbytes(self):
+        """快取以外、畫面用到的記憶體：壓縮預覽、共享記憶體區段與 pixmap"""
+        total = self.pixmap_nbytes() + self.scrub.nbytes
+        if self.block_svd is not None:
+            total += self.block_svd.nbytes()
+        if self.joint_svd is not None:
+            total += self.joint_svd.nbytes()
+        # 後端的畫面是共享區段的 view，已算在區段內
+        if self.compressed_image is not None and self.compressed_image.base is None:
+            total += self.compressed_image.nbytes
+        if self.compute_backend is not None and self.compute_backend.store is not None:
+            total += self.compute_backend.store.nbytes
+        return total
+    
+    def update_memory_usage(self):
+        """更新狀態列的記憶體用量與每個陣列的明細"""
+        arrays = self.memory_report()
+        total_mb = sum(nbytes for _, _, nbytes in arrays) / (1024 * 1024)
+        cap_mb = self.factor_cache.max_bytes / (1024 * 1024)
+        self.memory_label.setText(f"記憶體 {total_mb:.0f} / {cap_mb:.0f} MB")
+        self.memory_label.setToolTip("\n".join(
+            f"{name}  {'×'.join(map(str, shape))}  {nbytes / (1024 * 1024):.1f} MB"
+            for name, shape, nbytes in arrays
+        ))
+        self.filmstrip.setToolTip(f"已分解 {len(self.factor_cache.entries)} 張")
+        for row, path in enumerate(self.queue_paths):
+            state = self.factor_cache.state(path) or "未載入"
+            nbytes = self.factor_cache.entry_nbytes(path)
+            self.tab_bar.setTabToolTip(
+                row, f"{path}\n{state}  {nbytes / (1024 * 1024):.1f} MB"
+            )
+    
+    # ==================== 漸進式串流 ====================
+    
+    def export_progressive_stream(self):
+        """以目前的 k 匯出漸進式串流檔"""
+        if self.original_image is None:
+            QMessageBox.warning(self, "提醒", "請先上傳圖片！")
+            return
+        if self.preview_mode:
+            QMessageBox.information(self, "提醒", "完整解析度仍在分解中，請稍候再匯出。")
+            return
         
         file_name, _ = QFileDialog.getSaveFileName(
-            self, "儲存壓縮圖片", "", "PNG 檔案 (*.png);;JPEG 檔案 (*.jpg)"
+            self, "匯出漸進串流", "", "漸進串流 (*.svdp)"
         )
         
         if file_name:
-            try:
-                img = Image.fromarray(self.compressed_image)
-                img.save(file_name)
-                QMessageBox.information(self, "成功", "圖片已儲存！")
-            except Exception as e:
-                QMessageBox.critical(self, "錯誤", f"儲存失敗：{str(e)}")
+            self.start_export([(self.displayed_rank, file_name)], "svdp", {})
+    
+    def open_stream_viewer(self):
+        """從本機檔案或 socket 讀取漸進式串流並逐段顯示"""
+        source_type, ok = QInputDialog.getItem(
+            self, "串流檢視", "串流來源：", ["本機檔案", "本機 socket"], 0, False
+        )
+        if not ok:
+            return
+        
+        if source_type == "本機檔案":
+            file_name, _ = QFileDialog.getOpenFileName(
+                self, "開啟漸進串流", "", "漸進串流 (*.svdp)"
+            )
+            if not file_name:
+                return
+            source = file_name
+        else:
+            port, ok = QInputDialog.getInt(
+                self, "串流檢視", "localhost 連接埠：", 5005, 1, 65535
+            )
+            if not ok:
+                return
+            source = ("127.0.0.1", port)
+        
+        self.stop_stream_viewer()
+        self.stream_thread = StreamReaderThread(source, self)
+        self.stream_thread.frame_ready.connect(self.on_stream_frame)
+        self.stream_thread.failed.connect(
+            lambda msg: QMessageBox.critical(self, "錯誤", f"串流讀取失敗：{msg}")
+        )
+        self.stream_thread.start()
+        self.statusBar().showMessage("等待串流資料…")
+    
+    def stop_stream_viewer(self):
+        """停止目前的串流讀取"""
+        if self.stream_thread is not None:
+            self.stream_thread.requestInterruption()
+            self.stream_thread.wait()
+            self.stream_thread = None
+    
+    def on_stream_frame(self, frame, received, total, rank):
+        """每收到一段就更新壓縮預覽"""
+        self.compressed_image = frame
+        self.display_image(self.compressed_image_label, frame)
+        self.compressed_image_label.set_source(None, 0)
+        
+        percent = received / total * 100 if total else 0
+        self.compressed_ratio_label.setText(f"{percent:.1f}%")
+        self.compressed_size_label.setText(f"{received / (1024 * 1024):.2f} MB")
+        if self.original_image is not None and self.original_image.shape == frame.shape:
+            psnr = self.calculate_psnr(self.original_image, frame)
+            self.compressed_psnr_label.setText(f"{psnr:.2f} dB")
+        else:
+            self.compressed_psnr_label.setText("— dB")
+        self.statusBar().showMessage(f"串流已接收 {percent:.1f}%（k = {rank}）")
+    
+    def closeEvent(self, event):
+        """關閉視窗前停止背景工作"""
+        self.stop_stream_viewer()
+        self.prefetch_thread.stop()
+        self.scrub.stop()
+        if self.compute_backend is not None:
+            self.release_backend_frame()
+            self.compute_backend.shutdown()
+            self.compute_backend = None
+        if self.rank_thread is not None:
+            self.rank_thread.wait()
+        if self.export_thread is not None:
+            self.export_thread.wait()
+        if self.size_thread is not None:
+            self.size_thread.wait()
+        for thread in list(self.block_threads):
+            thread.wait()
+        self.factor_cache.close()
+        super().closeEvent(event)
 
 
-# 主程式
-if __name__ == "__main__":
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command:
+        return args.func(args)
+    
     app = QApplication(sys.argv)
     window = SVDCompressionApp()
     window.show()
-    sys.exit(app.exec_())
+    return app.exec()
 
+
+# 主程式
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2709 @@
+"""SVD 影像壓縮引擎：分解、重建、編碼格式、壓縮服務與命令列
+
+不依賴 Qt，壓縮服務、資料夾監看等無視窗的命令直接執行此檔即可；
+圖形介面 (SVD_app.py) 也從這裡匯入。
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import platform
+import math
+import argparse
+import asyncio
+import json
+import hashlib
+import signal
+import socket
+import struct
+import time
+import threading
+import urllib.parse
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, wait as wait_futures
+import numpy as np
+from PIL import Image
+try:
+    import scipy.linalg
+except ImportError:  # scipy 是選用的，沒有時只少了 LAPACK 驅動程式的選項
+    scipy = None
+import io
+import zlib
+
+
+# ==================== SVD 引擎 ====================
+#
+# 與視窗無關的分解 / 重建 / 品質計算，
+# 供 SVDCompressionApp、命令列與壓縮服務共用。
+
+# 預設模板：名稱 → 目標（與控制面板的模板相同）
+TEMPLATES = {
+    "social": {"size_mb": 2},    # 社群媒體 (2 MB, 快速上傳)
+    "email": {"size_mb": 5},     # 郵件附件 (5 MB, 平衡)
+    "archive": {"ratio": 80},    # 高品質存檔
+}
+
+
+# 以單一通道處理的 Pillow 模式（I、I;16*、F 的樣本超過 8 位元，需先縮放）
+GRAY_MODES = ("1", "L", "LA", "I", "I;16", "I;16L", "I;16B", "F")
+# 可開啟的圖片副檔名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".svdr")
+
+
+def scale_to_uint8(values):
+    """16 / 32 位元整數或浮點灰階 → uint8
+
+    超出 8 位元的資料依位元深度縮小（16 位元右移 8 位），而不是截在 255；
+    0..1 的浮點數視為正規化亮度。
+    """
+    peak = values.max(initial=0)
+    if values.dtype.kind == "f" and peak <= 1.0:
+        values = values * 255.0
+    elif peak > 255:
+        values = values / (256.0 if peak < 65536 else peak / 255.0)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def image_to_array(img):
+    """PIL 圖片 → (高, 寬, 通道) uint8 陣列
+
+    灰階圖片、以及三個通道完全相同的 RGB 圖片只保留一個通道，
+    之後的分解、重建與 PSNR 都只需做三分之一的工作。
+    """
+    if img.mode in ("1", "L", "LA"):
+        return np.array(img.convert("L"))[:, :, None]
+    if img.mode in GRAY_MODES:
+        return scale_to_uint8(np.array(img))[:, :, None]
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img_array = np.array(img)
+    r = img_array[:, :, 0]
+    if np.array_equal(r, img_array[:, :, 1]) and np.array_equal(r, img_array[:, :, 2]):
+        return img_array[:, :, :1].copy()
+    return img_array
+
+
+def decode_image(source):
+    """讀取圖片（路徑或 bytes，含 .svdr）為 (高, 寬, 1 或 3) 的 numpy 陣列"""
+    if not isinstance(source, bytes):
+        with open(source, "rb") as f:
+            if f.read(len(RESIDUAL_MAGIC)) == RESIDUAL_MAGIC:
+                return decode_near_lossless(RESIDUAL_MAGIC + f.read())
+    elif source.startswith(RESIDUAL_MAGIC):
+        return decode_near_lossless(source)
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    return image_to_array(img)
+
+
+def shrink_array(img_array, size):
+    """已解碼的 (高, 寬, 通道) 陣列縮小到 size 以內"""
+    img = Image.fromarray(img_array[:, :, 0] if img_array.shape[2] == 1 else img_array)
+    img.thumbnail(size)
+    return image_to_array(img)
+
+
+def preview_needs_full_decode(path, size):
+    """大於 size 的縮小版是否得先整張解碼（只有 JPEG 能在解碼時直接縮小）"""
+    if path.lower().endswith(".svdr"):
+        return True
+    with Image.open(path) as img:
+        return img.format != "JPEG" and (img.width > size[0] or img.height > size[1])
+
+
+def decode_preview(path, size):
+    """快速解碼縮小版圖片（JPEG 直接在解碼時縮小），回傳 (陣列, 原始 (寬, 高))
+
+    不大於 size 的圖片回傳的就是完整解析度，與 decode_image 相同。
+    """
+    if path.lower().endswith(".svdr"):
+        img_array = decode_image(path)
+        return shrink_array(img_array, size), (img_array.shape[1], img_array.shape[0])
+    with Image.open(path) as img:
+        full_size = img.size
+        if img.mode in GRAY_MODES and img.mode not in ("1", "L", "LA"):
+            # 高位元深度灰階：convert("L") 會截在 255，先縮放成 8 位元再縮小
+            return shrink_array(image_to_array(img), size), full_size
+        mode = "L" if img.mode in GRAY_MODES else "RGB"
+        img.draft(mode, size)
+        img = img.convert(mode)
+    img.thumbnail(size)
+    return image_to_array(img), full_size
+
+
+def svd_channels(img_array):
+    """對每個通道分別進行 SVD（灰階只有一個通道），回傳 [(U, S, Vt), ...]"""
+    if img_array.ndim == 2:
+        img_array = img_array[:, :, None]
+
+    return [fast_svd(img_array[:, :, c].astype(float)) for c in range(img_array.shape[2])]
+
+
+# ==================== SVD 後端 ====================
+#
+# 每個後端都是 svd(A, k) → (U, S, Vt)，S 由大到小；k 為 None 時回傳完整的
+# 精簡 SVD，否則至少回傳前 k 個三元組。fast_svd 依自動調校的結果挑選。
+
+SVD_BACKENDS = {}
+
+
+def svd_backend(name, partial_only=False):
+    """註冊 SVD 後端；partial_only 的後端只在要求前 k 個時參與比較"""
+    def register(func):
+        func.partial_only = partial_only
+        SVD_BACKENDS[name] = func
+        return func
+    return register
+
+
+@svd_backend("numpy")
+def svd_numpy(A, k=None):
+    return np.linalg.svd(A, full_matrices=False)
+
+
+if scipy is not None:
+    @svd_backend("scipy-gesdd")
+    def svd_scipy_gesdd(A, k=None):
+        return scipy.linalg.svd(A, full_matrices=False, lapack_driver="gesdd",
+                                check_finite=False)
+
+    @svd_backend("scipy-gesvd")
+    def svd_scipy_gesvd(A, k=None):
+        return scipy.linalg.svd(A, full_matrices=False, lapack_driver="gesvd",
+                                check_finite=False)
+
+
+@svd_backend("gram-eigh")
+def svd_gram(A, k=None):
+    """對較小一側的 Gram 矩陣做特徵分解；條件數平方，極小的奇異值較不準"""
+    m, n = A.shape
+    wide = m <= n
+    G = A @ A.T if wide else A.T @ A
+    w, V = np.linalg.eigh(G)
+    w, V = w[::-1], V[:, ::-1]
+    if k is not None:
+        w, V = w[:k], V[:, :k]
+    S = np.sqrt(np.clip(w, 0, None))
+    # 奇異值為 0 的方向對重建沒有貢獻，另一側向量設為 0
+    inv = np.divide(1.0, S, out=np.zeros_like(S), where=S > S[0] * 1e-12)
+    if wide:
+        return V, S, (V.T @ A) * inv[:, None]
+    return (A @ V) * inv, S, V.T
+
+
+@svd_backend("randomized", partial_only=True)
+def svd_randomized(A, k, oversample=10, power_iters=3):
+    """隨機化子空間疊代，只算前 k 個"""
+    l = min(k + oversample, min(A.shape))
+    rng = np.random.default_rng(0)
+    Q = np.linalg.qr(A @ rng.standard_normal((A.shape[1], l)))[0]
+    for _ in range(power_iters):
+        Q = np.linalg.qr(A @ np.linalg.qr(A.T @ Q)[0])[0]
+    U_b, S, Vt = np.linalg.svd(Q.T @ A, full_matrices=False)
+    return (Q @ U_b)[:, :k], S[:k], Vt[:k]
+
+
+# 調校結果存放的位置（可用環境變數 SVD_AUTOTUNE_PATH 指定）
+AUTOTUNE_PATH = os.environ.get(
+    "SVD_AUTOTUNE_PATH", os.path.join(os.path.expanduser("~"), ".svd_app_autotune.json")
+)
+# 超過此元素數的矩陣改在同長寬比、同 rank 比例的中央區塊上實測
+AUTOTUNE_MAX_ELEMENTS = 512 * 512
+# rank-k 近似誤差比參考結果大超過此比例，就視為不準確
+AUTOTUNE_RTOL = 1e-3
+
+
+class SVDAutotuner:
+    """依 (形狀級距, dtype, rank 級距) 挑選最快且準確的 SVD 後端
+
+    第一次遇到某個級距時，把每個後端各跑一次並計時，在幾個截斷 rank 上
+    檢查近似誤差（以各後端中最小的為參考，依 Eckart-Young 不可能低於
+    最佳值）並要求奇異值遞減，不準確的後端淘汰；最快的留下並寫入 JSON，
+    之後直接使用。小矩陣直接在實際資料上實測，結果也直接回傳不會白算；
+    大矩陣在縮小的中央區塊上實測，免得慢的後端（如 gesvd）拖上數十秒。
+    """
+
+    def __init__(self, path=AUTOTUNE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.table = None
+        self.machine = f"{platform.machine()}-{os.cpu_count()}-numpy{np.__version__}"
+
+    def load(self):
+        """讀取調校結果；換了機器或 numpy 版本就重新調校"""
+        self.table = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("machine") == self.machine:
+            self.table = data.get("winners", {})
+
+    def save(self):
+        data = {"machine": self.machine, "winners": self.table}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # 無法寫入時只是下次要重新調校
+
+    @staticmethod
+    def bucket(shape, dtype, k):
+        """形狀取最接近的 2 的次方；rank 以佔完整 rank 的比例分級"""
+        m, n = (2 ** round(math.log2(max(d, 1))) for d in shape)
+        if k is None or k >= min(shape):
+            rank = "full"
+        else:
+            fraction = k / min(shape)
+            rank = next(f"<={f}" for f in (0.05, 0.2, 0.4, 1.0) if fraction <= f)
+        return f"{m}x{n}/{np.dtype(dtype).name}/{rank}"
+
+    def candidates(self, k):
+        return [name for name, func in SVD_BACKENDS.items()
+                if k is not None or not func.partial_only]
+
+    def choose(self, A, k):
+        """已調校時回傳後端名稱，否則回傳 None"""
+        with self.lock:
+            if self.table is None:
+                self.load()
+            name = self.table.get(self.bucket(A.shape, A.dtype, k))
+            return name if name in SVD_BACKENDS else None
+
+    @staticmethod
+    def proxy(A, k):
+        """大矩陣取同長寬比的中央區塊，rank 依比例縮小"""
+        if A.size <= AUTOTUNE_MAX_ELEMENTS:
+            return A, k
+        scale = math.sqrt(AUTOTUNE_MAX_ELEMENTS / A.size)
+        m, n = (max(1, int(d * scale)) for d in A.shape)
+        top, left = (A.shape[0] - m) // 2, (A.shape[1] - n) // 2
+        block = A[top:top + m, left:left + n]
+        if k is not None:
+            k = max(1, round(k * min(m, n) / min(A.shape)))
+        return block, k
+
+    def tune(self, A, k):
+        """每個候選後端各跑一次，記下最快且準確的，回傳 A 的 SVD"""
+        B, k_b = self.proxy(A, k)
+        results = {}
+        for name in self.candidates(k_b):
+            start = time.perf_counter()
+            try:
+                factors = SVD_BACKENDS[name](B, k_b)
+            except (np.linalg.LinAlgError, ValueError, MemoryError):
+                continue
+            results[name] = (time.perf_counter() - start, factors)
+
+        if not results:
+            raise np.linalg.LinAlgError("所有 SVD 後端都失敗")
+
+        # 完整 rank 的重建誤差每個後端都近乎 0，要在截斷處比較才看得出差別
+        rank = min(B.shape) if k_b is None else k_b
+        ranks = sorted({max(1, rank // 8), max(1, rank // 2), rank})
+        norm = np.linalg.norm(B)
+
+        def errors(factors):
+            U, S, Vt = factors
+            return np.array([np.linalg.norm(B - (U[:, :j] * S[:j]) @ Vt[:j]) for j in ranks])
+
+        measured = {name: errors(factors) for name, (_, factors) in results.items()}
+        reference = np.min(list(measured.values()), axis=0)
+        accurate = {
+            name: result for name, result in results.items()
+            if np.all(measured[name] <= reference * (1 + AUTOTUNE_RTOL) + norm * 1e-7)
+            and np.all(np.diff(result[1][1][:rank]) <= norm * 1e-12)
+        }
+        if not accurate:
+            raise np.linalg.LinAlgError("沒有後端通過準確度檢查")
+        winner = min(accurate, key=lambda name: accurate[name][0])
+        with self.lock:
+            self.table[self.bucket(A.shape, A.dtype, k)] = winner
+            self.save()
+        if B is A:
+            return accurate[winner][1]
+        return SVD_BACKENDS[winner](A, k)
+
+
+SVD_TUNER = SVDAutotuner()
+
+
+def fast_svd(A, k=None):
+    """以自動調校挑出的後端計算 SVD（k 為 None 時為完整的精簡 SVD）"""
+    name = SVD_TUNER.choose(A, k)
+    if name is None:
+        return SVD_TUNER.tune(A, k)
+    return SVD_BACKENDS[name](A, k)
+
+
+# 通道的完整 rank 超過此值才先做截斷分解
+TRUNCATE_MIN_RANK = 600
+# 截斷分解一開始先算的三元組數
+INITIAL_RANK = 64
+# 延伸目標超過完整 rank 的這個比例時，直接做完整 SVD 比較快
+FULL_SVD_FRACTION = 0.4
+
+
+class ChannelSVD:
+    """單一通道的 SVD，記錄已算出的三元組數，需要時再往後延伸
+
+    延伸時對緊縮後的矩陣 A - U_k·diag(S_k)·Vt_k 做隨機化子空間疊代，
+    找出第 k+1 個之後的方向，前段不必重算；再於新舊方向合起來的子空間上
+    做一次 Rayleigh-Ritz，讓 U、Vt 保持正交、S 保持遞減。
+    上一輪多取的方向會留下來當下一輪的起始子空間。
+
+    extend 在背景執行緒中持有 lock；truncate、compact、restore 由畫面執行緒
+    呼叫，拿不到 lock 時直接略過，不會蓋掉延伸的結果，也不必等待。
+    """
+
+    def __init__(self, channel, rank=None, oversample=10, power_iters=3):
+        self.channel = channel
+        self.full_rank = min(channel.shape)
+        self.oversample = oversample
+        self.power_iters = power_iters
+        self.warm_start = None
+        self.rng = np.random.default_rng(0)
+        self.lock = threading.Lock()
+
+        if rank is None or rank >= self.full_rank * FULL_SVD_FRACTION:
+            self.factors = fast_svd(channel.astype(float))
+        else:
+            m, n = channel.shape
+            self.factors = (np.zeros((m, 0)), np.zeros(0), np.zeros((0, n)))
+            self.extend(rank)
+
+    @classmethod
+    def from_factors(cls, channel, factors):
+        """以已算好的 (U, S, Vt) 建立，不重新分解"""
+        svd = cls(channel, rank=0)
+        svd.factors = factors
+        return svd
+
+    @property
+    def rank(self):
+        """已算出的三元組數"""
+        return len(self.factors[1])
+
+    @property
+    def compacted(self):
+        return self.factors[0].dtype == np.float16
+
+    def compact(self):
+        """U、Vt 改存 float16，記憶體約剩四分之一（重建誤差遠小於 uint8 量化）"""
+        if self.compacted or not self.lock.acquire(blocking=False):
+            return
+        try:
+            U, S, Vt = self.factors
+            self.factors = (U.astype(np.float16), S, Vt.astype(np.float16))
+            self.warm_start = None
+        finally:
+            self.lock.release()
+
+    def restore(self):
+        """把 compact() 過的因子轉回 float64（延伸中則略過，延伸的結果本來就是 float64）"""
+        if not self.compacted or not self.lock.acquire(blocking=False):
+            return
+        try:
+            U, S, Vt = self.factors
+            self.factors = (U.astype(float), S, Vt.astype(float))
+        finally:
+            self.lock.release()
+
+    def truncate(self, k):
+        """只保留前 k 個三元組，釋放其餘的記憶體（之後仍可再 extend；延伸中則略過）"""
+        if k >= self.rank or not self.lock.acquire(blocking=False):
+            return
+        try:
+            U, S, Vt = self.factors
+            self.factors = (U[:, :k].copy(), S[:k].copy(), Vt[:k, :].copy())
+            self.warm_start = None
+        finally:
+            self.lock.release()
+
+    @property
+    def nbytes(self):
+        """U、S、Vt 與起始子空間佔用的位元組"""
+        total = sum(arr.nbytes for arr in self.factors)
+        if self.warm_start is not None:
+            total += self.warm_start.nbytes
+        return total
+
+    def extend(self, k):
+        """把三元組延伸到 k 個（不重算已有的前段）"""
+        with self.lock:
+            self._extend(k)
+
+    def _extend(self, k):
+        k = min(k, self.full_rank)
+        U, S, Vt = self.factors
+        p = k - len(S)
+        if p <= 0:
+            return
+        if k >= self.full_rank * FULL_SVD_FRACTION:
+            self.factors = fast_svd(self.channel.astype(float))
+            self.warm_start = None
+            return
+
+        A = self.channel.astype(float)
+        n = A.shape[1]
+        l = min(p + self.oversample, self.full_rank - len(S))
+
+        def deflated(X):
+            # (A - U S Vt) X
+            return A @ X - U @ (S[:, None] * (Vt @ X))
+
+        def deflated_t(Y):
+            # (A - U S Vt)^T Y
+            return A.T @ Y - Vt.T @ (S[:, None] * (U.T @ Y))
+
+        def orth(Y, basis):
+            # 去掉已知的奇異向量方向，避免數值誤差讓前段重新混入
+            return np.linalg.qr(Y - basis @ (basis.T @ Y))[0]
+
+        # 起始子空間：上一輪多取的方向 + 隨機方向
+        omega = self.rng.standard_normal((n, l))
+        if self.warm_start is not None:
+            warm = self.warm_start[:, :l]
+            omega[:, :warm.shape[1]] = warm
+
+        Q = orth(deflated(omega), U)
+        for _ in range(self.power_iters):
+            Z = orth(deflated_t(Q), Vt.T)
+            Q = orth(deflated(Z), U)
+
+        # Rayleigh-Ritz：在 [U | Q] 張成的子空間上做一次小矩陣 SVD，
+        # 新舊三元組一起重新正交化並依奇異值排序，不只是接在後面
+        B = np.linalg.qr(np.hstack([U, Q]))[0]
+        U_b, S_b, Vt_b = np.linalg.svd(B.T @ A, full_matrices=False)
+        self.warm_start = Vt_b[k:].T if len(S_b) > k else None
+        self.factors = (B @ U_b[:, :k], S_b[:k], Vt_b[:k])
+
+
+def decompose_image(img_array):
+    """依圖片大小決定是否截斷，回傳各通道的 ChannelSVD"""
+    full_rank = min(img_array.shape[:2])
+    rank = None if full_rank <= TRUNCATE_MIN_RANK else INITIAL_RANK
+    return [ChannelSVD(img_array[:, :, c], rank) for c in range(img_array.shape[2])]
+
+
+def image_state_nbytes(img_array, channels):
+    """一張已分解圖片（原圖 + 各通道因子）佔用的位元組"""
+    return img_array.nbytes + sum(channel.nbytes for channel in channels)
+
+
+def estimate_state_nbytes(path):
+    """只讀檔頭，估計 decompose_image 後佔用的位元組"""
+    with Image.open(path) as img:
+        width, height = img.size
+        n_channels = 1 if img.mode in GRAY_MODES else 3
+    full_rank = min(width, height)
+    rank = full_rank if full_rank <= TRUNCATE_MIN_RANK else INITIAL_RANK
+    return n_channels * (height * width + 8 * rank * (height + width + 1))
+
+
+# ==================== 因子上的幾何變換 ====================
+#
+# A = U·diag(S)·Vt，所以旋轉、翻轉、轉置只是重新排列因子：
+# 上下翻轉反轉 U 的列、左右翻轉反轉 Vt 的欄、轉置交換 U 與 Vt，
+# 旋轉 90° 則是轉置再翻轉一次。U、Vt 仍然正交，S 不變，回傳的都是 view。
+# 縮放 A' = R_h·A·R_wᵀ 是分別乘在 U 與 Vt 上的線性映射，之後以兩次 QR
+# 與 r×r 核心的小 SVD 恢復正交，仍不必重新分解整張圖片。
+
+GEOMETRIC_TRANSFORMS = {
+    "rot90": "逆時針旋轉 90°",
+    "rot270": "順時針旋轉 90°",
+    "rot180": "旋轉 180°",
+    "flip_h": "左右翻轉",
+    "flip_v": "上下翻轉",
+    "transpose": "轉置",
+    "resize": "縮放",
+}
+
+
+def transform_array(array, op):
+    """對 (H, W, ...) 陣列做與 transform_factors 相同的變換（不含縮放）"""
+    if op == "transpose":
+        return array.swapaxes(0, 1)
+    if op == "flip_v":
+        return array[::-1]
+    if op == "flip_h":
+        return array[:, ::-1]
+    if op == "rot180":
+        return array[::-1, ::-1]
+    if op == "rot90":
+        return array.swapaxes(0, 1)[::-1]
+    if op == "rot270":
+        return array.swapaxes(0, 1)[:, ::-1]
+    raise ValueError(f"未知的變換：{op}")
+
+
+def transform_factors(factors, op):
+    """對單一通道的 (U, S, Vt) 做旋轉、翻轉或轉置"""
+    U, S, Vt = factors
+    if op == "transpose":
+        return Vt.T, S, U.T
+    if op == "flip_v":
+        return U[::-1], S, Vt
+    if op == "flip_h":
+        return U, S, Vt[:, ::-1]
+    if op == "rot180":
+        return U[::-1], S, Vt[:, ::-1]
+    if op == "rot90":
+        return Vt.T[::-1], S, U.T
+    if op == "rot270":
+        return Vt.T, S, U.T[:, ::-1]
+    raise ValueError(f"未知的變換：{op}")
+
+
+def resample_rows(M, n_out):
+    """沿第 0 軸做面積平均重取樣：(n_in, r) → (n_out, r)，與 resize_array 的 BOX 濾鏡相同
+
+    以累積和在格線上線性內插求積分，不必建出 n_out × n_in 的矩陣。
+    """
+    n_in = M.shape[0]
+    M = M.astype(float)
+    edges = np.linspace(0, n_in, n_out + 1)
+    cumulative = np.vstack([np.zeros((1, M.shape[1])), np.cumsum(M, axis=0)])
+    base = np.minimum(edges.astype(int), n_in - 1)
+    integral = cumulative[base] + (edges - base)[:, None] * M[base]
+    return np.diff(integral, axis=0) * (n_out / n_in)
+
+
+def resize_factors(factors, height, width, rank=None):
+    """把 (U, S, Vt) 縮放成 height × width 的分解（最多保留 rank 個三元組）
+
+    R_h·U 與 Vt·R_wᵀ 不再正交，以 QR 拆出正交部分後，
+    對 r×r 的核心 R_u·diag(S)·R_vᵀ 做 SVD 重新排序三元組。
+    之後 extend() 會對新通道與這組因子的差做延伸，補回被丟掉的部分。
+    """
+    # 超過新尺寸完整 rank 的三元組多半是縮小時被平均掉的細節，先丟掉
+    r = min(len(factors[1]), height, width, rank or len(factors[1]))
+    U, S, Vt = factors[0][:, :r], factors[1][:r], factors[2][:r]
+    Q_u, R_u = np.linalg.qr(resample_rows(U, height))
+    Q_v, R_v = np.linalg.qr(resample_rows(Vt.T, width))
+    U_c, S_c, Vt_c = fast_svd((R_u * S) @ R_v.T)
+    return Q_u @ U_c, S_c, Vt_c @ Q_v.T
+
+
+def resize_array(img_array, height, width):
+    """以面積平均（PIL 的 BOX 濾鏡）縮放 (H, W, C) 的 uint8 圖片"""
+    img = Image.fromarray(img_array[:, :, 0] if img_array.shape[2] == 1 else img_array)
+    return image_to_array(img.resize((width, height), Image.Resampling.BOX))
+
+
+def transform_image(img_array, channels, op, scale=1.0, rank=None):
+    """對原圖與各通道的 ChannelSVD 一起做幾何變換，回傳 (新原圖, 新通道)
+
+    op 為 GEOMETRIC_TRANSFORMS 的鍵；"resize" 依 scale 縮放，
+    成本隨保留的三元組數增加，rank 可限制只縮放前段（其餘之後再延伸）。
+    """
+    if op == "resize":
+        height = max(1, round(img_array.shape[0] * scale))
+        width = max(1, round(img_array.shape[1] * scale))
+        img_array = resize_array(img_array, height, width)
+        factors = [resize_factors(channel.factors, height, width, rank) for channel in channels]
+    else:
+        img_array = np.ascontiguousarray(transform_array(img_array, op))
+        factors = [transform_factors(channel.factors, op) for channel in channels]
+    # 通道指向新原圖的切片，舊原圖才能釋放；起始子空間不再適用
+    return img_array, [
+        ChannelSVD.from_factors(img_array[:, :, c], f) for c, f in enumerate(factors)
+    ]
+
+
+class FactorCache:
+    """已分解圖片的 LRU 快取，也是整個程式的記憶體管理者
+
+    總用量（快取項目 + external() 回報的畫面、pixmap 等）超過上限時依序：
+      1. 對每個項目（含 pinned）呼叫 trim(鍵, 項目) 修剪目標用不到的三元組
+      2. 由最久未用的開始把不在 pinned 中的因子壓成 float16
+      3. 不在 pinned 中、retained 中的鍵（開啟中的文件）寫到磁碟，其餘丟棄
+    正在背景延伸的通道不會被修剪或壓縮（見 ChannelSVD）。
+    寫到磁碟的項目在 get() 時自動讀回並轉回 float64。
+    """
+
+    def __init__(self, max_bytes, trim=None, external=None):
+        self.max_bytes = max_bytes
+        self.trim = trim
+        self.external = external
+        self.entries = OrderedDict()  # 路徑 → (原圖, 各通道 ChannelSVD)
+        self.retained = set()         # 超過上限時寫到磁碟而不丟棄的鍵
+        self.spilled = {}             # 路徑 → 磁碟上的 .npz
+        self.spill_dir = None
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.spilled
+
+    def get(self, key):
+        if key in self.spilled:
+            self.entries[key] = self.load_spilled(key)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            for channel in entry[1]:
+                channel.restore()
+        return entry
+
+    def put(self, key, entry, pinned=()):
+        """放入（或更新為最近使用），回傳因此被丟棄的鍵"""
+        self.discard(key)
+        self.entries[key] = entry
+        return self.evict(pinned)
+
+    def discard(self, key):
+        """移除一個項目（含磁碟上的副本）"""
+        self.entries.pop(key, None)
+        path = self.spilled.pop(key, None)
+        if path is not None:
+            os.remove(path)
+
+    def evict(self, pinned=()):
+        """依 trim → float16 → 磁碟 / 丟棄的順序降到上限以下
+
+        trim 套用在所有項目上（只修掉目標用不到的 rank）；壓縮、寫到磁碟
+        與丟棄略過 pinned 中的鍵。
+        """
+        if self.trim is not None and self.total_bytes() > self.max_bytes:
+            for key, entry in self.entries.items():
+                self.trim(key, entry)
+        for key, (_, channels) in self.entries.items():
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if key not in pinned:
+                for channel in channels:
+                    channel.compact()
+        evicted = []
+        for key in list(self.entries):
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if key in pinned:
+                continue
+            if key in self.retained and self.spill(key):
+                continue
+            del self.entries[key]
+            evicted.append(key)
+        return evicted
+
+    def spill(self, key):
+        """把項目寫到暫存資料夾並釋放記憶體；寫入失敗回傳 False"""
+        img_array, channels = self.entries[key]
+        arrays = {"original": img_array}
+        for c, channel in enumerate(channels):
+            arrays[f"U{c}"], arrays[f"S{c}"], arrays[f"Vt{c}"] = channel.factors
+        try:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="svd_spill_")
+            fd, path = tempfile.mkstemp(suffix=".npz", dir=self.spill_dir)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+        except OSError:
+            return False
+        del self.entries[key]
+        self.spilled[key] = path
+        return True
+
+    def load_spilled(self, key):
+        path = self.spilled.pop(key)
+        with np.load(path) as data:
+            img_array = data["original"]
+            channels = [
+                ChannelSVD.from_factors(
+                    img_array[:, :, c], (data[f"U{c}"], data[f"S{c}"], data[f"Vt{c}"])
+                )
+                for c in range(img_array.shape[2])
+            ]
+        os.remove(path)
+        return img_array, channels
+
+    def state(self, key):
+        """項目目前的存放方式：記憶體 / float16 / 磁碟；不在快取中回傳 None"""
+        if key in self.spilled:
+            return "磁碟"
+        if key not in self.entries:
+            return None
+        return "float16" if self.entries[key][1][0].compacted else "記憶體"
+
+    def entry_nbytes(self, key):
+        entry = self.entries.get(key)
+        return image_state_nbytes(*entry) if entry is not None else 0
+
+    def nbytes(self):
+        return sum(image_state_nbytes(*entry) for entry in self.entries.values())
+
+    def total_bytes(self):
+        external = self.external() if self.external is not None else 0
+        return self.nbytes() + external
+
+    def close(self):
+        """刪除暫存資料夾"""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+        self.spilled.clear()
+
+
+def reconstruct_channel(U, S, Vt, k):
+    """重建單一通道"""
+    U_k = U[:, :k]
+    S_k = S[:k]
+    Vt_k = Vt[:k, :]
+    return np.dot(U_k, np.dot(np.diag(S_k), Vt_k))
+
+
+def factors_max_rank(factors):
+    return min(len(S) for _, S, _ in factors)
+
+
+def reconstruct_from_factors(factors, k):
+    """由 [(U, S, Vt), ...] 重建 RGB 圖片"""
+    k = max(1, min(k, factors_max_rank(factors)))
+    height, width = factors[0][0].shape[0], factors[0][2].shape[1]
+    # 逐通道寫入 uint8，同一時間只有一個通道的浮點暫存
+    img_approx = np.empty((height, width, len(factors)), dtype=np.uint8)
+    for c, (U, S, Vt) in enumerate(factors):
+        np.clip(reconstruct_channel(U, S, Vt, k), 0, 255, out=img_approx[:, :, c], casting="unsafe")
+    return img_approx
+
+
+def reconstruct_region(factors, k, rows, cols):
+    """只重建指定的列與欄：U[rows, :k]·diag(S[:k])·Vt[:k, cols]"""
+    k = max(1, min(k, factors_max_rank(factors)))
+    region = np.empty((len(rows), len(cols), len(factors)), dtype=np.uint8)
+    for c, (U, S, Vt) in enumerate(factors):
+        block = (U[rows, :k] * S[:k]) @ Vt[:k, cols]
+        np.clip(block, 0, 255, out=region[:, :, c], casting="unsafe")
+    return region
+
+
+def nearest_indices(n, scale):
+    """縮放 scale 倍時，每個輸出像素對應的來源索引（最近鄰）"""
+    return np.minimum(((np.arange(max(1, round(n * scale))) + 0.5) / scale).astype(int), n - 1)
+
+
+def channel_energies(img_array):
+    """各通道像素值的平方和（Frobenius 範數平方），(通道,) 陣列"""
+    return np.square(img_array, dtype=np.uint32).sum(axis=(0, 1), dtype=np.uint64).astype(float)
+
+
+def render_rank_series(factors, ranks, rows, cols, energy=None):
+    """一次畫出多個 rank 的縮圖，回傳 [(k, 縮圖, 估計 PSNR 或 None), ...]
+
+    依 rank 順序把三元組累加到取樣後的畫布上，每到一個要求的 k 就取快照，
+    總成本與只畫最大的 k 相同。給了原圖能量（channel_energies 的總和）時以 Eckart-Young
+    估計完整解析度的 PSNR（原圖能量減去前 k 個奇異值的平方和）。
+    """
+    max_rank = factors_max_rank(factors)
+    ranks = sorted({max(1, min(int(k), max_rank)) for k in ranks})
+    canvases = [np.zeros((len(rows), len(cols)), dtype=np.float32) for _ in factors]
+    n_values = sum(U.shape[0] * Vt.shape[1] for U, _, Vt in factors)
+    series, start = [], 0
+    for k in ranks:
+        frame = np.empty((len(rows), len(cols), len(factors)), dtype=np.uint8)
+        for c, ((U, S, Vt), canvas) in enumerate(zip(factors, canvases)):
+            canvas += (U[rows, start:k] * S[start:k]).astype(np.float32) @ \
+                Vt[start:k][:, cols].astype(np.float32)
+            np.clip(canvas, 0, 255, out=frame[:, :, c], casting="unsafe")
+        psnr = None
+        if energy is not None:
+            tail = energy - sum(float(np.sum(S[:k].astype(np.float64) ** 2)) for _, S, _ in factors)
+            psnr = 10 * np.log10(255.0 ** 2 / (max(tail, 0.0) / n_values + 1 / 12))
+        series.append((k, frame, psnr))
+        start = k
+    return series
+
+
+# 誤差熱度圖只用緊接在 k 之後的這麼多個捨去三元組（誤差能量集中在前段）
+HEATMAP_TAIL = 128
+# 熱度圖色階的上限：每像素 RMS 誤差（灰階值）
+HEATMAP_MAX_ERROR = 16.0
+
+
+def residual_energy_map(factors, k, rows, cols, tail=None, energies=None):
+    """捨去的三元組在取樣格點上的誤差能量（各通道的平方和）
+
+    A - A_k = U[:, k:]·diag(S[k:])·Vt[k:]，只取 rows、cols 上的值，
+    成本是 格點數 × 捨去的三元組數，與原圖解析度無關。
+    tail 只用 k 之後的前 tail 個換取速度。給了各通道原圖能量 energies 時，
+    全部捨去的能量 = ‖A‖²_F - ‖diag(S[:k])·Vt[:k]‖²_F（U 正交），即使因子
+    被截斷也已知，所以把算出的部分放大到這個總量，分布仍以前段為準。
+    """
+    energy = np.zeros((len(rows), len(cols)))
+    for c, (U, S, Vt) in enumerate(factors):
+        end = len(S) if tail is None else min(len(S), k + tail)
+        if end <= k:
+            continue
+        channel = np.square((U[rows, k:end] * S[k:end]) @ Vt[k:end][:, cols])
+        if energies is not None:
+            # 聯合模式的 Vt 只是一段，列不是單位向量，所以不能只用 S²
+            row_energy = S[:end] ** 2 * np.sum(np.square(Vt[:end], dtype=float), axis=1)
+            computed = row_energy[k:].sum()
+            if computed > 0:
+                channel *= max(energies[c] - row_energy[:k].sum(), 0.0) / computed
+        energy += channel
+    return energy
+
+
+def heatmap_overlay(frame, energy, max_error=HEATMAP_MAX_ERROR):
+    """把誤差能量畫成由黃到紅、越大越不透明的熱度圖，疊在 uint8 畫面 frame 上"""
+    level = np.clip(np.sqrt(energy / frame.shape[2]) / max_error, 0, 1)[:, :, None]
+    color = np.concatenate([np.full_like(level, 255), 255 * (1 - level), np.zeros_like(level)], axis=2)
+    alpha = 0.75 * level
+    base = np.repeat(frame, 3, axis=2) if frame.shape[2] == 1 else frame
+    return np.ascontiguousarray(base * (1 - alpha) + color * alpha, dtype=np.uint8)
+
+
+def calculate_psnr(original, compressed):
+    """計算 PSNR"""
+    if original.dtype == np.uint8 and compressed.dtype == np.uint8:
+        # 以 int16 相減、int32 平方，免去整張圖的 float64 暫存
+        diff = original.astype(np.int16) - compressed
+        mse = np.mean(np.square(diff, dtype=np.int32))
+    else:
+        mse = np.mean((original.astype(float) - compressed.astype(float)) ** 2)
+    if mse == 0:
+        return float('inf')
+    max_val = 255.0
+    psnr = 10 * np.log10((max_val ** 2) / mse)
+    return psnr
+
+
+def rank_for_ratio(max_rank, ratio):
+    """壓縮比例 (%) → k，與比例滑桿相同"""
+    k = int(max_rank * ratio / 100)
+    return max(1, min(k, max_rank))
+
+
+def rank_for_size(max_rank, original_size_mb, size_mb, size_model=None):
+    """目標大小 (MB) → k
+
+    有 SizeModel 時依預測的實際編碼大小選 k；否則退回未壓縮大小的線性對應。
+    """
+    if size_model is not None:
+        return size_model.rank_for_size(size_mb * 1024 * 1024, max_rank)
+    target_size = min(size_mb, original_size_mb)
+    return rank_for_ratio(max_rank, target_size / original_size_mb * 100)
+
+
+def rank_for_psnr(factors, psnr):
+    """達到目標 PSNR 的最小 k
+
+    依 Eckart-Young，捨去部分的誤差能量等於剩餘奇異值平方和，
+    不必重建就能估計每個 k 的 MSE（另加 uint8 量化的 1/12）。
+    """
+    max_rank = factors_max_rank(factors)
+    n_pixels = sum(U.shape[0] * Vt.shape[1] for U, _, Vt in factors)
+    tail = sum(
+        np.concatenate([np.cumsum((S[:max_rank] ** 2)[::-1])[::-1], [0.0]])
+        for _, S, _ in factors
+    )
+    mse = tail / n_pixels + 1 / 12
+    ok = np.nonzero(10 * np.log10(255.0 ** 2 / mse) >= psnr)[0]
+    k = ok[0] if len(ok) else max_rank
+    return max(1, min(int(k), max_rank))
+
+
+def resolve_target(target, max_rank, original_size_mb, psnr_rank, storage_rank=None):
+    """依目標 dict（rank / ratio / psnr / size_mb / template）決定 rank
+
+    psnr 交給 psnr_rank(psnr)；其餘先換算成逐通道的全域 k，有 storage_rank
+    時再由它換成同樣儲存量下該模式的 rank（分塊、聯合、共用基底）。
+    """
+    if "template" in target:
+        if target["template"] not in TEMPLATES:
+            raise ValueError(f"未知的模板：{target['template']}")
+        target = TEMPLATES[target["template"]]
+    if "psnr" in target:
+        return psnr_rank(float(target["psnr"]))
+
+    if "rank" in target:
+        k = max(1, min(int(target["rank"]), max_rank))
+    elif "ratio" in target:
+        k = rank_for_ratio(max_rank, float(target["ratio"]))
+    elif "size_mb" in target:
+        k = rank_for_size(max_rank, original_size_mb, float(target["size_mb"]))
+    else:
+        raise ValueError("需要指定 rank、ratio、psnr、size_mb 或 template")
+    return k if storage_rank is None else storage_rank(k)
+
+
+def rank_for_target(factors, original_size_mb, target):
+    """依目標 dict（rank / ratio / psnr / size_mb / template）決定 k"""
+    return resolve_target(target, factors_max_rank(factors), original_size_mb,
+                          lambda psnr: rank_for_psnr(factors, psnr))
+
+
+# ==================== 分塊 SVD ====================
+#
+# 把每個通道切成 size×size 的區塊，以 numpy 的堆疊 SVD 一次分解所有區塊。
+# 每個區塊依自己的奇異值能量與全域品質目標取不同的 rank：平坦區塊只留
+# 一兩個三元組，細節多的區塊留得多。成本是 區塊數 × size³，隨像素數線性
+# 成長；區塊彼此獨立，分批交給執行緒池（LAPACK 與 BLAS 都會釋放 GIL）。
+
+BLOCK_SIZES = (16, 32, 64, 128)
+BLOCK_BATCH = 512  # 每批最多幾個區塊
+
+
+def split_blocks(channel, size):
+    """(高, 寬) → ((區塊數, size, size), (列數, 欄數))，邊緣以複製填滿"""
+    height, width = channel.shape
+    padded = np.pad(channel, ((0, -height % size), (0, -width % size)), mode="edge")
+    grid = (padded.shape[0] // size, padded.shape[1] // size)
+    blocks = padded.reshape(grid[0], size, grid[1], size).swapaxes(1, 2)
+    return blocks.reshape(-1, size, size), grid
+
+
+def merge_blocks(blocks, grid, shape):
+    """split_blocks 的反向，裁掉填補的邊緣"""
+    size = blocks.shape[-1]
+    image = blocks.reshape(grid[0], grid[1], size, size).swapaxes(1, 2)
+    return image.reshape(grid[0] * size, grid[1] * size)[:shape[0], :shape[1]]
+
+
+def map_blocks(func, *arrays):
+    """沿第 0 軸分批平行執行 func，把每批結果依序接回"""
+    n = len(arrays[0])
+    batches = min(n, max(os.cpu_count() or 1, math.ceil(n / BLOCK_BATCH)))
+    bounds = np.linspace(0, n, batches + 1).astype(int)
+    chunks = [tuple(a[lo:hi] for a in arrays) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if len(chunks) == 1:
+        return func(*chunks[0])
+    with ThreadPoolExecutor(len(chunks)) as pool:
+        results = list(pool.map(lambda chunk: func(*chunk), chunks))
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+    return np.concatenate(results)
+
+
+class BlockSVD:
+    """整張圖片的分塊 SVD：每個通道一組堆疊的 (U, S, Vt)"""
+
+    def __init__(self, img_array, size=32):
+        self.size = size
+        self.shape = img_array.shape
+        self.factors = []
+        for c in range(img_array.shape[2]):
+            blocks, self.grid = split_blocks(img_array[:, :, c].astype(np.float32), size)
+            self.factors.append(map_blocks(
+                lambda b: np.linalg.svd(b, full_matrices=False), blocks
+            ))
+
+    @property
+    def n_blocks(self):
+        return self.grid[0] * self.grid[1]
+
+    def nbytes(self):
+        return sum(U.nbytes + S.nbytes + Vt.nbytes for U, S, Vt in self.factors)
+
+    def triplets_for_rank(self, k):
+        """與全域 rank k 相同儲存量（浮點數個數）可保留的區塊三元組總數"""
+        height, width, n_channels = self.shape
+        return k * (height + width + 1) * n_channels // (2 * self.size + 1)
+
+    def allocate(self, psnr=None, triplets=None):
+        """依全域目標分配各區塊的 rank，回傳每個通道的 (區塊數,) 陣列
+
+        捨去一個三元組使平方誤差增加 σ²，而每個三元組的儲存成本都一樣，
+        所以把所有區塊、所有通道的 σ² 放在一起由大到小保留就是最佳分配：
+        psnr 時保留到剩餘能量不超過誤差預算，triplets 時保留前 triplets 個。
+        """
+        energy = np.sort(np.concatenate([
+            (S.astype(np.float64) ** 2).ravel() for _, S, _ in self.factors
+        ]))[::-1]
+        if psnr is not None:
+            height, width, n_channels = self.shape
+            budget = (255.0 ** 2 / 10 ** (psnr / 10) - 1 / 12) * height * width * n_channels
+            tail = np.append(np.cumsum(energy[::-1])[::-1], 0.0)
+            keep = int(np.searchsorted(-tail, -max(budget, 0.0)))
+        else:
+            keep = int(triplets)
+        keep = max(0, min(keep, len(energy)))
+        threshold = energy[keep - 1] if keep else np.inf
+        return [np.count_nonzero(S.astype(np.float64) ** 2 >= threshold, axis=1)
+                for _, S, _ in self.factors]
+
+    def ranks_for_target(self, target):
+        """依目標 dict（rank / ratio / psnr / size_mb / template）分配各區塊的 rank
+
+        psnr 直接當誤差預算；其餘先換算成全域 rank k，再給相同的儲存量。
+        """
+        height, width, n_channels = self.shape
+        return resolve_target(
+            target, min(height, width), height * width * n_channels / (1024 * 1024),
+            lambda psnr: self.allocate(psnr=psnr),
+            lambda k: self.allocate(triplets=self.triplets_for_rank(k)),
+        )
+
+    def reconstruct(self, ranks):
+        """以批次矩陣乘法重建；各區塊只用自己的前 rank 個三元組"""
+        img_approx = np.empty(self.shape, dtype=np.uint8)
+        for c, ((U, S, Vt), rank) in enumerate(zip(self.factors, ranks)):
+            k = int(rank.max(initial=0))
+            weights = S[:, :k] * (np.arange(k) < rank[:, None])
+            blocks = map_blocks(
+                lambda U_b, w_b, Vt_b: (U_b * w_b[:, None, :]) @ Vt_b,
+                U[:, :, :k], weights, Vt[:, :k, :]
+            )
+            np.clip(merge_blocks(blocks, self.grid, self.shape[:2]), 0, 255,
+                    out=img_approx[:, :, c], casting="unsafe")
+        return img_approx
+
+    def stored_floats(self, ranks):
+        """保留的因子浮點數個數"""
+        return int(sum(rank.sum() for rank in ranks)) * (2 * self.size + 1)
+
+
+# ==================== 聯合色彩分解 ====================
+#
+# R、G、B 的邊緣通常對齊，三個通道各自的左奇異向量 U 高度重複。
+# 聯合模式把三個通道橫向並排成 高 × 3寬 的 [R | G | B] 一次分解：
+# 只有一個共用的 U，Vt 依欄切成三段就是各通道的權重。每個三元組
+# 存 高 + 3寬 + 1 個浮點數（逐通道則是 3 × (高 + 寬 + 1)），
+# 並排矩陣的殘差能量就是三個通道殘差的總和，Eckart-Young 估計照樣成立。
+
+JOINT_MODE = "joint"
+
+
+def joint_matrix(img_array):
+    """(高, 寬, 通道) → (高, 通道 × 寬) 的 [R | G | B]"""
+    height, width, n_channels = img_array.shape
+    return img_array.transpose(0, 2, 1).reshape(height, n_channels * width)
+
+
+def timed_svd(A):
+    """fast_svd 並回傳 ((U, S, Vt), 秒)；第一次遇到的大小先調校，不算進時間"""
+    if SVD_TUNER.choose(A, None) is None:
+        SVD_TUNER.tune(A, None)
+    start = time.perf_counter()
+    factors = fast_svd(A)
+    return factors, time.perf_counter() - start
+
+
+def energy_psnr(values, n_values):
+    """依 Eckart-Young 估計各通道都保留前 k 個三元組（k = 0..最短的長度）的 PSNR
+
+    values 是各通道的奇異值；捨去部分的誤差能量是各通道剩餘平方和的總和。
+    """
+    n = min(len(S) for S in values)
+    tail = sum(np.append(np.cumsum((S[:n] ** 2)[::-1])[::-1], 0.0) for S in values)
+    return 10 * np.log10(255.0 ** 2 / (tail / n_values + 1 / 12))
+
+
+class JointColorSVD:
+    """[R | G | B] 的一次 SVD：各通道共用 U，Vt 切成各通道的權重"""
+
+    def __init__(self, img_array):
+        self.shape = img_array.shape
+        self.factors, self.seconds = timed_svd(joint_matrix(img_array).astype(float))
+
+    @property
+    def max_rank(self):
+        return len(self.factors[1])
+
+    @property
+    def floats_per_triplet(self):
+        height, width, n_channels = self.shape
+        return height + n_channels * width + 1
+
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.factors)
+
+    def channel_factors(self):
+        """各通道的 (共用 U, S, 該通道的 Vt 段)，可直接交給 reconstruct_from_factors"""
+        U, S, Vt = self.factors
+        width = self.shape[1]
+        return [(U, S, Vt[:, c * width:(c + 1) * width]) for c in range(self.shape[2])]
+
+    def reconstruct(self, k):
+        return reconstruct_from_factors(self.channel_factors(), k)
+
+    def psnr(self):
+        """各 k 的估計 PSNR（k = 0..max_rank）"""
+        return energy_psnr([self.factors[1]], math.prod(self.shape))
+
+    def rank_for_storage(self, k):
+        """與逐通道 rank k 相同儲存量可保留的聯合三元組數"""
+        height, width, n_channels = self.shape
+        stored = k * n_channels * (height + width + 1)
+        return max(1, min(stored // self.floats_per_triplet, self.max_rank))
+
+    def rank_for_target(self, target):
+        """依目標 dict（rank / ratio / psnr / size_mb / template）決定聯合 rank
+
+        psnr 直接依聯合的奇異值；其餘先換算成逐通道的 k，再給相同的儲存量。
+        """
+        def psnr_rank(psnr):
+            k = int(np.searchsorted(self.psnr(), psnr))
+            return max(1, min(k, self.max_rank))
+
+        height, width, n_channels = self.shape
+        return resolve_target(target, min(height, width),
+                              height * width * n_channels / (1024 * 1024),
+                              psnr_rank, self.rank_for_storage)
+
+    def compare(self, k, separate_values, separate_seconds):
+        """與逐通道 SVD 在相同 PSNR 下比較：回傳 dict
+
+        separate_values 是各通道完整的奇異值；逐通道取達到聯合 rank k
+        同樣 PSNR 的最小 rank，再比較兩邊要存的浮點數與分解時間。
+        """
+        height, width, n_channels = self.shape
+        psnr = self.psnr()[min(k, self.max_rank)]
+        separate_psnr = energy_psnr(separate_values, math.prod(self.shape))
+        separate_k = min(int(np.searchsorted(separate_psnr, psnr)), len(separate_psnr) - 1)
+        return {
+            "psnr": float(psnr),
+            "joint_rank": k,
+            "joint_floats": k * self.floats_per_triplet,
+            "joint_seconds": self.seconds,
+            "separate_rank": separate_k,
+            "separate_floats": separate_k * n_channels * (height + width + 1),
+            "separate_seconds": separate_seconds,
+        }
+
+
+# ==================== 共用基底 ====================
+#
+# 相似的圖片（掃描表單、數字小圖、同背景的商品照）逐張做 SVD 會重複幾乎
+# 相同的工作、存下幾乎相同的基底。集合模式把抽樣圖片切成 size×size 的
+# 小塊，以增量 PCA 學出共用基底：每張圖片只累加小塊的總和與 Gram 矩陣
+# (size² × size²)，小塊本身不必留著，最後對共變異數做一次特徵分解。
+# 之後每張新圖片只要一次矩陣乘法算出係數；基底在最高 rank 仍達不到
+# 品質門檻時，由呼叫端退回逐張 SVD。
+
+BASIS_PATCH = 16
+BASIS_RANK = 64
+BASIS_MIN_PSNR = 30.0  # 沒有指定 PSNR 時，低於此值就退回逐張 SVD
+
+
+class SharedBasis:
+    """從一組圖片的小塊學出的截斷正交基底（各通道共用）"""
+
+    def __init__(self, patch=BASIS_PATCH, mean=None, basis=None, singular_values=None):
+        self.patch = patch
+        self.mean = mean                        # (patch², )
+        self.basis = basis                      # (patch², rank)，各欄正交
+        self.singular_values = singular_values  # 學習時的奇異值
+        # 增量 PCA 的累加量
+        self.count = 0
+        self.total = np.zeros(patch * patch)
+        self.gram = np.zeros((patch * patch, patch * patch))
+
+    @property
+    def rank(self):
+        return self.basis.shape[1]
+
+    @classmethod
+    def fit(cls, images, patch=BASIS_PATCH, rank=BASIS_RANK):
+        """從圖片（可迭代的 (高, 寬, 通道) 陣列，可以是產生器）學出基底"""
+        shared = cls(patch)
+        for img_array in images:
+            shared.partial_fit(img_array)
+        return shared.finalize(rank)
+
+    def partial_fit(self, img_array):
+        """累加一張圖片各通道小塊的總和與 Gram 矩陣"""
+        for c in range(img_array.shape[2]):
+            blocks, _ = split_blocks(img_array[:, :, c], self.patch)
+            vectors = blocks.reshape(len(blocks), -1).astype(np.float64)
+            self.count += len(vectors)
+            self.total += vectors.sum(axis=0)
+            self.gram += vectors.T @ vectors
+
+    def finalize(self, rank=BASIS_RANK):
+        """由累加量算出平均與前 rank 個主成分"""
+        if self.count == 0:
+            raise ValueError("需要至少一張圖片")
+        mean = self.total / self.count
+        covariance = self.gram - self.count * np.outer(mean, mean)
+        w, V = np.linalg.eigh(covariance)
+        rank = min(rank, len(w))
+        w, V = w[::-1][:rank], V[:, ::-1][:, :rank]
+        self.mean = mean.astype(np.float32)
+        self.basis = np.ascontiguousarray(V, dtype=np.float32)
+        self.singular_values = np.sqrt(np.clip(w, 0, None)).astype(np.float32)
+        return self
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, patch=self.patch, mean=self.mean, basis=self.basis,
+                     singular_values=self.singular_values)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data["patch"]), data["mean"], data["basis"], data["singular_values"])
+
+    def encode(self, img_array):
+        """投影到基底：回傳 (每個通道的係數 (區塊數, rank), 每個通道的置中能量, 區塊格數)"""
+        coefficients, energies = [], []
+        for c in range(img_array.shape[2]):
+            blocks, grid = split_blocks(img_array[:, :, c].astype(np.float32), self.patch)
+            centered = blocks.reshape(len(blocks), -1) - self.mean
+            coefficients.append(centered @ self.basis)
+            energies.append(float(np.einsum("ij,ij->", centered, centered, dtype=np.float64)))
+        return coefficients, energies, grid
+
+    def psnr_by_rank(self, coefficients, energies, shape):
+        """以前 r 個基底向量重建時的 PSNR（r = 0..rank），不必真的重建
+
+        基底正交，捨去部分的能量 = 置中能量 − 已保留係數的平方和。
+        """
+        kept = sum(np.cumsum((coef.astype(np.float64) ** 2).sum(axis=0)) for coef in coefficients)
+        residual = np.maximum(sum(energies) - np.concatenate([[0.0], kept]), 0.0)
+        mse = residual / (shape[0] * shape[1] * shape[2]) + 1 / 12
+        return 10 * np.log10(255.0 ** 2 / mse)
+
+    def decode(self, coefficients, rank, grid, shape):
+        """係數 → (高, 寬, 通道) uint8，每個通道一次矩陣乘法"""
+        img_approx = np.empty(shape, dtype=np.uint8)
+        for c, coef in enumerate(coefficients):
+            blocks = coef[:, :rank] @ self.basis[:, :rank].T + self.mean
+            blocks = blocks.reshape(-1, self.patch, self.patch)
+            np.clip(merge_blocks(blocks, grid, shape[:2]), 0, 255,
+                    out=img_approx[:, :, c], casting="unsafe")
+        return img_approx
+
+    def rank_for_target(self, coefficients, energies, grid, shape, target):
+        """依目標 dict 選基底 rank；PSNR 在最高 rank 仍達不到門檻時回傳 None
+
+        rank / ratio / size_mb 換算成與全域 rank k 相同的儲存量（係數個數）。
+        """
+        psnr = self.psnr_by_rank(coefficients, energies, shape)
+
+        def psnr_rank(target_psnr):
+            ok = np.nonzero(psnr >= target_psnr)[0]
+            return int(ok[0]) if len(ok) else None
+
+        def storage_rank(k):
+            rank = max(1, min(self.rank, k * (height + width + 1) // (grid[0] * grid[1])))
+            return rank if psnr[rank] >= BASIS_MIN_PSNR else None
+
+        height, width, n_channels = shape
+        return resolve_target(target, min(height, width),
+                              height * width * n_channels / (1024 * 1024),
+                              psnr_rank, storage_rank)
+
+
+# 工作行程內已載入的基底：路徑 → (修改時間, SharedBasis)
+_loaded_bases = {}
+
+
+def load_shared_basis(path):
+    """載入（並快取）基底檔；檔案更新後重新載入"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _loaded_bases.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _loaded_bases[path] = (mtime, SharedBasis.load(path))
+    return cached[1]
+
+
+# ==================== 漸進式串流格式 ====================
+#
+# 檔頭之後依奇異值由大到小送出區段，每個區段含各通道的 S、
+# 量化後的 U 欄與 Vt 列（每個三元組各自一個縮放係數）。
+# 接收端每收到一段就把 U·diag(S)·Vt 累加到畫布上，
+# 前幾段（只佔總位元組的幾個百分比）就足以看出影像輪廓。
+
+STREAM_MAGIC = b"SVDP"
+STREAM_VERSION = 1
+# magic, version, 量化位元數, 通道數, 高, 寬, 最大 rank, 總位元組
+STREAM_HEADER = struct.Struct("<4sBBBxIIIQ")
+# 起始 rank, 本段三元組數
+STREAM_CHUNK_HEADER = struct.Struct("<II")
+STREAM_READ_SIZE = 64 * 1024
+STREAM_DTYPES = {8: np.dtype("<i1"), 16: np.dtype("<i2")}
+
+
+def stream_chunk_schedule(k, max_chunk=32):
+    """區段切分：1, 1, 2, 4, ... 倍增，最多 max_chunk 個三元組一段"""
+    start, count = 0, 1
+    while start < k:
+        count = min(count, k - start)
+        yield start, count
+        start += count
+        if start > 1:
+            count = min(count * 2, max_chunk)
+
+
+def stream_chunk_size(n_channels, height, width, count, bits):
+    """單一區段的位元組數"""
+    itemsize = STREAM_DTYPES[bits].itemsize
+    per_channel = 3 * 4 * count + itemsize * count * (height + width)
+    return STREAM_CHUNK_HEADER.size + n_channels * per_channel
+
+
+def _quantize_rows(rows, bits):
+    """逐列對稱量化，回傳 (量化值, 縮放係數)"""
+    qmax = 2 ** (bits - 1) - 1
+    scale = np.abs(rows).max(axis=1) / qmax
+    scale[scale == 0] = 1.0
+    q = np.rint(rows / scale[:, None]).astype(STREAM_DTYPES[bits])
+    return q, scale.astype("<f4")
+
+
+def iter_progressive_stream(factors, k=None, bits=8, max_chunk=32):
+    """將 [(U, S, Vt), ...] 編碼成漸進式串流，逐段產生 bytes"""
+    if bits not in STREAM_DTYPES:
+        raise ValueError(f"不支援的量化位元數：{bits}")
+
+    height, width = factors[0][0].shape[0], factors[0][2].shape[1]
+    max_rank = factors_max_rank(factors)
+    k = max_rank if k is None else max(1, min(k, max_rank))
+    schedule = list(stream_chunk_schedule(k, max_chunk))
+
+    total = STREAM_HEADER.size + sum(
+        stream_chunk_size(len(factors), height, width, count, bits)
+        for _, count in schedule
+    )
+    yield STREAM_HEADER.pack(
+        STREAM_MAGIC, STREAM_VERSION, bits, len(factors),
+        height, width, k, total
+    )
+
+    for start, count in schedule:
+        parts = [STREAM_CHUNK_HEADER.pack(start, count)]
+        for U, S, Vt in factors:
+            U_q, U_scale = _quantize_rows(U[:, start:start + count].T, bits)
+            Vt_q, Vt_scale = _quantize_rows(Vt[start:start + count, :], bits)
+            parts += [
+                S[start:start + count].astype("<f4").tobytes(),
+                U_scale.tobytes(), Vt_scale.tobytes(),
+                U_q.tobytes(), Vt_q.tobytes(),
+            ]
+        yield b"".join(parts)
+
+
+class ProgressiveStreamDecoder:
+    """逐段解碼漸進式串流，以累加方式更新重建影像"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bytes_received = 0
+        self.total_bytes = 0
+        self.rank = 0
+        self.max_rank = 0
+        self.bits = 8
+        self.n_channels = 0
+        self.height = 0
+        self.width = 0
+        self.canvas = None
+
+    def feed(self, data):
+        """送入新收到的位元組，回傳本次套用的區段數"""
+        self.buffer += data
+        self.bytes_received += len(data)
+
+        if self.canvas is None:
+            if len(self.buffer) < STREAM_HEADER.size:
+                return 0
+            self._read_header()
+
+        applied = 0
+        while len(self.buffer) >= STREAM_CHUNK_HEADER.size:
+            start, count = STREAM_CHUNK_HEADER.unpack_from(self.buffer)
+            size = stream_chunk_size(
+                self.n_channels, self.height, self.width, count, self.bits
+            )
+            if len(self.buffer) < size:
+                break
+            if start != self.rank:
+                raise ValueError("串流區段順序錯誤")
+            payload = bytes(self.buffer[STREAM_CHUNK_HEADER.size:size])
+            del self.buffer[:size]
+            self._apply_chunk(payload, count)
+            applied += 1
+        return applied
+
+    def _read_header(self):
+        (magic, version, bits, n_channels,
+         height, width, max_rank, total) = STREAM_HEADER.unpack_from(self.buffer)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError("不是有效的漸進式串流")
+        if bits not in STREAM_DTYPES:
+            raise ValueError(f"不支援的量化位元數：{bits}")
+        del self.buffer[:STREAM_HEADER.size]
+
+        self.bits = bits
+        self.n_channels = n_channels
+        self.height = height
+        self.width = width
+        self.max_rank = max_rank
+        self.total_bytes = total
+        self.canvas = np.zeros((height, width, n_channels), dtype=np.float32)
+
+    def _apply_chunk(self, payload, count):
+        """把一個區段的秩一項累加到畫布上"""
+        dtype = STREAM_DTYPES[self.bits]
+        offset = 0
+
+        def take(dt, n):
+            nonlocal offset
+            arr = np.frombuffer(payload, dtype=dt, count=n, offset=offset)
+            offset += n * np.dtype(dt).itemsize
+            return arr
+
+        for c in range(self.n_channels):
+            S = take("<f4", count)
+            U_scale = take("<f4", count)
+            Vt_scale = take("<f4", count)
+            U_q = take(dtype, count * self.height).reshape(count, self.height)
+            Vt_q = take(dtype, count * self.width).reshape(count, self.width)
+
+            U_k = U_q.T.astype(np.float32) * (U_scale * S)
+            Vt_k = Vt_q.astype(np.float32) * Vt_scale[:, None]
+            self.canvas[:, :, c] += U_k @ Vt_k
+
+        self.rank += count
+
+    @property
+    def finished(self):
+        return self.canvas is not None and self.rank >= self.max_rank
+
+    def image(self):
+        """目前累積的影像 (uint8)"""
+        return np.clip(self.canvas, 0, 255).astype(np.uint8)
+
+
+# ==================== 近無失真格式 ====================
+#
+# 低 rank 基底 + 量化殘差：基底是 int8 量化的 U·√S 與 √S·Vt（每個三元組
+# 各自一個 2 的冪次縮放），與殘差一樣交給 zlib；殘差（原圖 − 基底）以
+# 2e+1 為步距量化、做空間預測後壓縮，解碼後每個像素與原圖的誤差保證
+# 不超過 e（e = 0 即為無失真）。縮放都是 2 的冪次、最大與最小冪次相差
+# 有上限，float64 矩陣乘法的所有部分和都是精確的，因此不論 BLAS 的
+# 加總順序，編碼端與解碼端得到的基底完全相同。
+
+RESIDUAL_MAGIC = b"SVDR"
+RESIDUAL_VERSION = 2
+# magic, version, 通道數, 每像素最大誤差, 空間預測方式, 高, 寬
+RESIDUAL_HEADER = struct.Struct("<4sBBBBII")
+# 每個通道：基底 rank
+RESIDUAL_CHANNEL_HEADER = struct.Struct("<I")
+# 同一通道各三元組乘積的 2 的冪次最多相差幾位（127² × rank 仍在 2^53 內）
+RESIDUAL_EXPONENT_SPAN = 28
+# 每段壓縮資料前的長度
+RESIDUAL_LENGTH = struct.Struct("<I")
+# 殘差的空間預測：不預測、左鄰、上鄰、左 + 上 − 左上（解碼都只是 cumsum）
+RESIDUAL_PREDICTORS = {0: "none", 1: "left", 2: "up", 3: "plane"}
+RESIDUAL_SEARCH_STEPS = 12  # 細找基底 rank 時最多做幾輪三分搜尋
+
+
+def quantize_base(U, S, Vt, k):
+    """前 k 個三元組 → (int8 的 U·√S, int8 的 √S·Vt, 兩者各三元組的 2 的冪次)
+
+    太小的三元組提高冪次（量化得更粗），讓乘積的冪次相差不超過
+    RESIDUAL_EXPONENT_SPAN。
+    """
+    root = np.sqrt(S[:k].astype(np.float64))
+    left = U[:, :k] * root
+    right = root[:, None] * Vt[:k]
+
+    def exponents(peaks):
+        return np.ceil(np.log2(np.maximum(peaks, 1e-30) / 127)).astype(np.int8)
+
+    left_exp = exponents(np.abs(left).max(axis=0, initial=0))
+    right_exp = exponents(np.abs(right).max(axis=1, initial=0))
+    floor = int((left_exp.astype(int) + right_exp).max(initial=0)) - RESIDUAL_EXPONENT_SPAN
+    left_exp += np.maximum(floor - (left_exp.astype(int) + right_exp), 0).astype(np.int8)
+    left_q = np.rint(left / power_of_two(left_exp))
+    right_q = np.rint(right / power_of_two(right_exp)[:, None])
+    return (np.clip(left_q, -127, 127).astype(np.int8),
+            np.clip(right_q, -127, 127).astype(np.int8), left_exp, right_exp)
+
+
+def power_of_two(exponents):
+    """int8 冪次 → float64 的 2^e（np.exp2 對 int8 會回傳 float16）"""
+    return np.exp2(exponents.astype(np.float64))
+
+
+def base_from_quantized(left, right, left_exp, right_exp):
+    """以精確的 float64 乘法重建基底 (int16, 0..255)；k = 0 時為全 0"""
+    if left.shape[1] == 0:
+        return np.zeros((left.shape[0], right.shape[1]), dtype=np.int16)
+    product = (left * power_of_two(left_exp)) @ (right * power_of_two(right_exp)[:, None])
+    return np.clip(np.rint(product), 0, 255).astype(np.int16)
+
+
+def pack_base(quantized):
+    """各通道量化後的基底 → 一段 zlib 壓縮資料（冪次、U·√S 依欄、√S·Vt 依列）"""
+    raw = b"".join(
+        left_exp.tobytes() + right_exp.tobytes() + left.T.tobytes() + right.tobytes()
+        for left, right, left_exp, right_exp in quantized
+    )
+    data = zlib.compress(raw, 6)
+    return RESIDUAL_LENGTH.pack(len(data)) + data
+
+
+def unpack_base(data, offset, ranks, height, width):
+    """pack_base 的反向，回傳 ([(left, right, left_exp, right_exp), ...], 讀完後的位移)"""
+    (length,) = RESIDUAL_LENGTH.unpack_from(data, offset)
+    offset += RESIDUAL_LENGTH.size
+    raw = np.frombuffer(zlib.decompress(data[offset:offset + length]), dtype=np.int8)
+    quantized, pos = [], 0
+    for k in ranks:
+        sizes = (k, k, k * height, k * width)
+        left_exp, right_exp, left_t, right = np.split(raw[pos:pos + sum(sizes)],
+                                                      np.cumsum(sizes)[:-1])
+        quantized.append((left_t.reshape(k, height).T, right.reshape(k, width),
+                          left_exp, right_exp))
+        pos += sum(sizes)
+    return quantized, offset + length
+
+
+def residual_indices(img_array, factors, k, max_error, rows=None, cols=None):
+    """基底 rank 為 k 時的殘差量化索引 (通道, 高, 寬)，還原誤差落在 ±max_error
+
+    給了 rows、cols 時只計算抽樣區塊。
+    """
+    sample = img_array if rows is None else img_array[np.ix_(rows, cols)]
+    indices = []
+    for c, (U, S, Vt) in enumerate(factors):
+        left, right, left_exp, right_exp = quantize_base(U, S, Vt, min(k, len(S)))
+        if rows is not None:
+            left, right = left[rows], right[:, cols]
+        base = base_from_quantized(left, right, left_exp, right_exp)
+        residual = sample[:, :, c].astype(np.int32) - base
+        indices.append(np.floor_divide(residual + max_error, 2 * max_error + 1))
+    return np.stack(indices)
+
+
+def predict_residual(indices, predictor):
+    """空間預測：回傳與預測值的差"""
+    if predictor in (1, 3):
+        indices = np.diff(indices, axis=2, prepend=0)
+    if predictor in (2, 3):
+        indices = np.diff(indices, axis=1, prepend=0)
+    return indices
+
+
+def unpredict_residual(diffs, predictor):
+    """predict_residual 的反向，整張圖一次以 cumsum 還原"""
+    if predictor in (2, 3):
+        diffs = np.cumsum(diffs, axis=1)
+    if predictor in (1, 3):
+        diffs = np.cumsum(diffs, axis=2)
+    return diffs
+
+
+def pack_residual(indices, predictor):
+    """預測後 zigzag 成 uint16，低、高位元組兩個平面各自壓縮
+
+    低位元組用 zlib 的 RLE 策略（快，且對雜訊般的殘差不比完整 LZ 差）；
+    高位元組幾乎全是 0，用預設策略壓到只剩極少位元組。
+    """
+    diffs = predict_residual(indices, predictor).astype(np.int32)
+    zigzag = ((diffs << 1) ^ (diffs >> 31)).astype("<u2")
+    parts = []
+    for plane, strategy in ((zigzag & 0xFF, zlib.Z_RLE), (zigzag >> 8, zlib.Z_DEFAULT_STRATEGY)):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 9, strategy)
+        data = compressor.compress(plane.astype(np.uint8).tobytes()) + compressor.flush()
+        parts += [RESIDUAL_LENGTH.pack(len(data)), data]
+    return b"".join(parts)
+
+
+def unpack_residual(data, offset, shape, predictor):
+    """pack_residual 的反向，回傳 (量化索引, 讀完後的位移)"""
+    planes = []
+    for _ in range(2):
+        (length,) = RESIDUAL_LENGTH.unpack_from(data, offset)
+        offset += RESIDUAL_LENGTH.size
+        raw = zlib.decompress(data[offset:offset + length])
+        planes.append(np.frombuffer(raw, dtype=np.uint8).reshape(shape))
+        offset += length
+    zigzag = planes[0].astype(np.int32) | (planes[1].astype(np.int32) << 8)
+    return unpredict_residual((zigzag >> 1) ^ -(zigzag & 1), predictor), offset
+
+
+def near_lossless_plan(img_array, factors, max_error, k=None):
+    """在抽樣區塊上估計總位元組，選出 (基底 rank, 空間預測方式)
+
+    k 為 None 時先以對數間距粗掃（含 k = 0，純殘差編碼），再在最佳點
+    兩側做三分搜尋；因子本身就比原圖大的 k 不必考慮。
+    """
+    height, width = img_array.shape[:2]
+    rows, cols = probe_indices(height), probe_indices(width)
+    scale = (height * width) / (len(rows) * len(cols))
+    limit = min(factors_max_rank(factors), height * width // (height + width))
+    cost = {}
+
+    def estimate(k):
+        if k not in cost:
+            indices = residual_indices(img_array, factors, k, max_error, rows, cols)
+            base_bytes = len(pack_base(
+                [quantize_base(U, S, Vt, min(k, len(S))) for U, S, Vt in factors]
+            )) if k else 0
+            cost[k] = min(
+                (base_bytes + len(pack_residual(indices, p)) * scale, p)
+                for p in RESIDUAL_PREDICTORS
+            )
+        return cost[k]
+
+    if k is not None:
+        return k, estimate(k)[1]
+
+    candidates = sorted({0, *np.geomspace(1, max(limit, 1), 8).astype(int).tolist()})
+    candidates = [k for k in candidates if k <= limit]
+    for k in candidates:
+        estimate(k)
+    best = min(cost, key=cost.get)
+    index = candidates.index(best)
+    low = candidates[max(index - 1, 0)]
+    high = candidates[min(index + 1, len(candidates) - 1)]
+    for _ in range(RESIDUAL_SEARCH_STEPS):
+        if high - low <= 2:
+            break
+        a, b = low + (high - low) // 3, high - (high - low) // 3
+        if estimate(a) <= estimate(b):
+            high = b
+        else:
+            low = a
+    for k in range(low, high + 1):
+        estimate(k)
+    best = min(cost, key=cost.get)
+    return best, cost[best][1]
+
+
+def encode_near_lossless(img_array, factors, max_error=2, k=None):
+    """編碼成 .svdr；k 為 None 時自動選總位元組最少的基底 rank"""
+    if not 0 <= max_error <= 127:
+        raise ValueError("每像素最大誤差需介於 0 到 127")
+    k, predictor = near_lossless_plan(img_array, factors, max_error, k)
+    height, width, n_channels = img_array.shape
+    parts = [RESIDUAL_HEADER.pack(RESIDUAL_MAGIC, RESIDUAL_VERSION, n_channels,
+                                  max_error, predictor, height, width)]
+    quantized = [quantize_base(U, S, Vt, min(k, len(S))) for U, S, Vt in factors]
+    parts += [RESIDUAL_CHANNEL_HEADER.pack(q[0].shape[1]) for q in quantized]
+    parts.append(pack_base(quantized))
+    indices = residual_indices(img_array, factors, k, max_error)
+    parts.append(pack_residual(indices, predictor))
+    return b"".join(parts)
+
+
+def decode_near_lossless(data):
+    """解碼 .svdr，回傳 (高, 寬, 通道) uint8 陣列"""
+    magic, version, n_channels, max_error, predictor, height, width = (
+        RESIDUAL_HEADER.unpack_from(data)
+    )
+    if magic != RESIDUAL_MAGIC or version != RESIDUAL_VERSION:
+        raise ValueError("不是 SVDR 檔案")
+    offset = RESIDUAL_HEADER.size
+    ranks = []
+    for _ in range(n_channels):
+        ranks.append(RESIDUAL_CHANNEL_HEADER.unpack_from(data, offset)[0])
+        offset += RESIDUAL_CHANNEL_HEADER.size
+    quantized, offset = unpack_base(data, offset, ranks, height, width)
+    bases = [base_from_quantized(*q) for q in quantized]
+    indices, _ = unpack_residual(data, offset, (n_channels, height, width), predictor)
+    restored = np.stack(bases) + indices * (2 * max_error + 1)
+    return np.ascontiguousarray(np.clip(restored, 0, 255).astype(np.uint8).transpose(1, 2, 0))
+
+
+# ==================== 編碼匯出 ====================
+
+# 格式代碼 → (顯示名稱, 副檔名, MIME)
+EXPORT_FORMATS = {
+    "png": ("PNG", ".png", "image/png"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WebP", ".webp", "image/webp"),
+    "svdp": ("SVD 因子 (漸進串流)", ".svdp", "application/x-svd-stream"),
+    "svdr": ("SVD 近無失真 (基底 + 殘差)", ".svdr", "application/x-svd-residual"),
+}
+JPEG_SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}
+
+
+def encode_image(img_array, fmt, options=None):
+    """以 Pillow 編碼成 png / jpeg / webp，回傳 bytes
+
+    options：png 用 level、optimize；jpeg 用 quality、subsampling、
+    optimize、progressive；webp 用 quality、lossless、method。
+    """
+    options = options or {}
+    buffer = io.BytesIO()
+    img = Image.fromarray(img_array[:, :, 0] if img_array.shape[2] == 1 else img_array)
+    if fmt == "png":
+        img.save(buffer, "PNG", compress_level=options.get("level", 6),
+                 optimize=options.get("optimize", False))
+    elif fmt == "jpeg":
+        img.save(buffer, "JPEG", quality=options.get("quality", 90),
+                 subsampling=JPEG_SUBSAMPLING[options.get("subsampling", "4:2:0")],
+                 optimize=options.get("optimize", False),
+                 progressive=options.get("progressive", False))
+    elif fmt == "webp":
+        img.save(buffer, "WEBP", quality=options.get("quality", 90),
+                 lossless=options.get("lossless", False),
+                 method=options.get("method", 4))
+    else:
+        raise ValueError(f"不支援的格式：{fmt}")
+    return buffer.getvalue()
+
+
+def export_rank(factors, k, fmt, options, path, frame=None, original=None):
+    """重建 rank k 並編碼寫檔，回傳 (k, 路徑, 位元組, 編碼毫秒)
+
+    svdr 由編碼器自行選基底 rank（需要原圖），回傳的 k 是選出的基底 rank。
+    """
+    if fmt == "svdp":
+        start = time.perf_counter()
+        data = b"".join(iter_progressive_stream(factors, k))
+    elif fmt == "svdr":
+        start = time.perf_counter()
+        data = encode_near_lossless(original, factors, options.get("max_error", 2))
+        k = RESIDUAL_CHANNEL_HEADER.unpack_from(data, RESIDUAL_HEADER.size)[0]
+    else:
+        if frame is None:
+            frame = reconstruct_from_factors(factors, k)
+        start = time.perf_counter()
+        data = encode_image(frame, fmt, options)
+    encode_ms = (time.perf_counter() - start) * 1000
+    with open(path, "wb") as f:
+        f.write(data)
+    return k, path, len(data), encode_ms
+
+
+SIZE_PROBE_GRID = 6      # 抽樣區塊為 6×6 格，每格取中央一塊
+SIZE_PROBE_TILE = 128    # 每塊邊長上限 (像素)
+SIZE_PROBE_RANKS = 8     # 探測的 rank 數（對數間距）
+SIZE_TOLERANCE = 0.03    # 實測與目標相差超過 3% 就重新選 k
+
+
+def probe_indices(n, grid=SIZE_PROBE_GRID, tile=SIZE_PROBE_TILE):
+    """把 n 切成 grid 格，每格取中央一段，回傳串接後的索引"""
+    cell = n // grid
+    length = min(tile, cell // 2)
+    if length < 8:
+        return np.arange(n)
+    offset = (cell - length) // 2
+    return np.concatenate([np.arange(i * cell + offset, i * cell + offset + length)
+                           for i in range(grid)])
+
+
+class SizeModel:
+    """預測某個格式在任意 k 的實際編碼大小
+
+    在幾個探測 rank 只重建抽樣區塊拼成的小圖並編碼，扣掉檔頭後依面積放大，
+    再以 log k 內插成曲線。拼接的接縫讓預測有偏差，但偏差在不同 k 之間
+    相當穩定，所以每次完整編碼的實測值都拿來校正鄰近的 k。
+    """
+
+    def __init__(self, original, fmt, options=None):
+        self.fmt = fmt
+        self.options = options or {}
+        self.original = original
+        self.full_rank = min(original.shape[:2])
+        self.rows = probe_indices(original.shape[0])
+        self.cols = probe_indices(original.shape[1])
+        self.scale = original.shape[0] * original.shape[1] / (len(self.rows) * len(self.cols))
+        blank = np.zeros((8, 8, original.shape[2]), dtype=np.uint8)
+        self.header = len(encode_image(blank, fmt, self.options))
+        self.probes = {}     # k → 抽樣估計的位元組
+        self.measured = {}   # k → 完整編碼的位元組
+        self.probed_rank = 0 # 探測時已分解的 rank
+
+    @property
+    def ready(self):
+        return bool(self.probes)
+
+    def sample_bytes(self, region):
+        data = encode_image(region, self.fmt, self.options)
+        return (len(data) - self.header) * self.scale + self.header
+
+    def probe(self, factors):
+        """在對數間距的 rank 上抽樣編碼；已分解的 rank 以外以原圖作為滿 rank 的端點
+
+        截斷分解延伸之後再呼叫，只補上新的探測點。
+        """
+        available = factors_max_rank(factors)
+        if available <= self.probed_rank:
+            return
+        probes = dict(self.probes)
+        for k in np.unique(np.geomspace(1, available, SIZE_PROBE_RANKS).astype(int)):
+            if int(k) not in probes:
+                region = reconstruct_region(factors, int(k), self.rows, self.cols)
+                probes[int(k)] = self.sample_bytes(region)
+        if self.full_rank not in probes:
+            probes[self.full_rank] = self.sample_bytes(self.original[np.ix_(self.rows, self.cols)])
+        self.probes = probes
+        self.probed_rank = available
+
+    def measure(self, factors, k, frame=None):
+        """完整編碼 rank k，記下實測大小並回傳"""
+        if frame is None:
+            frame = reconstruct_from_factors(factors, k)
+        self.measured[k] = len(encode_image(frame, self.fmt, self.options))
+        return self.measured[k]
+
+    def raw_predict(self, ks):
+        ranks = sorted(self.probes)
+        return np.interp(np.log(ks), np.log(ranks), [self.probes[k] for k in ranks])
+
+    def predict(self, ks):
+        """k（純量或陣列）→ 預測的編碼位元組"""
+        ks = np.asarray(ks, dtype=float)
+        if ks.ndim == 0:
+            k = int(ks)
+            if k in self.measured:
+                return float(self.measured[k])
+            return float(self.predict(ks[None])[0])
+        sizes = self.raw_predict(ks)
+        if self.measured:
+            # 校正比例在實測點之間以 log k 內插，範圍外沿用最近的實測點
+            ranks = sorted(self.measured)
+            ratios = [self.measured[k] / self.raw_predict([k])[0] for k in ranks]
+            sizes = sizes * np.interp(np.log(ks), np.log(ranks), ratios)
+        return sizes
+
+    def rank_for_size(self, size_bytes, max_rank):
+        """預測大小不超過 size_bytes 的最大 k（品質最好）；都超過時回傳 1"""
+        ks = np.arange(1, max_rank + 1)
+        ok = np.nonzero(self.predict(ks) <= size_bytes)[0]
+        return int(ks[ok[-1]]) if len(ok) else 1
+
+
+def rank_for_encoded_size(factors, original, fmt, size_mb, options=None, rounds=2):
+    """依實際編碼大小選 k：抽樣建模 → 選 k → 完整編碼校正 → 必要時再選一次"""
+    model = SizeModel(original, fmt, options)
+    model.probe(factors)
+    max_rank = factors_max_rank(factors)
+    target = size_mb * 1024 * 1024
+    k = model.rank_for_size(target, max_rank)
+    for _ in range(rounds):
+        size = model.measure(factors, k)
+        if abs(size - target) <= target * SIZE_TOLERANCE and size <= target:
+            break
+        retry = model.rank_for_size(target, max_rank)
+        if retry == k:
+            break
+        k = retry
+    return k
+
+
+# ==================== 壓縮服務 ====================
+#
+# 純 asyncio 的本機 HTTP 服務：
+#   POST /compress?rank=|ratio=|psnr=|size_mb=|template=&format=png|jpeg|webp|svdp
+#   POST /compress?format=svdr&max_error=e   近無失真，基底 rank 由編碼器決定
+#   加上 &block=16|32|64|128 時改用分塊 SVD，各區塊自適應 rank
+#   加上 &joint=1 時改用聯合色彩分解，三個通道共用 U
+#   以 serve --basis 啟動時，一般圖片格式先投影到共用基底
+#        本文為圖片檔，回傳壓縮結果，指標放在 X-SVD-* 標頭
+#   GET  /metrics  延遲與吞吐量 (JSON)
+# SVD 等 CPU 工作交給行程池；同時執行數與排隊數都有上限，
+# 排隊已滿時直接回 503，讓呼叫端退避重試。
+
+SERVICE_FORMATS = {code: mime for code, (_, _, mime) in EXPORT_FORMATS.items()}
+SERVICE_TARGET_KEYS = ("rank", "ratio", "psnr", "size_mb", "template")
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def compress_job(data, target, fmt):
+    """在工作行程中執行：解碼 → SVD → 重建 → 編碼，回傳 (內容, 指標)"""
+    start = time.perf_counter()
+    img_array = decode_image(data)
+    if "block" in target and fmt in ("png", "jpeg", "webp"):
+        return compress_blocks_job(img_array, target, fmt, start)
+    if "joint" in target and fmt in ("png", "jpeg", "webp"):
+        return compress_joint_job(img_array, target, fmt, start)
+    if "basis" in target:
+        if fmt in ("png", "jpeg", "webp"):
+            result = compress_basis_job(img_array, target, fmt, start)
+            if result is not None:
+                return result
+        # 基底表示不了這張圖片：退回逐張 SVD
+        target = {k: v for k, v in target.items() if k != "basis"}
+    factors = svd_channels(img_array)
+    # 只指定大小時，依實際編碼大小選 k
+    resolved = TEMPLATES.get(target.get("template"), target)
+    if fmt == "svdr":
+        body = encode_near_lossless(img_array, factors, int(target.get("max_error", 2)))
+        k = RESIDUAL_CHANNEL_HEADER.unpack_from(body, RESIDUAL_HEADER.size)[0]
+        compressed = decode_near_lossless(body)
+    elif fmt != "svdp" and list(resolved) == ["size_mb"]:
+        k = rank_for_encoded_size(factors, img_array, fmt, float(resolved["size_mb"]))
+    else:
+        k = rank_for_target(factors, img_array.nbytes / (1024 * 1024), target)
+
+    if fmt == "svdp":
+        compressed = reconstruct_from_factors(factors, k)
+        body = b"".join(iter_progressive_stream(factors, k))
+    elif fmt != "svdr":
+        compressed = reconstruct_from_factors(factors, k)
+        body = encode_image(compressed, fmt)
+
+    metrics = {
+        "rank": k,
+        "max_rank": factors_max_rank(factors),
+        "psnr": calculate_psnr(img_array, compressed),
+        "bytes": len(body),
+        "original_bytes": img_array.nbytes,
+        "compute_ms": (time.perf_counter() - start) * 1000,
+    }
+    return body, metrics
+
+
+def compress_blocks_job(img_array, target, fmt, start):
+    """compress_job 的分塊模式：不做整張 SVD，成本隨像素數線性成長"""
+    size = int(target["block"])
+    if size not in BLOCK_SIZES:
+        raise ValueError(f"區塊大小需為 {'、'.join(map(str, BLOCK_SIZES))} 之一")
+    blocks = BlockSVD(img_array, size)
+    ranks = blocks.ranks_for_target({k: v for k, v in target.items() if k != "block"})
+    compressed = blocks.reconstruct(ranks)
+    body = encode_image(compressed, fmt)
+    kept = np.concatenate(ranks)
+    metrics = {
+        "rank": int(kept.max()),
+        "max_rank": size,
+        "mean_rank": float(kept.mean()),
+        "blocks": blocks.n_blocks,
+        "stored_floats": blocks.stored_floats(ranks),
+        "psnr": calculate_psnr(img_array, compressed),
+        "bytes": len(body),
+        "original_bytes": img_array.nbytes,
+        "compute_ms": (time.perf_counter() - start) * 1000,
+    }
+    return body, metrics
+
+
+def compress_joint_job(img_array, target, fmt, start):
+    """compress_job 的聯合色彩模式：一次分解 [R | G | B]"""
+    joint = JointColorSVD(img_array)
+    k = joint.rank_for_target({k: v for k, v in target.items() if k != "joint"})
+    compressed = joint.reconstruct(k)
+    body = encode_image(compressed, fmt)
+    metrics = {
+        "rank": k,
+        "max_rank": joint.max_rank,
+        "stored_floats": k * joint.floats_per_triplet,
+        "psnr": calculate_psnr(img_array, compressed),
+        "bytes": len(body),
+        "original_bytes": img_array.nbytes,
+        "compute_ms": (time.perf_counter() - start) * 1000,
+    }
+    return body, metrics
+
+
+def compress_basis_job(img_array, target, fmt, start):
+    """compress_job 的集合模式：投影到共用基底，品質不足時回傳 None"""
+    basis = load_shared_basis(target["basis"])
+    coefficients, energies, grid = basis.encode(img_array)
+    rank = basis.rank_for_target(coefficients, energies, grid, img_array.shape,
+                                 {k: v for k, v in target.items() if k != "basis"})
+    if rank is None:
+        return None
+    compressed = basis.decode(coefficients, rank, grid, img_array.shape)
+    body = encode_image(compressed, fmt)
+    metrics = {
+        "rank": rank,
+        "max_rank": basis.rank,
+        "shared_basis": 1,
+        "psnr": calculate_psnr(img_array, compressed),
+        "bytes": len(body),
+        "original_bytes": img_array.nbytes,
+        "compute_ms": (time.perf_counter() - start) * 1000,
+    }
+    return body, metrics
+
+
+def latency_summary(samples):
+    """延遲樣本 (秒) → 百分位數 (ms)"""
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    ms = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": float(ms.mean())}
+
+
+async def read_http_message(reader):
+    """讀取一個 HTTP/1.1 訊息，回傳 (起始列, 標頭 dict)；連線結束時回傳 None
+
+    任何一列超過 StreamReader 的長度上限時，readline 會拋出 ValueError。
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return line.decode("latin-1").strip(), headers
+
+
+def content_length(headers):
+    """標頭中的 Content-Length（沒有時為 0）；不是非負整數時拋出 ValueError"""
+    length = int(headers.get("content-length", 0))
+    if length < 0:
+        raise ValueError("Content-Length 不可為負")
+    return length
+
+
+def http_response(status, body=b"", headers=None):
+    """組出 HTTP/1.1 回應"""
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+    for name, value in {**(headers or {}), "Content-Length": len(body)}.items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def json_response(status, payload):
+    body = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+    return http_response(status, body, {"Content-Type": "application/json; charset=utf-8"})
+
+
+class CompressionService:
+    """asyncio 本機 HTTP 壓縮服務，CPU 工作交給有上限的行程池"""
+
+    def __init__(self, workers=None, concurrency=None, queue_limit=64, max_body_mb=64,
+                 basis=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.basis = basis  # 共用基底檔；有指定時一般圖片格式先投影到基底
+        self.concurrency = concurrency or self.workers
+        self.queue_limit = queue_limit
+        self.max_body = int(max_body_mb * 1024 * 1024)
+        self.pool = None
+        self.slots = None
+
+        # 統計
+        self.started = time.monotonic()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=2048)
+        self.queue_waits = deque(maxlen=2048)
+        self.finish_times = deque(maxlen=8192)
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"壓縮服務：http://{host}:{port}"
+              f"（{self.workers} 個行程，同時 {self.concurrency} 件，排隊上限 {self.queue_limit}）")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        """處理一條連線上的請求（支援 keep-alive）"""
+        try:
+            while True:
+                try:
+                    message = await read_http_message(reader)
+                except ValueError:
+                    writer.write(json_response(431, {"error": "請求列或標頭過長"}))
+                    break
+                if message is None:
+                    break
+                request_line, headers = message
+                try:
+                    method, target, _ = request_line.split(" ", 2)
+                    length = content_length(headers)
+                except ValueError:
+                    writer.write(json_response(400, {"error": "請求格式錯誤"}))
+                    break
+                if length > self.max_body:
+                    writer.write(json_response(413, {"error": "圖片過大"}))
+                    break
+
+                body = await reader.readexactly(length)
+                writer.write(await self.dispatch(method, target, body))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/metrics":
+            return json_response(200, self.metrics())
+        if url.path != "/compress":
+            return json_response(404, {"error": f"找不到 {url.path}"})
+        if method != "POST":
+            return json_response(405, {"error": "請使用 POST"})
+
+        query = dict(urllib.parse.parse_qsl(url.query))
+        fmt = query.get("format", "png").lower()
+        target = {key: query[key] for key in SERVICE_TARGET_KEYS if key in query}
+        if fmt == "svdr":
+            target = {"max_error": query.get("max_error", 2)}
+        elif target and "block" in query:
+            target["block"] = query["block"]
+        elif target and query.get("joint") in ("1", "true"):
+            target["joint"] = True
+        elif target and self.basis is not None:
+            target["basis"] = self.basis
+        if fmt not in SERVICE_FORMATS:
+            return json_response(400, {"error": f"不支援的格式：{fmt}"})
+        if not target:
+            return json_response(400, {"error": "需要指定 " + "、".join(SERVICE_TARGET_KEYS)})
+        return await self.compress(body, target, fmt)
+
+    async def compress(self, body, target, fmt):
+        """排隊取得執行名額，再交給行程池"""
+        if self.waiting >= self.queue_limit:
+            self.rejected += 1
+            return http_response(503, b"", {"Retry-After": "1"})
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.queue_waits.append(time.monotonic() - start)
+        try:
+            loop = asyncio.get_running_loop()
+            payload, metrics = await loop.run_in_executor(
+                self.pool, compress_job, body, target, fmt
+            )
+        except ValueError as e:
+            self.failed += 1
+            return json_response(400, {"error": str(e)})
+        except Exception as e:
+            self.failed += 1
+            return json_response(500, {"error": str(e)})
+        finally:
+            self.active -= 1
+            self.slots.release()
+
+        now = time.monotonic()
+        self.completed += 1
+        self.latencies.append(now - start)
+        self.finish_times.append(now)
+
+        headers = {"Content-Type": SERVICE_FORMATS[fmt]}
+        headers.update({
+            f"X-SVD-{name.replace('_', '-').title()}": (
+                f"{value:.3f}" if isinstance(value, float) else value
+            )
+            for name, value in metrics.items()
+        })
+        return http_response(200, payload, headers)
+
+    def metrics(self):
+        """目前的延遲、吞吐量與排隊狀況"""
+        now = time.monotonic()
+        uptime = now - self.started
+        window = min(60.0, uptime) or 1.0
+        recent = sum(1 for t in self.finish_times if now - t <= window)
+        return {
+            "uptime_s": uptime,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "in_flight": self.active,
+            "queued": self.waiting,
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "throughput_rps": self.completed / uptime if uptime else 0.0,
+            "recent_rps": recent / window,
+            "latency_ms": latency_summary(self.latencies),
+            "queue_wait_ms": latency_summary(self.queue_waits),
+        }
+
+
+async def run_load(url, image_bytes, total, concurrency):
+    """以 concurrency 條 keep-alive 連線送出 total 個請求，回傳統計"""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    request = (
+        f"POST {path} HTTP/1.1\r\n"
+        f"Host: {parts.netloc}\r\n"
+        f"Content-Type: application/octet-stream\r\n"
+        f"Content-Length: {len(image_bytes)}\r\n\r\n"
+    ).encode("latin-1") + image_bytes
+
+    remaining = total
+    statuses = Counter()
+    latencies = []
+
+    async def client():
+        nonlocal remaining
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                status_line, headers = await read_http_message(reader)
+                await reader.readexactly(content_length(headers))
+                latencies.append(time.perf_counter() - start)
+                statuses[int(status_line.split(" ", 2)[1])] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "elapsed_s": elapsed,
+        "rps": total / elapsed,
+        "ok_rps": statuses[200] / elapsed,
+        "statuses": dict(statuses),
+        "latency_ms": latency_summary(latencies),
+    }
+
+
+# ==================== 監看資料夾 ====================
+#
+# 長時間執行的批次模式：輪詢來源資料夾，新出現或內容有變的圖片在大小與
+# 修改時間穩定後才送進有上限的行程池處理（與壓縮服務共用 compress_job）。
+# 清單檔記錄每個檔案的內容雜湊與設定，重新啟動時已完成的直接略過。
+
+WATCH_MANIFEST = ".svd_manifest.json"
+WATCH_SNAPSHOT_EVERY = 5.0  # 清單檔最多每幾秒寫一次
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def watch_job(path, output_path, target, fmt, known_digest=None):
+    """在工作行程中執行：內容沒變就略過，否則壓縮並原子寫出"""
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = file_digest(data)
+    if digest == known_digest:
+        return digest, None
+    body, metrics = compress_job(data, target, fmt)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # 先寫暫存檔再改名，中斷時不會留下寫一半的輸出
+    tmp = f"{output_path}.{os.getpid()}.part"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, output_path)
+    metrics["input_bytes"] = len(data)
+    return digest, metrics
+
+
+class FolderWatcher:
+    """監看資料夾，增量、可續跑地壓縮新圖片
+
+    檔案的狀態依序是：未穩定（pending）→ 待處理（ready）→ 執行中
+    （in_flight）→ 記入清單。送進行程池的工作數不超過 workers × 2，
+    其餘只以路徑排隊，一次湧入上千個檔案時記憶體也不會跟著膨脹。
+    """
+
+    def __init__(self, source, output, target, fmt="png", workers=None,
+                 interval=1.0, settle=2.0, report=10.0):
+        self.source = os.path.abspath(source)
+        self.output = os.path.abspath(output)
+        self.target = target
+        self.fmt = fmt
+        self.workers = workers or os.cpu_count() or 1
+        self.interval = interval
+        self.settle = settle
+        self.report_every = report
+        # 設定不同（目標或格式改了）時，清單內的紀錄視為過期
+        self.settings = json.dumps({"target": target, "format": fmt}, sort_keys=True)
+
+        self.manifest_path = os.path.join(self.output, WATCH_MANIFEST)
+        self.manifest = {}
+        self.pending = {}       # 路徑 → (大小, 修改時間, 首次看到此狀態的時間)
+        self.ready = deque()
+        self.queued = set()
+        self.in_flight = {}     # future → (路徑, 大小, 修改時間)
+
+        # 統計
+        self.started = time.monotonic()
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.input_bytes = 0
+        self.finish_times = deque(maxlen=8192)
+        self.dirty = False
+        self.last_snapshot = 0.0
+        self.last_report = 0.0
+
+    # ---- 清單檔 ----
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def save_manifest(self, force=False):
+        now = time.monotonic()
+        if not self.dirty or (not force and now - self.last_snapshot < WATCH_SNAPSHOT_EVERY):
+            return
+        os.makedirs(self.output, exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.manifest}, f, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+        self.dirty = False
+        self.last_snapshot = now
+
+    def is_done(self, rel, size, mtime):
+        """大小、修改時間與設定都和清單相同就不必再讀檔（失敗的檔案也一樣，改過才重試）"""
+        entry = self.manifest.get(rel)
+        return (entry is not None and entry["settings"] == self.settings
+                and entry["size"] == size and entry["mtime"] == mtime)
+
+    def output_path(self, rel):
+        stem = os.path.splitext(rel)[0]
+        return os.path.join(self.output, stem + EXPORT_FORMATS[self.fmt][1])
+
+    # ---- 掃描 ----
+
+    def iter_images(self):
+        """遞迴列出來源中的圖片（略過隱藏檔與輸出資料夾）"""
+        stack = [self.source]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) != self.output:
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # 掃描途中被刪除
+                    yield entry.path, stat.st_size, stat.st_mtime_ns
+
+    def scan(self):
+        """把大小與修改時間已穩定 settle 秒的新檔案或變更檔案排入待處理"""
+        now = time.monotonic()
+        seen = set()
+        for path, size, mtime in self.iter_images():
+            rel = os.path.relpath(path, self.source)
+            seen.add(path)
+            if path in self.queued or self.is_done(rel, size, mtime):
+                self.pending.pop(path, None)
+                continue
+            previous = self.pending.get(path)
+            if previous is None or previous[:2] != (size, mtime):
+                # 第一次看到或還在寫入：重新計時
+                self.pending[path] = (size, mtime, now)
+            elif size > 0 and now - previous[2] >= self.settle:
+                del self.pending[path]
+                self.ready.append((path, size, mtime))
+                self.queued.add(path)
+        # 等待穩定期間被刪除的檔案不再追蹤
+        for path in self.pending.keys() - seen:
+            del self.pending[path]
+
+    # ---- 排程 ----
+
+    def submit(self, pool):
+        while self.ready and len(self.in_flight) < self.workers * 2:
+            path, size, mtime = self.ready.popleft()
+            rel = os.path.relpath(path, self.source)
+            entry = self.manifest.get(rel)
+            known = entry.get("digest") if entry and entry["settings"] == self.settings else None
+            future = pool.submit(
+                watch_job, path, self.output_path(rel), self.target, self.fmt, known
+            )
+            self.in_flight[future] = (path, size, mtime)
+
+    def collect(self, timeout):
+        """最多等 timeout 秒，收回已完成的工作並記入清單"""
+        done, _ = wait_futures(self.in_flight, timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            path, size, mtime = self.in_flight.pop(future)
+            self.queued.discard(path)
+            rel = os.path.relpath(path, self.source)
+            entry = {"settings": self.settings, "size": size, "mtime": mtime}
+            try:
+                digest, metrics = future.result()
+            except Exception as e:
+                # 記下失敗，檔案沒變就不再重試
+                self.failed += 1
+                print(f"失敗：{rel}：{e}")
+                entry["error"] = str(e)
+                self.manifest[rel] = entry
+                self.dirty = True
+                continue
+            entry["digest"] = digest
+            if metrics is None:
+                # 只是被 touch 過，內容沒變
+                self.skipped += 1
+                entry.update({k: v for k, v in self.manifest.get(rel, {}).items()
+                              if k not in entry})
+            else:
+                self.completed += 1
+                self.input_bytes += metrics["input_bytes"]
+                self.finish_times.append(time.monotonic())
+                entry.update(rank=metrics["rank"], psnr=round(metrics["psnr"], 3),
+                             bytes=metrics["bytes"])
+            self.manifest[rel] = entry
+            self.dirty = True
+
+    def stats(self):
+        """佇列深度與吞吐量"""
+        now = time.monotonic()
+        uptime = now - self.started
+        window = min(60.0, uptime) or 1.0
+        recent = sum(1 for t in self.finish_times if now - t <= window)
+        return {
+            "pending": len(self.pending),
+            "ready": len(self.ready),
+            "in_flight": len(self.in_flight),
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "files_per_s": recent / window,
+            "mb_per_s": self.input_bytes / (1024 * 1024) / uptime if uptime else 0.0,
+        }
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_every:
+            return
+        self.last_report = now
+        s = self.stats()
+        print(f"等待穩定 {s['pending']}｜待處理 {s['ready']}｜執行中 {s['in_flight']}｜"
+              f"完成 {s['completed']}（略過 {s['skipped']}、失敗 {s['failed']}）｜"
+              f"{s['files_per_s']:.2f} 檔/s、{s['mb_per_s']:.2f} MB/s")
+
+    def run(self, once=False):
+        """輪詢直到中斷；once 時處理完目前的檔案就結束"""
+        self.load_manifest()
+        print(f"監看 {self.source} → {self.output}（{self.workers} 個行程，"
+              f"清單已有 {len(self.manifest)} 筆）")
+        next_scan = 0.0
+        with ProcessPoolExecutor(self.workers) as pool:
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= next_scan:
+                        self.scan()
+                        next_scan = now + self.interval
+                    self.submit(pool)
+                    if self.in_flight:
+                        self.collect(max(0.0, next_scan - time.monotonic()))
+                    elif once and not self.ready and not self.pending:
+                        break
+                    else:
+                        time.sleep(max(0.0, next_scan - time.monotonic()))
+                    self.save_manifest()
+                    self.report()
+            finally:
+                for future in self.in_flight:
+                    future.cancel()
+                self.save_manifest(force=True)
+                self.report(force=True)
+
+
+# ==================== 命令列 ====================
+
+def serve_stream(blocks, port, rate_kb=0):
+    """在 localhost 上把串流送給每個連入的檢視器"""
+    with socket.create_server(("127.0.0.1", port)) as server:
+        print(f"串流服務：127.0.0.1:{port}（Ctrl+C 結束）")
+        while True:
+            conn, addr = server.accept()
+            with conn:
+                try:
+                    for block in blocks:
+                        conn.sendall(block)
+                        if rate_kb:
+                            time.sleep(len(block) / (rate_kb * 1024))
+                except OSError as e:
+                    print(f"{addr} 中斷：{e}")
+
+
+def stream_command(args):
+    """stream 子命令：把圖片編碼成漸進式串流寫檔或送出"""
+    img_array = decode_image(args.image)
+    blocks = list(iter_progressive_stream(
+        svd_channels(img_array), args.rank, args.bits
+    ))
+    if args.output:
+        with open(args.output, "wb") as f:
+            for block in blocks:
+                f.write(block)
+        print(f"已寫入 {args.output}（{sum(map(len, blocks))} bytes）")
+    else:
+        serve_stream(blocks, args.port, args.rate)
+    return 0
+
+
+def serve_command(args):
+    """serve 子命令"""
+    service = CompressionService(args.workers, args.concurrency, args.queue,
+                                 basis=args.basis and os.path.abspath(args.basis))
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def loadgen_command(args):
+    """loadgen 子命令"""
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+    result = asyncio.run(run_load(args.url, image_bytes, args.requests, args.concurrency))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def watch_command(args):
+    """watch 子命令"""
+    target = {key: value for key in SERVICE_TARGET_KEYS
+              if (value := getattr(args, key)) is not None}
+    if args.format == "svdr":
+        target = {"max_error": 2 if args.max_error is None else args.max_error}
+    elif not target:
+        target = {"ratio": 50}
+    if args.block is not None and args.format != "svdr":
+        target["block"] = args.block
+    elif args.joint and args.format != "svdr":
+        target["joint"] = True
+    elif args.basis is not None and args.format != "svdr":
+        target["basis"] = os.path.abspath(args.basis)
+    watcher = FolderWatcher(args.source, args.output, target, args.format, args.workers,
+                            args.interval, args.settle, args.report)
+    # 以 SIGTERM 停止常駐程序時也先寫回清單檔
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    return 1 if watcher.failed else 0
+
+
+def iter_image_paths(paths):
+    """展開檔案與資料夾（遞迴）中的圖片路徑"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def basis_command(args):
+    """basis 子命令：從一組圖片學出共用基底"""
+    paths = list(iter_image_paths(args.images))
+    if not paths:
+        print("找不到圖片")
+        return 1
+    if args.sample and len(paths) > args.sample:
+        # 平均間隔抽樣，避免只取到同一批的檔案
+        paths = [paths[i] for i in np.linspace(0, len(paths) - 1, args.sample).astype(int)]
+    start = time.perf_counter()
+    basis = SharedBasis.fit((decode_image(path) for path in paths), args.patch, args.rank)
+    basis.save(args.output)
+    energy = basis.singular_values.astype(np.float64) ** 2
+    total = np.trace(basis.gram - basis.count * np.outer(basis.mean, basis.mean))
+    print(f"已寫入 {args.output}：{len(paths)} 張、{basis.count} 個 {args.patch}×{args.patch} "
+          f"小塊，rank {basis.rank} 涵蓋 {energy.sum() / total * 100:.2f}% 的能量"
+          f"（{time.perf_counter() - start:.1f} 秒）")
+    return 0
+
+
+def build_parser():
+    """命令列的子命令（stream、serve、loadgen、watch、basis）"""
+    parser = argparse.ArgumentParser(description="SVD 智慧影像壓縮工具")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    stream_parser = subparsers.add_parser("stream", help="輸出漸進式串流")
+    stream_parser.add_argument("image")
+    target = stream_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-o", "--output", help="寫入 .svdp 檔")
+    target.add_argument("--port", type=int, help="在 localhost 的連接埠上提供串流")
+    stream_parser.add_argument("--rank", type=int, default=None, help="最多送出的 k")
+    stream_parser.add_argument("--bits", type=int, choices=sorted(STREAM_DTYPES), default=8)
+    stream_parser.add_argument("--rate", type=float, default=0, help="限速 (KB/s)，0 為不限")
+    stream_parser.set_defaults(func=stream_command)
+    
+    serve_parser = subparsers.add_parser("serve", help="啟動本機 HTTP 壓縮服務")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--workers", type=int, default=None, help="行程數（預設為 CPU 數）")
+    serve_parser.add_argument("--concurrency", type=int, default=None, help="同時執行的請求上限")
+    serve_parser.add_argument("--queue", type=int, default=64, help="排隊上限，超過回 503")
+    serve_parser.add_argument("--basis", default=None, help="共用基底檔（basis 子命令產生）")
+    serve_parser.set_defaults(func=serve_command)
+    
+    load_parser = subparsers.add_parser("loadgen", help="對壓縮服務施壓並量測每秒請求數")
+    load_parser.add_argument("image")
+    load_parser.add_argument("--url", default="http://127.0.0.1:8765/compress?ratio=50")
+    load_parser.add_argument("-n", "--requests", type=int, default=100)
+    load_parser.add_argument("-c", "--concurrency", type=int, default=8)
+    load_parser.set_defaults(func=loadgen_command)
+
+    watch_parser = subparsers.add_parser("watch", help="監看資料夾並壓縮新圖片")
+    watch_parser.add_argument("source")
+    watch_parser.add_argument("output")
+    goal = watch_parser.add_mutually_exclusive_group()
+    goal.add_argument("--rank", type=int)
+    goal.add_argument("--ratio", type=float)
+    goal.add_argument("--psnr", type=float)
+    goal.add_argument("--size-mb", dest="size_mb", type=float)
+    goal.add_argument("--template", choices=sorted(TEMPLATES))
+    watch_parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="png")
+    watch_parser.add_argument("--max-error", dest="max_error", type=int, default=None,
+                              help="svdr 的每像素最大誤差（預設 2）")
+    watch_parser.add_argument("--block", type=int, choices=BLOCK_SIZES, default=None,
+                              help="改用分塊 SVD 的區塊大小")
+    watch_parser.add_argument("--joint", action="store_true",
+                              help="改用聯合色彩分解（三個通道共用 U）")
+    watch_parser.add_argument("--basis", default=None,
+                              help="共用基底檔；投影品質不足的圖片退回逐張 SVD")
+    watch_parser.add_argument("--workers", type=int, default=None, help="行程數（預設為 CPU 數）")
+    watch_parser.add_argument("--interval", type=float, default=1.0, help="輪詢間隔 (秒)")
+    watch_parser.add_argument("--settle", type=float, default=2.0,
+                              help="大小與修改時間不變多久才視為寫入完成 (秒)")
+    watch_parser.add_argument("--report", type=float, default=10.0, help="回報間隔 (秒)")
+    watch_parser.add_argument("--once", action="store_true", help="處理完現有檔案就結束")
+    watch_parser.set_defaults(func=watch_command)
+
+    basis_parser = subparsers.add_parser("basis", help="從一組相似的圖片學出共用基底")
+    basis_parser.add_argument("images", nargs="+", help="圖片檔或資料夾")
+    basis_parser.add_argument("-o", "--output", required=True, help="寫入的基底檔 (.npz)")
+    basis_parser.add_argument("--patch", type=int, default=BASIS_PATCH, help="小塊邊長")
+    basis_parser.add_argument("--rank", type=int, default=BASIS_RANK, help="保留的基底向量數")
+    basis_parser.add_argument("--sample", type=int, default=64,
+                              help="最多使用幾張圖片學習（0 為全部）")
+    basis_parser.set_defaults(func=basis_command)
+    return parser
+
+
+def main(argv=None):
+    """執行命令列子命令；沒有指定時印出說明（圖形介面在 SVD_app.py）"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())